@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+"""Benchmark the stages of hashing an image.
+
+This script should be run from the top level package directory, like this:
+
+  >> python -m benchmarks.bench_hash --output bench_output.json
+
+It builds synthetic images of several sizes, still or animated, encodes them, and then times
+each stage of hashing them with Hash.hash_image, for several sets of Hash parameters. The
+stage times are those measured by a HashStats object, so they are of the code which actually
+runs. The stages are:
+- decode: loading the pixels of each frame.
+- seek: seeking forward through the frames of an animation, up to the last key frame.
+- convert: converting a frame to a single plane of floats.
+- resize: resizing to the standard width and trimming the edges.
+- dct: computing the top-left block of the 2-D DCT of the core.
+- quantize: clamping and quantizing the top-left DCT coefficients.
+- digest: formatting the quantized coefficients and feeding them to the digest.
+- other: everything else, such as parsing the image header and formatting the digest.
+
+Results are written as JSON. When given the results of a previous run, via --baseline, the
+ratio of the time of each stage to the previous one is printed as well, to spot regressions.
+
+Depends on:
+- The Python Image Library
+- NumPy
+- SciPy, for the cases which use the 'fftpack' DCT backend
+"""
+
+import argparse
+import io
+import json
+import logging
+import platform
+import sys
+import timeit
+
+import numpy
+from PIL import Image
+try:
+    import scipy
+except ImportError:
+    scipy = None
+
+import sdhash
+
+
+_IMAGE_SIZES = [(256, 192), (1024, 768), (4000, 3000)]
+_FRAME_COUNTS = [1, 5, 20, 100]
+_ANIMATION_SIZE = (320, 240)
+_HASHER_PARAMS = [
+    {},
+    {'standard_width': 256, 'edge_width': 32},
+    {'dct_core_width': 8, 'dct_coeff_buckets': 64},
+    {'dct_backend': 'fftpack'},
+    {'dct_backend': 'fftpack', 'dct_core_width': 8, 'dct_coeff_buckets': 64},
+    ]
+_STAGES = ['decode', 'seek', 'convert', 'resize', 'dct', 'quantize', 'digest', 'other']
+
+
+def build_image(size, seed):
+    """Build a synthetic RGB image, made of a few low frequency waves and some noise."""
+    random = numpy.random.RandomState(seed)
+    (width, height) = size
+    ys = numpy.linspace(0, 1, height)[:, numpy.newaxis, numpy.newaxis]
+    xs = numpy.linspace(0, 1, width)[numpy.newaxis, :, numpy.newaxis]
+    mat = numpy.zeros((height, width, 3))
+    for _ in range(4):
+        (fy, fx) = random.uniform(0, 6, 2)
+        phase = random.uniform(0, 2 * numpy.pi, 3)
+        mat += 32 * numpy.sin(2 * numpy.pi * (fy * ys + fx * xs) + phase)
+    mat += 128 + random.normal(0, 8, mat.shape)
+    return Image.fromarray(numpy.uint8(numpy.clip(mat, 0, 255)), mode='RGB')
+
+
+def build_cases():
+    """Build the encoded test images, as a list of dicts with a name, frame count and data."""
+    cases = []
+
+    for size in _IMAGE_SIZES:
+        encoded = io.BytesIO()
+        build_image(size, 0).save(encoded, 'JPEG', quality=90)
+        cases.append({
+            'name': 'jpeg-%dx%d' % size,
+            'frames': 1,
+            'data': encoded.getvalue(),
+            })
+
+    for frame_count in _FRAME_COUNTS:
+        frames = [build_image(_ANIMATION_SIZE, seed).convert('P', palette=Image.ADAPTIVE)
+            for seed in range(frame_count)]
+        encoded = io.BytesIO()
+        frames[0].save(encoded, 'GIF', save_all=True, append_images=frames[1:])
+        cases.append({
+            'name': 'gif-%dx%d-%dframes' % (_ANIMATION_SIZE + (frame_count,)),
+            'frames': frame_count,
+            'data': encoded.getvalue(),
+            })
+
+    return cases
+
+
+def time_hash(hasher, data):
+    """Hash an encoded image once, timing each stage. Returns a dict from stage to seconds.
+
+    The hasher must have been created with a HashStats object, which is reset.
+    """
+    hasher.stats.reset()
+    start = timeit.default_timer()
+    hasher.hash_image(Image.open(io.BytesIO(data)))
+    seconds = timeit.default_timer() - start
+
+    latencies = hasher.stats.snapshot()['latencies']
+    timings = dict((stage, latencies[stage]['total_seconds'] if stage in latencies else 0.0)
+        for stage in _STAGES if stage != 'other')
+    timings['other'] = max(0.0, seconds - sum(timings.values()))
+    return timings
+
+
+def run(repeats):
+    """Run all the benchmarks. Returns a list of results, one per case and hasher."""
+    results = []
+
+    for case in build_cases():
+        for params in _HASHER_PARAMS:
+            hasher = sdhash.Hash(stats=sdhash.HashStats(), **params)
+            runs = [time_hash(hasher, case['data']) for _ in range(repeats)]
+            stages = {}
+            for stage in _STAGES:
+                samples = sorted(r[stage] for r in runs)
+                stages[stage] = {
+                    'min': samples[0],
+                    'median': samples[len(samples) // 2],
+                    'mean': sum(samples) / len(samples),
+                    }
+            totals = sorted(sum(r.values()) for r in runs)
+            results.append({
+                'case': case['name'],
+                'frames': case['frames'],
+                'params': hasher.params,
+                'stages': stages,
+                'total': {'min': totals[0], 'median': totals[len(totals) // 2]},
+                })
+            logging.info('%s %s: %.2fms', case['name'], params, 1000 * totals[len(totals) // 2])
+
+    return results
+
+
+def compare(results, baseline):
+    """Print the ratio of median stage times to those from a baseline run."""
+    baseline_by_key = dict((_result_key(result), result) for result in baseline['results'])
+
+    for result in results:
+        previous = baseline_by_key.get(_result_key(result))
+        if previous is None:
+            continue
+        ratios = []
+        for stage in _STAGES + ['total']:
+            current_time = (result['total'] if stage == 'total' else result['stages'][stage])['median']
+            previous_time = (previous['total'] if stage == 'total' else previous['stages'][stage])['median']
+            if previous_time > 0:
+                ratios.append('%s=%.2fx' % (stage, current_time / previous_time))
+        sys.stdout.write('%s %s: %s\n' % (result['case'], _params_key(result['params']),
+            ' '.join(ratios)))
+
+
+def _result_key(result):
+    return (result['case'], _params_key(result['params']))
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stages of hashing an image.')
+    parser.add_argument('--repeats', type=int, default=5,
+        help='How many times to hash each image with each hasher.')
+    parser.add_argument('--output', default=None,
+        help='Where to write the JSON results. Defaults to stdout.')
+    parser.add_argument('--baseline', default=None,
+        help='JSON results of a previous run to compare against.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': numpy.__version__,
+            'scipy': scipy.__version__ if scipy is not None else None,
+            'pillow': getattr(Image, '__version__', getattr(Image, 'PILLOW_VERSION', None)),
+            'machine': platform.machine(),
+            },
+        'repeats': args.repeats,
+        'results': run(args.repeats),
+        }
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    if args.baseline is not None:
+        with open(args.baseline) as baseline:
+            compare(report['results'], json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""Benchmark the cost of starting up a process which uses SDHash.
+
+This script should be run from the top level package directory, like this:
+
+  >> python -m benchmarks.bench_import --output import_output.json
+
+Each scenario is run in a fresh Python process, several times. The wall time of the whole
+process and its peak resident set size are recorded. The scenarios are:
+- python: an empty Python process, as a baseline.
+- dependencies: importing NumPy and PIL, which SDHash always needs.
+- sdhash: importing SDHash and building a Hash with the default, NumPy, DCT backend.
+- sdhash-fftpack: as above, but with the 'fftpack' DCT backend, which imports SciPy.
+
+Depends on:
+- Linux or another POSIX system, for resource.getrusage.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import timeit
+
+
+_SCENARIOS = [
+    ('python', 'pass'),
+    ('dependencies', 'import numpy; import PIL.Image'),
+    ('sdhash', 'import sdhash; sdhash.Hash()'),
+    ('sdhash-fftpack', 'import sdhash; sdhash.Hash(dct_backend="fftpack")'),
+    ]
+
+# Reports the peak RSS of the process itself, in the units of ru_maxrss.
+_SCRIPT_TEMPLATE = '''
+import resource, sys
+{statements}
+sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+'''
+
+
+def time_scenario(statements):
+    """Run statements in a fresh process. Returns the wall time and the peak RSS, in KiB."""
+    script = _SCRIPT_TEMPLATE.format(statements=statements)
+    start = timeit.default_timer()
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=os.getcwd())
+    elapsed = timeit.default_timer() - start
+    max_rss = int(output.decode('ascii').strip())
+    # ru_maxrss is in bytes on macOS and in KiB everywhere else.
+    if platform.system() == 'Darwin':
+        max_rss //= 1024
+    return (elapsed, max_rss)
+
+
+def run(repeats):
+    """Run all the scenarios. Returns a list of results, one per scenario."""
+    results = []
+
+    for (name, statements) in _SCENARIOS:
+        runs = [time_scenario(statements) for _ in range(repeats)]
+        times = sorted(elapsed for (elapsed, _) in runs)
+        rss = sorted(max_rss for (_, max_rss) in runs)
+        results.append({
+            'scenario': name,
+            'statements': statements,
+            'wall_seconds': {'min': times[0], 'median': times[len(times) // 2]},
+            'max_rss_kib': {'min': rss[0], 'median': rss[len(rss) // 2]},
+            })
+        logging.info('%s: %.1fms, %dKiB', name, 1000 * times[len(times) // 2],
+            rss[len(rss) // 2])
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the startup cost of SDHash.')
+    parser.add_argument('--repeats', type=int, default=10,
+        help='How many times to run each scenario.')
+    parser.add_argument('--output', default=None,
+        help='Where to write the JSON results. Defaults to stdout.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            },
+        'repeats': args.repeats,
+        'results': run(args.repeats),
+        }
+
+    if args.output is not None:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
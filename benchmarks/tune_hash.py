@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+"""Sweep Hash parameters, and report the speed and accuracy of each set of them.
+
+This script should be run from the top level package directory, like this:
+
+  >> python -m benchmarks.tune_hash --standard-width 48,64,96,128 --output tune_output.json
+
+It cuts random crops out of the originals in ./tests/data, and applies to each of them the transformations which SDHash should see through, after those of
+./tests/gen_test_data.py: recompression as JPEG at several qualities and as GIF, gaussian
+noise, blurring, rescaling and conversion to grayscale. They are done with PIL rather than
+ImageMagick, so the results differ a little from those of the test data. Crops of the same
+original overlap, so they can't tell collisions from matches. The collisions are instead
+measured over independent images: the originals themselves, and images of random noise built
+by ./tests/util.py from distinct seeds. Then, for each combination of the swept parameters,
+it hashes all the encoded images, and reports:
+- images_per_second: how many images were hashed per second, decoding included, in the
+  fastest of the repeats.
+- resized_images_per_second: the same, counting only the time spent resizing, computing the
+  DCT and hashing, which is what the swept parameters change. Decoding and converting the
+  images to grayscale take the same time for all of them.
+- recall: the fraction of transformed images whose digest is that of their crop, overall and
+  per transformation.
+- collision_rate: the fraction of pairs of independent images whose digests are equal.
+
+The results are printed as a table, and written as JSON with --output. The default
+parameters are always included, and the report ends with the smallest standard width whose
+recall and collision rate are at least as good as those of the defaults.
+
+Depends on:
+- The Python Image Library
+- NumPy
+"""
+
+import argparse
+import glob
+import io
+import itertools
+import json
+import logging
+import platform
+import sys
+import timeit
+
+import numpy
+from PIL import Image, ImageFilter
+
+import sdhash
+import tests.util as util
+
+
+_ORIGINALS = './tests/data/*.original.png'
+_SWEPT_PARAMS = ['standard_width', 'edge_width', 'height_buckets', 'dct_core_width',
+    'dct_coeff_buckets']
+# The stages of HashStats whose cost depends on the swept parameters.
+_RESIZED_STAGES = ['resize', 'dct', 'quantize', 'digest']
+
+
+def _jpeg(quality):
+    return lambda im, random: _encode(im, 'JPEG', quality=quality)
+
+
+def _gif(im, random):
+    return _encode(im.convert('P', palette=Image.ADAPTIVE), 'GIF')
+
+
+def _noise(sigma):
+    def transform(im, random):
+        mat = numpy.asarray(im, dtype=numpy.float64)
+        mat = mat + random.normal(0, sigma, mat.shape)
+        return _encode(Image.fromarray(numpy.uint8(numpy.clip(mat, 0, 255)), mode=im.mode), 'PNG')
+    return transform
+
+
+def _blur(radius):
+    return lambda im, random: _encode(im.filter(ImageFilter.GaussianBlur(radius)), 'PNG')
+
+
+def _scale(factor):
+    def transform(im, random):
+        (width, height) = im.size
+        size = (max(1, int(round(width * factor))), max(1, int(round(height * factor))))
+        return _encode(im.resize(size, Image.LANCZOS), 'PNG')
+    return transform
+
+
+def _gray(im, random):
+    return _encode(im.convert('L'), 'PNG')
+
+
+TRANSFORMS = [
+    ('qual95', _jpeg(95)),
+    ('qual80', _jpeg(80)),
+    ('qual75', _jpeg(75)),
+    ('qual50', _jpeg(50)),
+    ('qual25', _jpeg(25)),
+    ('gif', _gif),
+    ('noise04', _noise(4)),
+    ('noise08', _noise(8)),
+    ('blur1', _blur(1)),
+    ('blur2', _blur(2)),
+    ('scale050x', _scale(0.5)),
+    ('scale150x', _scale(1.5)),
+    ('scale200x', _scale(2)),
+    ('scale300x', _scale(3)),
+    ('gray', _gray),
+    ]
+
+
+def build_images(originals, crops_per_original, seed):
+    """Cut random crops out of the originals, and transform each one.
+
+    Each crop keeps between half and all of the width and of the height of its original.
+
+    Returns:
+      A list of dicts, one per encoded image, with the index of the crop it was made from under
+      'crop', the name of the transformation under 'transform', which is None for the crop
+      itself, and the encoded image under 'data'.
+    """
+    random = numpy.random.RandomState(seed)
+    images = []
+    crop_idx = 0
+
+    for path in originals:
+        im = Image.open(path).convert('RGB')
+        (width, height) = im.size
+        for _ in range(crops_per_original):
+            (crop_width, crop_height) = (int(width * random.uniform(0.5, 1)),
+                int(height * random.uniform(0.5, 1)))
+            (left, top) = (random.randint(0, width - crop_width + 1),
+                random.randint(0, height - crop_height + 1))
+            im_crop = im.crop((left, top, left + crop_width, top + crop_height))
+            images.append({'crop': crop_idx, 'transform': None, 'data': _encode(im_crop, 'PNG')})
+            for (name, transform) in TRANSFORMS:
+                images.append({'crop': crop_idx, 'transform': name,
+                    'data': transform(im_crop, random)})
+            crop_idx += 1
+
+    return images
+
+
+def build_negatives(originals, count, seed):
+    """Build independent images, no two of which should have equal digests.
+
+    Those are the originals, and count images of random noise, each with its own seed and with
+    between 64 and 512 rows and columns.
+
+    Returns:
+      A list of encoded images.
+    """
+    random = numpy.random.RandomState(seed)
+    negatives = [_encode(Image.open(path).convert('RGB'), 'PNG') for path in originals]
+    for idx in range(count):
+        size = (random.randint(64, 513), random.randint(64, 513))
+        negatives.append(_encode(util.build_random_color_image(size, seed + idx), 'PNG'))
+    return negatives
+
+
+def evaluate(hasher, images, negatives, repeats):
+    """Hash all the images with a hasher, and measure its speed and accuracy.
+
+    Images which can't be hashed, such as those too short for the edges of the hasher, count
+    as misses.
+
+    Args:
+      hasher: the Hash object to evaluate. It must have a HashStats as its stats.
+      images: the images, as returned by build_images.
+      negatives: the independent images, as returned by build_negatives. They are hashed once,
+        after the timed repeats.
+      repeats: how many times to hash all the images.
+
+    Returns:
+      A dict with the params of the hasher, and its images_per_second,
+      resized_images_per_second, recall, recall_by_transform and collision_rate, as described
+      in the module docstring, the total seconds spent in each stage of hashing in the fastest
+      repeat under 'stage_seconds', and the number of images which could not be hashed under
+      'errors'.
+    """
+    best_seconds = None
+    for _ in range(repeats):
+        hasher.stats.reset()
+        start = timeit.default_timer()
+        digests = [_hash_data(hasher, image['data']) for image in images]
+        seconds = timeit.default_timer() - start
+        if best_seconds is None or seconds < best_seconds:
+            best_seconds = seconds
+            stage_seconds = dict((stage, latency['total_seconds']) for (stage, latency)
+                in hasher.stats.snapshot()['latencies'].items())
+
+    crop_digests = dict((image['crop'], digest) for (image, digest) in zip(images, digests)
+        if image['transform'] is None)
+    matches_by_transform = dict((name, []) for (name, _) in TRANSFORMS)
+    for (image, digest) in zip(images, digests):
+        if image['transform'] is not None:
+            matches_by_transform[image['transform']].append(
+                digest is not None and digest == crop_digests[image['crop']])
+    matches = list(itertools.chain.from_iterable(matches_by_transform.values()))
+
+    return {
+        'params': dict((name, hasher.params[name]) for name in _SWEPT_PARAMS),
+        'images_per_second': len(images) / best_seconds,
+        'resized_images_per_second': len(images) /
+            sum(stage_seconds.get(stage, 0.0) for stage in _RESIZED_STAGES),
+        'stage_seconds': stage_seconds,
+        'recall': float(sum(matches)) / len(matches),
+        'recall_by_transform': dict((name, float(sum(transform_matches)) / len(transform_matches))
+            for (name, transform_matches) in matches_by_transform.items()),
+        'collision_rate': _collision_rate([_hash_data(hasher, data) for data in negatives]),
+        'errors': sum(digest is None for digest in digests),
+        }
+
+
+def sweep(values_by_param, images, negatives, repeats):
+    """Evaluate every combination of parameter values, and the default parameters.
+
+    Combinations which Hash does not accept, such as edges wider than half the standard width,
+    are skipped.
+
+    Returns:
+      A list of results from evaluate, with the default parameters first.
+    """
+    defaults = sdhash.Hash().params
+    combinations = [dict((name, defaults[name]) for name in _SWEPT_PARAMS)]
+    for values in itertools.product(*[values_by_param[name] for name in _SWEPT_PARAMS]):
+        params = dict(zip(_SWEPT_PARAMS, values))
+        if params not in combinations:
+            combinations.append(params)
+
+    results = []
+    for params in combinations:
+        try:
+            hasher = sdhash.Hash(stats=sdhash.HashStats(), **params)
+        except AssertionError:
+            logging.warning('Skipping invalid parameters %s', _params_key(params))
+            continue
+        result = evaluate(hasher, images, negatives, repeats)
+        logging.info('%s: %.1f images/s, recall %.3f, collision rate %.5f, %d errors',
+            _params_key(params), result['images_per_second'], result['recall'],
+            result['collision_rate'], result['errors'])
+        results.append(result)
+
+    return results
+
+
+def recommend(results):
+    """Pick the result with the smallest standard width which is as accurate as the defaults.
+
+    That is, whose recall is at least, and whose collision rate at most, that of the first
+    result, which is for the default parameters. Ties are broken by speed.
+    """
+    baseline = results[0]
+    candidates = [result for result in results
+        if result['recall'] >= baseline['recall'] and
+            result['collision_rate'] <= baseline['collision_rate']]
+    return min(candidates,
+        key=lambda result: (result['params']['standard_width'], -result['images_per_second']))
+
+
+def print_report(results, best, stream):
+    """Print the results as a table, followed by the recommended parameters."""
+    stream.write('%5s %5s %7s %5s %7s %10s %10s %7s %10s\n' % ('width', 'edge', 'heights',
+        'core', 'coeffs', 'images/s', 'resized/s', 'recall', 'collisions'))
+    for result in results:
+        params = result['params']
+        stream.write('%5d %5d %7d %5d %7d %10.1f %10.1f %7.3f %10.5f\n' % (
+            params['standard_width'], params['edge_width'], params['height_buckets'],
+            params['dct_core_width'], params['dct_coeff_buckets'], result['images_per_second'],
+            result['resized_images_per_second'], result['recall'], result['collision_rate']))
+    stream.write('Smallest standard width as accurate as the defaults: %s\n' %
+        _params_key(best['params']))
+
+
+def _collision_rate(digests):
+    # Pairs of independent images with equal digests, out of all pairs. Images which could not
+    # be hashed collide with nothing.
+    digest_counts = {}
+    for digest in digests:
+        if digest is not None:
+            digest_counts[digest] = digest_counts.get(digest, 0) + 1
+
+    num_pairs = _pairs(len(digests))
+    num_collisions = sum(_pairs(count) for count in digest_counts.values())
+    return float(num_collisions) / num_pairs if num_pairs > 0 else 0.0
+
+
+def _pairs(count):
+    return count * (count - 1) // 2
+
+
+def _hash_data(hasher, data):
+    try:
+        return hasher.hash_image(Image.open(io.BytesIO(data)))
+    except Exception:
+        return None
+
+
+def _encode(im, image_format, **kwargs):
+    if image_format == 'PNG':
+        # Lossless either way, and much faster to write than with the default compression.
+        kwargs.setdefault('compress_level', 1)
+    encoded = io.BytesIO()
+    im.save(encoded, image_format, **kwargs)
+    return encoded.getvalue()
+
+
+def _params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def _int_list(text):
+    return [int(value) for value in text.split(',')]
+
+
+def main():
+    defaults = sdhash.Hash()
+    parser = argparse.ArgumentParser(
+        description='Sweep Hash parameters, and report the speed and accuracy of each set.')
+    parser.add_argument('--originals', default=_ORIGINALS,
+        help='A glob of the images to cut the crops out of.')
+    parser.add_argument('--crops', type=int, default=20,
+        help='How many crops to cut out of each original.')
+    parser.add_argument('--seed', type=int, default=0,
+        help='The seed of the crops, of the noise and of the negatives.')
+    parser.add_argument('--negatives', type=int, default=200,
+        help='How many images of random noise to measure the collisions over, besides the '
+            'originals.')
+    parser.add_argument('--repeats', type=int, default=3,
+        help='How many times to hash all the images with each set of parameters.')
+    parser.add_argument('--standard-width', type=_int_list, default=[48, 64, 96, 128, 256],
+        help='Comma separated values to sweep.')
+    parser.add_argument('--edge-width', type=_int_list, default=[8, defaults.edge_width],
+        help='Comma separated values to sweep.')
+    parser.add_argument('--height-buckets', type=_int_list, default=[defaults.height_buckets],
+        help='Comma separated values to sweep.')
+    parser.add_argument('--dct-core-width', type=_int_list, default=[defaults.dct_core_width],
+        help='Comma separated values to sweep.')
+    parser.add_argument('--dct-coeff-buckets', type=_int_list,
+        default=[defaults.dct_coeff_buckets], help='Comma separated values to sweep.')
+    parser.add_argument('--output', default=None,
+        help='Where to write the JSON results.')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    originals = sorted(glob.glob(args.originals))
+    if len(originals) == 0:
+        parser.error('No originals match %s' % args.originals)
+    images = build_images(originals, args.crops, args.seed)
+    negatives = build_negatives(originals, args.negatives, args.seed)
+    logging.info('Built %d images from %d originals, and %d negatives', len(images),
+        len(originals), len(negatives))
+
+    results = sweep(dict((name, getattr(args, name)) for name in _SWEPT_PARAMS), images,
+        negatives, args.repeats)
+    best = recommend(results)
+    print_report(results, best, sys.stdout)
+
+    if args.output is not None:
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': numpy.__version__,
+                'pillow': getattr(Image, '__version__', getattr(Image, 'PILLOW_VERSION', None)),
+                'machine': platform.machine(),
+                },
+            'originals': originals,
+            'crops': args.crops,
+            'negatives': args.negatives,
+            'seed': args.seed,
+            'transforms': [name for (name, _) in TRANSFORMS],
+            'results': results,
+            'recommended': best['params'],
+            }
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
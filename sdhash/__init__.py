@@ -1,11 +1,16 @@
 """Library for image hashing and deduplication."""
 
+import binascii
+import bisect
 import hashlib
 import math
+import timeit
 
 import numpy
 from PIL import Image
-import scipy.fftpack as fftpack
+
+import sdhash.dct
+import sdhash.resample
 
 
 class Hash(object):
@@ -14,9 +19,20 @@ class Hash(object):
     DCT_COEFF_MIN = -1024
     DCT_COEFF_MAX = 1023
     MAX_HEIGHT = 2048
+    DIGESTS = {'md5': 16, 'blake2b-64': 8, 'blake2b-128': 16}
+    DIGEST_FORMATS = frozenset(['hex', 'bytes', 'int'])
+    # The (left, top, right, bottom) fractions of the image which window_digests crops off. The
+    # set is the same under rotations and flips, as orientation_invariant needs.
+    WINDOW_CROPS = (
+        (0.05, 0, 0, 0), (0, 0.05, 0, 0), (0, 0, 0.05, 0), (0, 0, 0, 0.05),
+        (0.1, 0, 0, 0), (0, 0.1, 0, 0), (0, 0, 0.1, 0), (0, 0, 0, 0.1),
+        (0.05, 0.05, 0.05, 0.05),
+        )
 
     def __init__(self, standard_width=128, edge_width=16, key_frames=frozenset([0, 4, 9, 14, 19]),
-            height_buckets=256, dct_core_width=4, dct_coeff_buckets=128):
+            height_buckets=256, dct_core_width=4, dct_coeff_buckets=128, fast_decode=False,
+            dct_backend='numpy', digest='md5', digest_format='hex', orientation_invariant=False,
+            max_pixels=None, max_decoded_pixels=None, stats=None):
         """Create a Hash object.
 
         Args:
@@ -30,6 +46,46 @@ class Hash(object):
             the hash computations.
           dct_coeff_buckets: the quantization level for DCT coefficients from the top-left matrix
             of the DCT of the image.
+          fast_decode: whether to let the decoder shrink images while decoding them, down to about
+            twice the standard width, and decode straight to grayscale. Only JPEG images which
+            haven't been loaded yet are affected, and they are modified in place. Hashes are not
+            identical to the exact path. See the README for how often they differ.
+          dct_backend: how to compute the DCT. With 'numpy', only the top-left dct_core_width^2
+            coefficients are computed, as two small matrix products with cached cosine bases.
+            With 'fftpack', the full DCT of the image core is computed with scipy.fftpack, which
+            is imported at this point, as older versions of this library did. Both give the same
+            hashes, which the tests check over the real test images and their transforms.
+          digest: the hash function which produces the final digest, one of DIGESTS. With 'md5',
+            the quantized values are hashed as text, as older versions of this library did, and
+            digests are the same as theirs. With 'blake2b-64' or 'blake2b-128', which need Python
+            3.6 or later, BLAKE2b with an 8 or 16 byte digest is fed the quantized values of each
+            frame as a single buffer of little-endian int16s, which is cheaper to hash.
+          digest_format: how hash_image returns digests. With 'hex', as a string of hexadecimal
+            digits. With 'bytes', as the raw bytes of the digest. With 'int', as a non-negative
+            integer, built from the bytes of the digest in big-endian order. Raw bytes and
+            integers take about half the memory of hexadecimal strings.
+          orientation_invariant: whether to give the same digest to an image and to its rotations
+            by 90, 180 and 270 degrees, and its flips. Landscape frames are transposed to portrait
+            before the resize, so the cores of all the orientations are flips of one another,
+            and flips only change the signs of some DCT coefficients. Of the eight orientations
+            of the DCT, the one whose quantized values are the smallest, in lexicographic order,
+            is hashed. Digests differ from those made without it. Images over 16 times as tall
+            as wide are cropped to MAX_HEIGHT from the top, which breaks the invariance.
+          max_pixels: the most pixels of a frame which are converted to floats, at 4 bytes each,
+            and resized. Larger JPEG frames which haven't been loaded yet are shrunk by the
+            decoder, as with fast_decode. Frames which are still larger once decoded are shrunk
+            by the smallest whole factor which fits, with a box filter over a strip of rows at a
+            time, so no full size copy of them is made. Hashes of the frames which are shrunk
+            differ a little from the exact ones. When None, frames are never shrunk.
+          max_decoded_pixels: the most pixels of a frame which are decoded. Frames which are
+            larger, after any shrinking by the decoder, raise a ValueError before they are
+            decoded. Together with max_pixels, this bounds the memory used to hash a frame.
+            When None, there is no limit, beyond that of PIL.Image.MAX_IMAGE_PIXELS.
+          stats: an object which collects measurements of the work done while hashing, such as
+            a HashStats. It must have a record_time(stage, seconds) method, called with the time
+            spent in each stage of hashing, and an add(counter, amount) method, called to count
+            images, frames and pixels. When None, no measurements are made. The stats object is
+            not part of params, and is copied along with the Hash object to other processes.
         """
         assert standard_width > 0
         assert edge_width >= 0
@@ -41,6 +97,13 @@ class Hash(object):
         assert dct_core_width <= standard_width - 2 * edge_width
         assert dct_coeff_buckets > 0
         assert dct_coeff_buckets <= (self.DCT_COEFF_MAX - self.DCT_COEFF_MIN + 1)
+        assert dct_backend in sdhash.dct.BACKENDS
+        assert digest in self.DIGESTS
+        assert digest_format in self.DIGEST_FORMATS
+        assert max_pixels is None or max_pixels > 0
+        assert max_decoded_pixels is None or max_decoded_pixels > 0
+        if digest != 'md5' and not hasattr(hashlib, 'blake2b'):
+            raise ImportError('The %s digest needs hashlib.blake2b, from Python 3.6 or later' % digest)
 
         self._standard_width = standard_width
         self._edge_width = edge_width
@@ -51,6 +114,22 @@ class Hash(object):
         self._dct_coeff_buckets = dct_coeff_buckets
         self._dct_coeff_split = float(self.DCT_COEFF_MAX - self.DCT_COEFF_MIN + 1) / dct_coeff_buckets
         self._lower_bound_fp_rate = 1.0 / (dct_core_width * dct_core_width * dct_coeff_buckets)
+        self._fast_decode = fast_decode
+        self._dct_backend = dct_backend
+        self._dct2 = sdhash.dct.load_backend(dct_backend)
+        self._digest = digest
+        self._digest_format = digest_format
+        self._orientation_invariant = orientation_invariant
+        self._max_pixels = max_pixels
+        self._max_decoded_pixels = max_decoded_pixels
+        self._stats = stats
+        self._height_bits = height_buckets.bit_length()
+        self._coeff_min = int(self.DCT_COEFF_MIN / self._dct_coeff_split)
+        self._coeff_bits = (int(self.DCT_COEFF_MAX / self._dct_coeff_split) - self._coeff_min).bit_length()
+        self._signature_bits = self._height_bits + dct_core_width * dct_core_width * self._coeff_bits
+        # The text which the 'md5' digest hashes for each possible quantized coefficient.
+        self._coeff_texts = [('%s%04d' % ('+' if coeff >= 0 else '-', abs(coeff))).encode('ascii')
+            for coeff in range(self._coeff_min, int(self.DCT_COEFF_MAX / self._dct_coeff_split) + 1)]
 
     def hash_image(self, im):
         """Hash an image. Ignore details.
@@ -59,16 +138,330 @@ class Hash(object):
           im: a PIL image which will be hashed.
 
         Returns:
-          An MD5 hash string, resistent to small small perceptual transformations.
+          A digest, resistent to small small perceptual transformations. By default, an MD5 hash
+          string. See the digest and digest_format arguments of the constructor.
         """
-        hasher = hashlib.md5()
+        hasher = self._new_hasher()
 
-        if _is_video(im):
-            self._hash_animation(im, hasher)
+        first_core = self._first_frame_core(im)
+        if self._seek_forward(im, 1):
+            self._hash_animation(im, first_core, hasher)
+            if self._stats is not None:
+                self._stats.add('animations_hashed', 1)
         else:
-            self._hash_image(im, hasher)
+            self._hash_image(first_core, hasher)
+            if self._stats is not None:
+                self._stats.add('images_hashed', 1)
+
+        return self._format_digest(hasher.digest())
+
+    def orientation_digests(self, im):
+        """Hash an image as it would be hashed in each of its eight orientations.
+
+        With orientation_invariant, hash_image hashes one of these, the canonical one. Storing a
+        single orientation digest per image, and looking up all eight of a query, finds the same
+        duplicates, with all the orientations told apart.
+
+        Args:
+          im: a PIL image which will be hashed.
+
+        Returns:
+          A list of eight digests, starting with that of the image as it is, then those of the
+          image flipped left to right, top to bottom, and both, then those of its transpose,
+          flipped likewise. Landscape images are transposed first, so for them, the flips are
+          those of the transpose.
+        """
+        assert self._orientation_invariant
+
+        hashers = [self._new_hasher() for _ in range(8)]
+
+        first_core = self._first_frame_core(im)
+        if self._seek_forward(im, 1):
+            cores = self._key_frame_cores(im, first_core)
+            marker = b'VIDEO'
+        else:
+            cores = [first_core]
+            marker = b'IMAGE'
+        for hasher in hashers:
+            hasher.update(marker)
+        for (height_small, mat_core) in cores:
+            mat_dct = self._dct_core(mat_core)
+            for (hasher, quantized) in zip(hashers,
+                    self._quantize_orientations(height_small, mat_dct)):
+                self._quantized_hash(quantized, hasher)
+
+        return [self._format_digest(hasher.digest()) for hasher in hashers]
+
+    def window_digests(self, im, crops=None):
+        """Hash an image, and windows of it with some of its borders cropped off.
+
+        The digest of a window is the one hash_image gives to the image cropped the same way,
+        with the crop box rounded down to whole pixels, up to floating point rounding. So an
+        image whose borders were cropped, or padded, can be found by looking up the digests of
+        all the windows of the query, or by storing those of all the windows of the indexed
+        images. The image is decoded and converted once. The DCT of each window is computed from
+        the converted frame, with bases which combine the crop, the Lanczos resize of
+        sdhash.resample, the edge trimming and the cosines of the DCT. The bases of all the
+        windows are stacked, so that the DCTs of all of them come out of two matrix products,
+        which cost about dct_core_width times the number of windows multiplications per pixel.
+        Those bases are cached per frame size and crops, for the 16 most recently used ones.
+
+        Each key frame of an animation is windowed the same way. With orientation_invariant, the
+        crops are those of the image transposed to portrait. With fast_decode or max_pixels, the
+        windows are those of the frame decoded at a reduced size, which can differ from the
+        cropped image decoded at its own reduced size.
+
+        Args:
+          im: a PIL image which will be hashed.
+          crops: a sequence of (left, top, right, bottom) tuples, with the fraction of the width
+            or height of the image to crop from each side. Defaults to WINDOW_CROPS.
+
+        Returns:
+          A frozenset of digests, with that of hash_image and those of the windows. Windows
+          which hash the same only appear once.
+        """
+        crops = tuple(tuple(crop) for crop in (crops if crops is not None else self.WINDOW_CROPS))
+        for (left, top, right, bottom) in crops:
+            assert min(left, top, right, bottom) >= 0
+            assert left + right < 1
+            assert top + bottom < 1
+
+        hashers = [self._new_hasher() for _ in range(1 + len(crops))]
+
+        if im.tell() != 0:
+            im.seek(0)
+        first_gray = self._frame_gray(im)
+        if self._seek_forward(im, 1):
+            grays = self._key_frame_cores(im, first_gray, self._frame_gray)
+            marker = b'VIDEO'
+        else:
+            grays = [first_gray]
+            marker = b'IMAGE'
+        for hasher in hashers:
+            hasher.update(marker)
+        for im_gray in grays:
+            (height_small, mat) = self._gray_plane(im_gray)
+            self._core_hash((height_small, self._trim_edges(mat)), hashers[0])
+            for (hasher, quantized) in zip(hashers[1:], self._window_quantized(im_gray, crops)):
+                self._quantized_hash(quantized, hasher)
+        if self._stats is not None:
+            self._stats.add('animations_hashed' if marker == b'VIDEO' else 'images_hashed', 1)
+
+        return frozenset(self._format_digest(hasher.digest()) for hasher in hashers)
+
+    def hash_array(self, arr):
+        """Hash an image held in a NumPy array. Ignore details.
+
+        The array goes straight to luminance and to the resize, without building a PIL image for
+        its contents. The resize uses the cached weights of sdhash.resample, and only computes
+        the pixels left after the crop to MAX_HEIGHT and the edge trimming. For uint8 arrays, the
+        digest is the same as that of hash_image for the equivalent 'L', 'RGB' or 'RGBA' PIL
+        image, up to floating point rounding in the resize. Float arrays are taken to hold values
+        on the same 0 to 255 scale, as in an 'F' PIL image.
+
+        Args:
+          arr: a NumPy array of uint8s or floats, of shape (height, width) for grayscale images,
+            or of shape (height, width, channels) for RGB or RGBA images. Alpha is ignored.
+
+        Returns:
+          A digest, as for hash_image.
+        """
+        hasher = self._new_hasher()
+        self._hash_image(self._array_core(arr), hasher)
+        if self._stats is not None:
+            self._stats.add('images_hashed', 1)
+        return self._format_digest(hasher.digest())
+
+    def hash_arrays(self, arrays):
+        """Hash a batch of images held in NumPy arrays. Ignore details.
+
+        As with hash_images, arrays are resized one by one, and the DCT is computed once for each
+        group of arrays which share the same resized height. Arrays of the same size share the
+        cached weights of the resize.
+
+        Args:
+          arrays: an iterable of NumPy arrays, as for hash_array.
+
+        Returns:
+          A list of digests, in the same order as arrays. Each is identical to the result of
+          hash_array on the corresponding array.
+        """
+        digests = []
+        cores_by_height = {}
+
+        for arr in arrays:
+            (height_small, mat_core) = self._array_core(arr)
+            cores_by_height.setdefault(height_small, []).append((len(digests), mat_core))
+            digests.append(None)
+
+        self._hash_cores(cores_by_height, digests)
+        return digests
+
+    def hash_buffer(self, buf, width, height, mode='L'):
+        """Hash an image held as raw pixels in a buffer. Ignore details.
+
+        The buffer is viewed as a NumPy array, without copying it, and hashed with hash_array.
+
+        Args:
+          buf: an object supporting the buffer protocol, such as bytes, bytearray or memoryview,
+            holding the pixels row by row, with no padding between rows.
+          width: the width of the image.
+          height: the height of the image.
+          mode: how pixels are laid out. One of 'L', for one uint8 per pixel, 'RGB' or 'RGBA', for
+            three or four interleaved uint8s per pixel, or 'F', for one native float32 per pixel.
+
+        Returns:
+          A digest, as for hash_image.
+        """
+        assert mode in _BUFFER_MODES
+        (dtype, channels) = _BUFFER_MODES[mode]
+        shape = (height, width) if channels == 1 else (height, width, channels)
+        num_bytes = height * width * channels * numpy.dtype(dtype).itemsize
+        # Through a memoryview, as the NumPy versions for Python 2 can't take one in frombuffer.
+        data = numpy.asarray(memoryview(buf)).reshape(-1).view(numpy.uint8)
+        assert data.shape[0] >= num_bytes
+        return self.hash_array(data[:num_bytes].view(dtype).reshape(shape))
+
+    def hash_frames(self, frames):
+        """Hash a video given as a sequence of frames. Ignore details.
+
+        Frames are hashed one at a time, as they arrive, so the sequence can be streamed from a
+        decoder without holding the video in memory. The key_frames of the constructor are not
+        used: every frame given is hashed, so key frames are picked beforehand, with the samplers
+        of sdhash.video for example. Hashing the key frames of an animation this way gives the
+        same digest as hash_image does for it.
+
+        Args:
+          frames: an iterable of frames, each a PIL image or a NumPy array as for hash_array. A
+            PIL image frame is only used until the next frame is requested, so the same image
+            object can be seeked from frame to frame.
+
+        Returns:
+          A digest, as for hash_image.
+
+        Raises:
+          ValueError: if there are no frames.
+        """
+        hasher = self._new_hasher()
+        # Mark the fact that this is in the video space, as for animations.
+        hasher.update(b'VIDEO')
+
+        num_frames = 0
+        for frame in frames:
+            if isinstance(frame, numpy.ndarray):
+                self._core_hash(self._array_core(frame), hasher)
+            else:
+                self._core_hash(self._frame_core(frame), hasher)
+            num_frames += 1
+
+        if num_frames == 0:
+            raise ValueError('There are no frames to hash')
+        if self._stats is not None:
+            self._stats.add('animations_hashed', 1)
+        return self._format_digest(hasher.digest())
+
+    def hash_images(self, images):
+        """Hash a batch of images. Ignore details.
+
+        Images are resized one by one, but the DCT is computed once for each group of images which
+        share the same resized height, over a stack of their cores. Animations are hashed one by
+        one, as with hash_image. The cores of all images are held in memory until the end, so very
+        large inputs should be fed in chunks.
+
+        Args:
+          images: an iterable of PIL images which will be hashed.
+
+        Returns:
+          A list of digests, in the same order as images. Each is identical to the result
+          of hash_image on the corresponding image.
+        """
+        digests = []
+        cores_by_height = {}
+        stats = self._stats
+
+        for im in images:
+            (height_small, mat_core) = self._first_frame_core(im)
+            if self._seek_forward(im, 1):
+                hasher = self._new_hasher()
+                self._hash_animation(im, (height_small, mat_core), hasher)
+                if stats is not None:
+                    stats.add('animations_hashed', 1)
+                digests.append(self._format_digest(hasher.digest()))
+                continue
+            cores_by_height.setdefault(height_small, []).append((len(digests), mat_core))
+            digests.append(None)
+
+        self._hash_cores(cores_by_height, digests)
+        return digests
+
+    def coefficients(self, im):
+        """Compute the quantized values which hash_image hashes for an image.
 
-        return hasher.hexdigest()
+        For animations, only the current frame, which is normally the first one, is used.
+
+        Args:
+          im: a PIL image.
+
+        Returns:
+          A NumPy int16 array with 1 + dct_core_width^2 elements. The first one is the height
+          bucket of the image, and the rest are the quantized DCT coefficients, in row major order.
+        """
+        (height_small, mat_core) = self._frame_core(im)
+        mat_dct = self._dct_core(mat_core)
+        return self._quantize(height_small, mat_dct)
+
+    def signature(self, im):
+        """Compute a compact signature of an image, for near-duplicate search.
+
+        The signature contains the same values as coefficients, each encoded with a Gray code,
+        so values which are one bucket apart differ in a single bit. The Hamming distance between
+        two signatures, as computed by hamming_distance, is thus small for near-duplicates which
+        hash_image would consider different because of a single coefficient crossing a bucket
+        boundary.
+
+        Args:
+          im: a PIL image.
+
+        Returns:
+          A NumPy uint8 array of signature_bits bits, packed, and padded with zeros at the end.
+        """
+        return self.pack_signatures(self.coefficients(im))
+
+    def pack_signatures(self, coefficients):
+        """Pack the quantized values produced by coefficients into signatures.
+
+        Args:
+          coefficients: a NumPy array as produced by coefficients, or a 2-D array with one such
+            array per row.
+
+        Returns:
+          The signature, as produced by signature, or a 2-D array with one signature per row.
+        """
+        coefficients = numpy.asarray(coefficients, dtype=numpy.int32)
+        assert coefficients.shape[-1] == 1 + self._dct_core_width * self._dct_core_width
+
+        heights_bits = _gray_code_bits(coefficients[..., :1], self._height_bits)
+        coeffs_bits = _gray_code_bits(coefficients[..., 1:] - self._coeff_min, self._coeff_bits)
+        return numpy.packbits(numpy.concatenate([heights_bits, coeffs_bits], axis=-1), axis=-1)
+
+    def digest_bytes(self, digest):
+        """Convert a digest produced by hash_image back to the raw bytes of the digest.
+
+        Args:
+          digest: a digest, in the digest_format of this Hash object.
+
+        Returns:
+          A byte string of digest_size bytes.
+        """
+        if self._digest_format == 'bytes':
+            return digest
+        if self._digest_format == 'int':
+            digest = '%0*x' % (2 * self.digest_size, digest)
+        return binascii.unhexlify(digest)
+
+    def format_digest(self, raw_digest):
+        """Convert the raw bytes of a digest to the digest_format of this Hash object."""
+        return self._format_digest(raw_digest)
 
     def test_duplicate(self, im1, im2):
         """Test whether two images are duplicates.
@@ -85,54 +478,390 @@ class Hash(object):
 
         return hash1 == hash2
 
-    def _hash_image(self, im, hasher):
+    def find_duplicates(self, images, max_distance=None):
+        """Group images into classes of duplicates.
+
+        Each image is hashed once, with hash_images, rather than once for every pair it is in, as
+        with test_duplicate.
+
+        Args:
+          images: an iterable of PIL images.
+          max_distance: when None, images are duplicates when their digests are equal, as for
+            test_duplicate. Otherwise, images are near-duplicates when their distance, as in
+            distance_matrix, is at most max_distance, and classes are the connected groups of
+            near-duplicates.
+
+        Returns:
+          A list of classes, each a sorted list of indices into images, ordered by their first
+          index. Images with no duplicates are in classes of their own.
+        """
+        if max_distance is None:
+            return digest_classes(self.hash_images(images))
+        return distance_classes(self.distance_matrix(images), max_distance)
+
+    def distance_matrix(self, images):
+        """Compute the distances between all pairs of images, for near-duplicate detection.
+
+        Args:
+          images: an iterable of PIL images. For animations, only the current frame, which is
+            normally the first one, is used, as for coefficients.
+
+        Returns:
+          A symmetric N x N NumPy int32 array, with the coefficient_distances between the
+          coefficients of each pair of images.
+        """
+        coefficients = []
+        cores_by_height = {}
+
+        for im in images:
+            (height_small, mat_core) = self._frame_core(im)
+            cores_by_height.setdefault(height_small, []).append((len(coefficients), mat_core))
+            coefficients.append(None)
+
+        # As in hash_images, the DCT is computed once for all the cores of the same height.
+        for (height_small, cores) in cores_by_height.items():
+            mats_dct = self._dct_core(numpy.array([mat_core for (_, mat_core) in cores]))
+            for ((position, _), mat_dct) in zip(cores, mats_dct):
+                coefficients[position] = self._quantize(height_small, mat_dct)
+
+        num_values = 1 + self._dct_core_width * self._dct_core_width
+        return coefficient_distances(numpy.array(coefficients).reshape((-1, num_values)))
+
+    def _hash_cores(self, cores_by_height, digests):
+        # Hashes still images, with a DCT over the stack of cores of each height. The digest of
+        # each core goes to its position in digests.
+        stats = self._stats
+        for (height_small, cores) in cores_by_height.items():
+            if stats is not None:
+                start = _timer()
+            mats_dct = self._dct_core(numpy.array([mat_core for (_, mat_core) in cores]))
+            if stats is not None:
+                _record_time(stats, 'dct', start)
+                stats.add('images_hashed', len(cores))
+                stats.add('frames_hashed', len(cores))
+            for ((position, _), mat_dct) in zip(cores, mats_dct):
+                if stats is not None:
+                    start = _timer()
+                hasher = self._new_hasher()
+                hasher.update(b'IMAGE')
+                self._coeffs_hash(height_small, mat_dct, hasher)
+                digests[position] = self._format_digest(hasher.digest())
+
+    def _hash_image(self, core, hasher):
         # Mark the fact that this is in the images space.
-        hasher.update('IMAGE')
+        hasher.update(b'IMAGE')
         # Add the contents of the single frame to the hash.
-        self._frame_hash(im, hasher)
+        self._core_hash(core, hasher)
 
-    def _hash_animation(self, im, hasher):
+    def _hash_animation(self, im, first_core, hasher):
         # Mark the fact that this is in the video space.
-        hasher.update('VIDEO')
-
-        # Add the contents of each key frame to the hash. Algorithm is kind of ugly.
-        # We can only seek to consecutive frames. So this means we have to do the
-        # sequence 0,1,2,... . Whenever we encounter a key frame, we hash it. We stop if
-        # ther are no more frames in the video or no more key frames.
-        frame_idx = 0
-        key_frame_idx = 0
-        while True:
-            try:
-                im.seek(frame_idx)
-            except EOFError:
+        hasher.update(b'VIDEO')
+
+        # Add the contents of each key frame to the hash.
+        for core in self._key_frame_cores(im, first_core):
+            self._core_hash(core, hasher)
+
+    def _key_frame_cores(self, im, first_core, frame_core=None):
+        # The core of the first frame was already computed, and the animation was left at the
+        # second frame. Frames are only ever seeked forward, straight to the next key frame.
+        # Formats where each frame builds on the previous one, such as GIF, decode the frames in
+        # between exactly once, while formats with independent frames skip them altogether. We
+        # stop if there are no more frames in the video or no more key frames.
+        frame_core = frame_core if frame_core is not None else self._frame_core
+        for frame_idx in self._key_frames:
+            if frame_idx == 0:
+                yield first_core
+                continue
+            if not self._seek_forward(im, frame_idx):
                 break
-            if frame_idx == self._keyframes[key_frame_idx]:
-                self._frame_hash(im, hasher)
-                key_frame_idx += 1
-                if key_frame_idx >= len(self._keyframes):
-                    break
-            frame_idx += 1
+            yield frame_core(im)
         im.seek(0)
 
-    def _frame_hash(self, im, hasher):
+    def _first_frame_core(self, im):
+        if im.tell() != 0:
+            im.seek(0)
+        return self._frame_core(im)
+
+    def _seek_forward(self, im, frame_idx):
+        # Returns whether the frame exists. If it doesn't, the image stays at the current frame.
+        current_idx = im.tell()
+        assert frame_idx >= current_idx
+        if frame_idx == current_idx:
+            return True
+        stats = self._stats
+        if stats is not None:
+            start = _timer()
+        try:
+            im.seek(frame_idx)
+        except EOFError:
+            return False
+        if stats is not None:
+            _record_time(stats, 'seek', start)
+            stats.add('frames_seeked', frame_idx - current_idx)
+        return True
+
+    def _core_hash(self, core, hasher):
+        stats = self._stats
+        (height_small, mat_core) = core
+        if stats is not None:
+            start = _timer()
+        mat_dct = self._dct_core(mat_core)
+        if stats is not None:
+            _record_time(stats, 'dct', start)
+            stats.add('frames_hashed', 1)
+        self._coeffs_hash(height_small, mat_dct, hasher)
+
+    def _array_core(self, arr):
+        stats = self._stats
+        if stats is not None:
+            start = _timer()
+        mat = _luminance(numpy.asarray(arr))
+        if stats is not None:
+            _record_time(stats, 'convert', start)
+        return self._plane_core(mat)
+
+    def _plane_core(self, mat):
+        # Works on a single plane or on a stack of them, all of the same size.
+        stats = self._stats
+        if stats is not None:
+            start = _timer()
+        (height, width) = mat.shape[-2:]
+        if self._orientation_invariant and width > height:
+            mat = numpy.swapaxes(mat, -1, -2)
+            (height, width) = (width, height)
+        desired_height = _height_at_width(width, height, self._standard_width)
+        height_small = min(desired_height, self.MAX_HEIGHT)
+        edge_width = self._edge_width
+        # Cores of images too short for the edges are empty, as with hash_image.
+        top = min(edge_width, height_small)
+        rows = (top, max(top, height_small - edge_width))
+        cols = (edge_width, self._standard_width - edge_width)
+        mat_core = sdhash.resample.resize(mat, self._standard_width, desired_height, rows, cols)
+        mat_core -= 128
+        if stats is not None:
+            _record_time(stats, 'resize', start)
+        return (height_small, mat_core)
+
+    def _frame_core(self, im):
+        (height_small, mat) = self._frame_plane(im)
+        return (height_small, self._trim_edges(mat))
+
+    def _frame_plane(self, im):
+        # The resized frame, with its edges, and with 128 subtracted from it.
+        return self._gray_plane(self._frame_gray(im))
+
+    def _frame_gray(self, im):
+        # The frame, decoded and converted to a single plane of floats, as a PIL image.
+        stats = self._stats
+        if self._fast_decode:
+            _draft_to_width(im, 2 * self._standard_width, self._orientation_invariant)
+        if self._max_pixels is not None:
+            _draft_to_pixels(im, self._max_pixels)
+        (width, height) = im.size
+        if self._max_decoded_pixels is not None and width * height > self._max_decoded_pixels:
+            raise ValueError('Frame of %dx%d pixels is over the limit of %d decoded pixels' %
+                (width, height, self._max_decoded_pixels))
+        if stats is not None:
+            start = _timer()
+            im.load()
+            start = _record_time(stats, 'decode', start)
+            stats.add('pixels_decoded', width * height)
+            stats.add('bytes_decoded', width * height * len(im.getbands()))
+        if self._max_pixels is not None and width * height > self._max_pixels:
+            im = _shrink_to_pixels(im, self._max_pixels)
+            if stats is not None:
+                stats.add('frames_shrunk', 1)
         im_gray = im.convert('F')
-        im_small = _resize_to_width(im_gray, self._standard_width)
+        if stats is not None:
+            _record_time(stats, 'convert', start)
+        return im_gray
+
+    def _gray_plane(self, im_gray):
+        stats = self._stats
+        if stats is not None:
+            start = _timer()
+        im_small = _resize_to_width(im_gray, self._standard_width, self._orientation_invariant)
         mat = numpy.asarray(im_small, dtype=numpy.float32) - 128
-        edge_width = self._edge_width
-        mat_core = mat[edge_width:(mat.shape[0]-edge_width), edge_width:(mat.shape[1]-edge_width)]
-        mat_dct = fftpack.dct(fftpack.dct(mat_core, norm='ortho').T, norm='ortho').T
-    
         _, height_small = im_small.size
-        hasher.update('%d' % (height_small / self._height_split))
+        if stats is not None:
+            _record_time(stats, 'resize', start)
+        return (height_small, mat)
+
+    def _trim_edges(self, mat):
+        edge_width = self._edge_width
+        return mat[edge_width:(mat.shape[0]-edge_width), edge_width:(mat.shape[1]-edge_width)]
+
+    def _dct_core(self, mat_core):
+        # Only the top-left dct_core_width x dct_core_width block is computed or returned.
+        return self._dct2(mat_core, self._dct_core_width)
+
+    def _window_quantized(self, im_gray, crops):
+        # The quantized values of each window of the converted frame, in the order of crops.
+        stats = self._stats
+        if stats is not None:
+            start = _timer()
+        mat = numpy.asarray(im_gray, dtype=numpy.float64) - 128
+        if self._orientation_invariant and mat.shape[1] > mat.shape[0]:
+            mat = mat.T
+        (rows_basis, cols_basis, heights) = self._window_plan(mat.shape, crops)
+        width = self._dct_core_width
+        mat_rows = numpy.matmul(rows_basis, mat)
+        mats_dct = numpy.matmul(mat_rows.reshape((len(crops), width, mat.shape[1])),
+            cols_basis.transpose((0, 2, 1)))
+        if stats is not None:
+            start = _record_time(stats, 'dct', start)
+        quantized = [self._quantize(height_small, mat_dct)
+            for (height_small, mat_dct) in zip(heights, mats_dct)]
+        if stats is not None:
+            _record_time(stats, 'quantize', start)
+            stats.add('windows_hashed', len(crops))
+        return quantized
 
-        for ii in range(0, self._dct_core_width):
-            for jj in range(0, self._dct_core_width):
-                hasher.update(self._prepare_coeff(mat_dct[ii][jj]))
+    def _window_plan(self, shape, crops):
+        # The stacked row bases and column bases of the windows of a converted frame of the given
+        # shape, and the heights each window is resized to. Each window is resized as
+        # _resize_to_width would resize the image cropped to it, including the transpose of
+        # landscape windows with orientation_invariant, which transposes their DCT, and
+        # _quantize does not tell those apart.
+        key = (shape, self._standard_width, self._edge_width, self._dct_core_width,
+            self._orientation_invariant, crops)
+        plan = _WINDOW_PLANS.get(key)
 
-    def _prepare_coeff(self, coeff):
-        clamped = int(max(min(coeff, self.DCT_COEFF_MAX), self.DCT_COEFF_MIN) / self._dct_coeff_split)
-        sign = '+' if clamped >= 0 else '-'
-        return '%s%04d' % (sign, abs(clamped))
+        if plan is None:
+            (height, width) = shape
+            standard_width = self._standard_width
+            rows_bases = []
+            cols_bases = []
+            heights = []
+            for (left, top, right, bottom) in crops:
+                cols = (int(left * width), width - int(right * width))
+                rows = (int(top * height), height - int(bottom * height))
+                window_width = cols[1] - cols[0]
+                window_height = rows[1] - rows[0]
+                if self._orientation_invariant and window_width > window_height:
+                    desired_height = _height_at_width(window_height, window_width, standard_width)
+                    height_small = min(desired_height, self.MAX_HEIGHT)
+                    rows_bases.append(self._window_basis(height, rows, standard_width,
+                        standard_width))
+                    cols_bases.append(self._window_basis(width, cols, desired_height,
+                        height_small))
+                else:
+                    desired_height = _height_at_width(window_width, window_height, standard_width)
+                    height_small = min(desired_height, self.MAX_HEIGHT)
+                    rows_bases.append(self._window_basis(height, rows, desired_height,
+                        height_small))
+                    cols_bases.append(self._window_basis(width, cols, standard_width,
+                        standard_width))
+                heights.append(height_small)
+            plan = (numpy.concatenate(rows_bases), numpy.array(cols_bases), heights)
+            for basis in plan[:2]:
+                basis.flags.writeable = False
+            _WINDOW_PLANS.put(key, plan)
+
+        return plan
+
+    def _window_basis(self, length, window, out_size, kept_size):
+        # The first dct_core_width rows of the DCT basis of the core of a window of a vector of the
+        # given length, resized to out_size pixels, of which the first kept_size are kept before
+        # the edges are trimmed. Rows past the length of the core are zero.
+        basis = numpy.zeros((self._dct_core_width, length))
+        core_start = min(self._edge_width, kept_size)
+        core_stop = max(core_start, kept_size - self._edge_width)
+        if core_stop == core_start:
+            return basis
+        weights = sdhash.resample.weights(window[1] - window[0], out_size, core_start, core_stop)
+        core_basis = numpy.dot(sdhash.dct.dct_basis(core_stop - core_start, self._dct_core_width),
+            weights)
+        basis[:core_basis.shape[0], window[0]:window[1]] = core_basis
+        return basis
+
+    def _coeffs_hash(self, height_small, mat_dct, hasher):
+        stats = self._stats
+        if stats is not None:
+            start = _timer()
+        quantized = self._quantize(height_small, mat_dct)
+        if stats is not None:
+            _record_time(stats, 'quantize', start)
+        self._quantized_hash(quantized, hasher)
+
+    def _quantized_hash(self, quantized, hasher):
+        stats = self._stats
+        if stats is not None:
+            start = _timer()
+        if self._digest == 'md5':
+            # The height bucket, then each coefficient as a sign and four digits, as in the text
+            # older versions fed to MD5 piece by piece. It is hashed in one go, to the same digest.
+            coeff_texts = self._coeff_texts
+            coeff_min = self._coeff_min
+            hasher.update(('%d' % quantized[0]).encode('ascii') +
+                b''.join([coeff_texts[coeff - coeff_min] for coeff in quantized[1:].tolist()]))
+        else:
+            hasher.update(quantized.astype('<i2').tobytes())
+        if stats is not None:
+            _record_time(stats, 'digest', start)
+
+    def _new_hasher(self):
+        if self._digest == 'md5':
+            return hashlib.md5()
+        return hashlib.blake2b(digest_size=self.DIGESTS[self._digest])
+
+    def _format_digest(self, raw_digest):
+        if self._digest_format == 'bytes':
+            return raw_digest
+        hex_digest = binascii.hexlify(raw_digest).decode('ascii')
+        if self._digest_format == 'int':
+            return int(hex_digest, 16)
+        return str(hex_digest)
+
+    def _quantize(self, height_small, mat_dct):
+        if self._orientation_invariant:
+            orientations = self._quantize_orientations(height_small, mat_dct)
+            # The height bucket is the same for all, so only the coefficients are compared.
+            return orientations[numpy.lexsort(orientations[:, 1:].T[::-1])[0]]
+        core = mat_dct[:self._dct_core_width, :self._dct_core_width].astype(numpy.float64)
+        coeffs = numpy.trunc(numpy.clip(core, self.DCT_COEFF_MIN, self.DCT_COEFF_MAX) /
+            self._dct_coeff_split)
+        quantized = numpy.empty(1 + self._dct_core_width * self._dct_core_width, dtype=numpy.int16)
+        quantized[0] = int(height_small / self._height_split)
+        quantized[1:] = coeffs.flatten()
+        return quantized
+
+    def _quantize_orientations(self, height_small, mat_dct):
+        # Quantizes the DCT of the core in each of its eight orientations, in the order of
+        # orientation_digests. Reversing the rows of a matrix flips the sign of the odd rows of its
+        # DCT, reversing the columns flips the sign of the odd columns, and transposing it
+        # transposes its DCT. The signs are flipped before quantizing, which is not symmetric
+        # around zero because of the clipping.
+        width = self._dct_core_width
+        core = mat_dct[:width, :width].astype(numpy.float64)
+        signs = (-1.0) ** numpy.arange(width)
+        flips = [core, core * signs, core * signs[:, numpy.newaxis],
+            core * signs * signs[:, numpy.newaxis]]
+        cores = numpy.array(flips + [flip.T for flip in flips])
+        coeffs = numpy.trunc(numpy.clip(cores, self.DCT_COEFF_MIN, self.DCT_COEFF_MAX) /
+            self._dct_coeff_split)
+        quantized = numpy.empty((8, 1 + width * width), dtype=numpy.int16)
+        quantized[:, 0] = int(height_small / self._height_split)
+        quantized[:, 1:] = coeffs.reshape((8, width * width))
+        return quantized
+
+    @property
+    def params(self):
+        return {
+            'standard_width': self._standard_width,
+            'edge_width': self._edge_width,
+            'key_frames': list(self._key_frames),
+            'height_buckets': self._height_buckets,
+            'dct_core_width': self._dct_core_width,
+            'dct_coeff_buckets': self._dct_coeff_buckets,
+            'fast_decode': self._fast_decode,
+            'dct_backend': self._dct_backend,
+            'digest': self._digest,
+            'digest_format': self._digest_format,
+            'orientation_invariant': self._orientation_invariant,
+            'max_pixels': self._max_pixels,
+            'max_decoded_pixels': self._max_decoded_pixels,
+            }
 
     @property
     def standard_width(self):
@@ -169,23 +898,448 @@ class Hash(object):
     @property
     def lower_bound_fp_rate(self):
         return self._lower_bound_fp_rate
+
+    @property
+    def fast_decode(self):
+        return self._fast_decode
+
+    @property
+    def dct_backend(self):
+        return self._dct_backend
+
+    @property
+    def digest(self):
+        return self._digest
+
+    @property
+    def digest_format(self):
+        return self._digest_format
+
+    @property
+    def orientation_invariant(self):
+        return self._orientation_invariant
+
+    @property
+    def max_pixels(self):
+        return self._max_pixels
+
+    @property
+    def max_decoded_pixels(self):
+        return self._max_decoded_pixels
+
+    @property
+    def digest_size(self):
+        return self.DIGESTS[self._digest]
+
+    @property
+    def signature_bits(self):
+        return self._signature_bits
+
+    @property
+    def stats(self):
+        return self._stats
+
+
+class HashFamily(object):
+    """Object used for computing the hashes of several Hash configurations at once.
+
+    The configurations must agree on how images become cores, that is, on standard_width,
+    edge_width, key_frames, fast_decode, dct_backend, orientation_invariant, max_pixels and
+    max_decoded_pixels. They can differ in everything else, such as a coarse configuration for
+    routing images to buckets and a fine one for verification. Each frame is decoded, converted
+    and resized once, and its DCT is computed once, at the largest dct_core_width of the family.
+    The top-left block of that DCT is the DCT each configuration needs, so the digests are those
+    of the Hash objects, up to floating point rounding in the DCT.
+    """
+
+    def __init__(self, hashers):
+        """Create a HashFamily object.
+
+        Args:
+          hashers: the Hash objects to compute digests for. The decoding, resizing and DCT are
+            measured in the stats of the one with the largest dct_core_width, and the
+            quantizing and digest in the stats of each.
+        """
+        hashers = list(hashers)
+        assert len(hashers) > 0
+        core_params = [_core_params(hasher) for hasher in hashers]
+        assert all(params == core_params[0] for params in core_params)
+
+        self._hashers = hashers
+        self._core_hasher = max(hashers, key=lambda hasher: hasher.dct_core_width)
+
+    def hash_image(self, im):
+        """Hash an image with each Hash of the family.
+
+        Args:
+          im: a PIL image which will be hashed.
+
+        Returns:
+          A list of digests, one for each Hash, in order. Each is the result of its hash_image.
+        """
+        core_hasher = self._core_hasher
+        digest_hashers = [hasher._new_hasher() for hasher in self._hashers]
+
+        first_core = core_hasher._first_frame_core(im)
+        if core_hasher._seek_forward(im, 1):
+            for digest_hasher in digest_hashers:
+                digest_hasher.update(b'VIDEO')
+            for core in core_hasher._key_frame_cores(im, first_core):
+                self._core_hash(core, digest_hashers)
+            if core_hasher.stats is not None:
+                core_hasher.stats.add('animations_hashed', 1)
+        else:
+            for digest_hasher in digest_hashers:
+                digest_hasher.update(b'IMAGE')
+            self._core_hash(first_core, digest_hashers)
+            if core_hasher.stats is not None:
+                core_hasher.stats.add('images_hashed', 1)
+
+        return self._format_digests(digest_hashers)
+
+    def hash_array(self, arr):
+        """Hash an image held in a NumPy array with each Hash of the family.
+
+        Args:
+          arr: a NumPy array, as for Hash.hash_array.
+
+        Returns:
+          A list of digests, one for each Hash, in order. Each is the result of its hash_array.
+        """
+        core_hasher = self._core_hasher
+        digest_hashers = [hasher._new_hasher() for hasher in self._hashers]
+
+        for digest_hasher in digest_hashers:
+            digest_hasher.update(b'IMAGE')
+        self._core_hash(core_hasher._array_core(arr), digest_hashers)
+        if core_hasher.stats is not None:
+            core_hasher.stats.add('images_hashed', 1)
+
+        return self._format_digests(digest_hashers)
+
+    def _core_hash(self, core, digest_hashers):
+        core_hasher = self._core_hasher
+        stats = core_hasher.stats
+        (height_small, mat_core) = core
+        if stats is not None:
+            start = _timer()
+        mat_dct = core_hasher._dct_core(mat_core)
+        if stats is not None:
+            _record_time(stats, 'dct', start)
+            stats.add('frames_hashed', 1)
+        for (hasher, digest_hasher) in zip(self._hashers, digest_hashers):
+            # Each Hash quantizes its own top-left block of the DCT.
+            hasher._coeffs_hash(height_small, mat_dct, digest_hasher)
+
+    def _format_digests(self, digest_hashers):
+        return [hasher._format_digest(digest_hasher.digest())
+            for (hasher, digest_hasher) in zip(self._hashers, digest_hashers)]
+
+    @property
+    def hashers(self):
+        return list(self._hashers)
+
+
+class HashStats(object):
+    """Object used for collecting measurements of the work done by Hash objects.
+
+    For each stage of hashing, a histogram of the time spent in it is kept. Bucket i counts the
+    calls which took at most LATENCY_BOUNDS[i] seconds, and more than the previous bound. The
+    last bucket counts the calls slower than all bounds. The stages are:
+      decode: decoding the pixels of a frame.
+      seek: seeking to the next frame of an animation.
+      convert: converting a frame to a single plane of floats.
+      resize: resizing a frame to the standard width and trimming its edges.
+      dct: computing the DCT, for a single frame or a batch of them.
+      quantize: clamping and quantizing the DCT coefficients.
+      digest: feeding the quantized coefficients to the digest.
+
+    Counters are kept for images_hashed, animations_hashed, frames_seeked, frames_hashed,
+    windows_hashed, frames_shrunk, pixels_decoded and bytes_decoded.
+    """
+
+    LATENCY_BOUNDS = [1e-5 * 2 ** power for power in range(20)]
+
+    def __init__(self):
+        """Create an empty HashStats object."""
+        self.reset()
+
+    def reset(self):
+        """Forget all measurements."""
+        self._latencies = {}
+        self._counters = {}
+
+    def record_time(self, stage, seconds):
+        latency = self._latencies.get(stage)
+        if latency is None:
+            latency = self._latencies[stage] = {
+                'count': 0,
+                'total_seconds': 0.0,
+                'buckets': [0] * (len(self.LATENCY_BOUNDS) + 1),
+                }
+        latency['count'] += 1
+        latency['total_seconds'] += seconds
+        latency['buckets'][bisect.bisect_left(self.LATENCY_BOUNDS, seconds)] += 1
+
+    def add(self, counter, amount):
+        self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def snapshot(self):
+        """Export all measurements.
+
+        Returns:
+          A dict, suitable for serializing to JSON, with the latency bucket bounds under
+          'latency_bounds', a dict from stage to its count, total_seconds and buckets under
+          'latencies', and a dict from counter to its value under 'counters'.
+        """
+        return {
+            'latency_bounds': list(self.LATENCY_BOUNDS),
+            'latencies': dict((stage, {
+                'count': latency['count'],
+                'total_seconds': latency['total_seconds'],
+                'buckets': list(latency['buckets']),
+                }) for (stage, latency) in self._latencies.items()),
+            'counters': dict(self._counters),
+            }
+
+
+def hamming_distance(signatures1, signatures2):
+    """Compute the Hamming distance between signatures.
+
+    Args:
+      signatures1: a signature, as produced by Hash.signature, or an array of them, one per row.
+      signatures2: a signature, or an array of them. Must broadcast against signatures1.
+
+    Returns:
+      The number of bits which differ between the signatures, as an integer or a NumPy array of
+      integers, following NumPy broadcasting rules.
+    """
+    diff = numpy.bitwise_xor(numpy.asarray(signatures1, dtype=numpy.uint8),
+        numpy.asarray(signatures2, dtype=numpy.uint8))
+    return _POPCOUNT[diff].sum(axis=-1)
+
+
+def coefficient_distances(coefficients):
+    """Compute the distances between all pairs of rows of quantized values.
+
+    The distance is the sum of the absolute differences between the values, that is, the number
+    of buckets the height and the DCT coefficients of two images are apart. The matrix is computed
+    a block of rows at a time, so memory use stays proportional to its size.
+
+    Args:
+      coefficients: a 2-D array with one row per image, as produced by Hash.coefficients.
+
+    Returns:
+      A symmetric N x N NumPy int32 array.
+    """
+    coefficients = numpy.asarray(coefficients, dtype=numpy.int32)
+    (num_rows, num_values) = coefficients.shape
+    distances = numpy.empty((num_rows, num_rows), dtype=numpy.int32)
+    block_rows = max(1, _DISTANCE_BLOCK_VALUES // max(1, num_rows * num_values))
+
+    for start in range(0, num_rows, block_rows):
+        block = coefficients[start:start + block_rows, numpy.newaxis, :]
+        distances[start:start + block_rows] = numpy.abs(
+            block - coefficients[numpy.newaxis, :, :]).sum(axis=-1)
+
+    return distances
+
+
+def digest_classes(digests):
+    """Group equal digests into classes.
+
+    Args:
+      digests: a sequence of digests.
+
+    Returns:
+      A list of classes, each a sorted list of indices into digests, ordered by their first index.
+    """
+    classes_by_digest = {}
+    classes = []
+
+    for (idx, digest) in enumerate(digests):
+        digest_class = classes_by_digest.get(digest)
+        if digest_class is None:
+            digest_class = classes_by_digest[digest] = []
+            classes.append(digest_class)
+        digest_class.append(idx)
+
+    return classes
+
+
+def distance_classes(distances, max_distance):
+    """Group items into the connected groups of those at most max_distance apart.
+
+    Args:
+      distances: a symmetric N x N array of distances, as produced by coefficient_distances.
+      max_distance: the largest distance at which two items are linked.
+
+    Returns:
+      A list of classes, each a sorted list of indices, ordered by their first index.
+    """
+    distances = numpy.asarray(distances)
+    num_items = distances.shape[0]
+    parents = list(range(num_items))
+
+    def find(idx):
+        while parents[idx] != idx:
+            parents[idx] = parents[parents[idx]]
+            idx = parents[idx]
+        return idx
+
+    (rows, cols) = numpy.nonzero(numpy.triu(distances <= max_distance, 1))
+    for (row, col) in zip(rows.tolist(), cols.tolist()):
+        (root_row, root_col) = (find(row), find(col))
+        if root_row != root_col:
+            parents[max(root_row, root_col)] = min(root_row, root_col)
+
+    classes_by_root = {}
+    classes = []
+    for idx in range(num_items):
+        root = find(idx)
+        root_class = classes_by_root.get(root)
+        if root_class is None:
+            root_class = classes_by_root[root] = []
+            classes.append(root_class)
+        root_class.append(idx)
+
+    return classes
+
+
+_POPCOUNT = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.int32)
     
 
-def _is_video(im):
-    try:
-        im.seek(1)
-    except EOFError:
-        return False
-    im.seek(0)
-    return True
+# The bases of the windows of Hash.window_digests, per converted frame shape and crops. They span
+# the whole frame, so for frames a few thousand pixels on a side each takes a couple of megabytes,
+# and only the _MAX_WINDOW_PLANS most recently used are kept.
+_MAX_WINDOW_PLANS = 16
+_WINDOW_PLANS = sdhash.resample.PlanCache(_MAX_WINDOW_PLANS)
+
+# How many values coefficient_distances subtracts at once.
+_DISTANCE_BLOCK_VALUES = 1 << 22
+
+_timer = timeit.default_timer
+
+
+def _record_time(stats, stage, start):
+    now = _timer()
+    stats.record_time(stage, now - start)
+    return now
+
+
+def _core_params(hasher):
+    # The parameters which decide the core of a frame, and its DCT.
+    params = hasher.params
+    return (params['standard_width'], params['edge_width'], params['key_frames'],
+        params['fast_decode'], params['dct_backend'], params['orientation_invariant'],
+        params['max_pixels'], params['max_decoded_pixels'])
+
+
+def _gray_code_bits(values, num_bits):
+    # Gray code each value and expand it into num_bits bits, most significant first, along the
+    # last axis.
+    gray = values ^ (values >> 1)
+    shifts = numpy.arange(num_bits - 1, -1, -1)
+    bits = (gray[..., numpy.newaxis] >> shifts) & 1
+    return bits.reshape(values.shape[:-1] + (values.shape[-1] * num_bits,)).astype(numpy.uint8)
+
+
+def _draft_to_width(im, desired_width, transpose_landscape=False):
+    # The decoder picks the largest reduction which keeps the image at least this large. It does
+    # nothing for formats other than JPEG, or for images which have already been loaded.
+    (width, height) = im.size
+    if transpose_landscape and width > height:
+        # The height becomes the width once the image is transposed.
+        if height > desired_width:
+            im.draft('L', (max(1, int(float(width) / float(height) * desired_width)), desired_width))
+        return
+    if width <= desired_width:
+        return
+    desired_height = max(1, int(float(height) / float(width) * desired_width))
+    im.draft('L', (desired_width, desired_height))
+
+
+def _draft_to_pixels(im, max_pixels):
+    # As _draft_to_width, the decoder keeps the image at least as large as asked, so it can end
+    # up with up to four times max_pixels, which _shrink_to_pixels takes care of.
+    (width, height) = im.size
+    if width * height <= max_pixels:
+        return
+    scale = math.sqrt(float(max_pixels) / (width * height))
+    im.draft('L', (max(1, int(width * scale)), max(1, int(height * scale))))
 
 
-def _resize_to_width(im, desired_width):
+def _shrink_to_pixels(im, max_pixels):
+    # Shrinks a frame by the smallest whole factor which brings it within max_pixels. Each strip
+    # of output rows is resized straight from the frame, which only needs a buffer as large as
+    # the strip, rather than a copy of the whole frame.
     (width, height) = im.size
+    factor = max(2, int(math.sqrt(float(width * height) / max_pixels)))
+    while (width // factor) * (height // factor) > max_pixels:
+        factor += 1
+    (shrunk_width, shrunk_height) = (max(1, width // factor), max(1, height // factor))
+
+    if im.mode not in _SHRINK_MODES:
+        im = im.convert('L')
+    im_shrunk = Image.new(im.mode, (shrunk_width, shrunk_height))
+    strip_height = max(1, max_pixels // (shrunk_width * factor))
+    row_scale = float(height) / shrunk_height
+    for top in range(0, shrunk_height, strip_height):
+        bottom = min(shrunk_height, top + strip_height)
+        im_strip = im.resize((shrunk_width, bottom - top), Image.BOX,
+            box=(0, top * row_scale, width, bottom * row_scale))
+        im_shrunk.paste(im_strip, (0, top))
+
+    return im_shrunk
+
+
+# The modes which _shrink_to_pixels resizes as they are. Frames in other modes, such as
+# palette ones, are converted to 8 bit grayscale first.
+_SHRINK_MODES = frozenset(['L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr', 'I', 'F'])
+
+_LUMA_WEIGHTS = numpy.array([299, 587, 114], dtype=numpy.float32)
+
+# The dtype and number of channels of the pixels in buffers passed to Hash.hash_buffer.
+_BUFFER_MODES = {
+    'L': (numpy.uint8, 1),
+    'RGB': (numpy.uint8, 3),
+    'RGBA': (numpy.uint8, 4),
+    'F': (numpy.float32, 1),
+    }
+
+
+def _luminance(arr):
+    assert arr.dtype == numpy.uint8 or numpy.issubdtype(arr.dtype, numpy.floating)
+    assert arr.ndim == 2 or (arr.ndim == 3 and arr.shape[2] in (3, 4))
+    if arr.ndim == 2:
+        return arr.astype(numpy.float32, copy=False)
+    # The same weighting of channels as PIL uses when converting to 'F'. For uint8s, the weighted
+    # sums are integers below 2^24, so they are exact in float32, and the division rounds just as
+    # it does in PIL. A product per channel is much faster than numpy.dot over the last axis.
+    mat = numpy.multiply(arr[..., 0], _LUMA_WEIGHTS[0], dtype=numpy.float32)
+    mat += numpy.multiply(arr[..., 1], _LUMA_WEIGHTS[1], dtype=numpy.float32)
+    mat += numpy.multiply(arr[..., 2], _LUMA_WEIGHTS[2], dtype=numpy.float32)
+    mat /= 1000
+    return mat
+
+
+def _height_at_width(width, height, desired_width):
     aspect_ratio = float(height) / float(width)
     desired_height = int(aspect_ratio * desired_width)
-    desired_height = desired_height + desired_height % 2 # Always a multiple of 2.
-    im_resized = im.resize((desired_width, desired_height), Image.ANTIALIAS)
+    return desired_height + desired_height % 2 # Always a multiple of 2.
+
+
+def _resize_to_width(im, desired_width, transpose_landscape=False):
+    (width, height) = im.size
+    if transpose_landscape and width > height:
+        # Resized to the transposed size, then transposed, which is cheaper than the other way
+        # around, and the same up to floating point rounding.
+        desired_height = _height_at_width(height, width, desired_width)
+        im_resized = im.resize((desired_height, desired_width), Image.LANCZOS).transpose(
+            Image.TRANSPOSE)
+    else:
+        desired_height = _height_at_width(width, height, desired_width)
+        im_resized = im.resize((desired_width, desired_height), Image.LANCZOS)
     if desired_height >= Hash.MAX_HEIGHT:
         im_cropped = im_resized.crop((0, 0, desired_width, Hash.MAX_HEIGHT))
         im_cropped.load()
@@ -0,0 +1,235 @@
+"""Hashing of images from asyncio code, without blocking the event loop.
+
+Requires Python 3.7 or later. Usage:
+
+  >> hasher = sdhash.aio.AsyncHash(max_concurrency=8)
+  >> digest = await hasher.hash_image(request_body, timeout=5.0)
+
+Images are decoded and hashed in a pool of worker processes shared by all the calls made through
+an AsyncHash. At most max_concurrency images are handed to the pool at any time. Further calls
+wait, without holding a worker or a thread, until a slot frees up, which provides backpressure to
+the callers. The module level hash_image and hash_many go through a default AsyncHash, created on
+first use.
+
+A worker process which dies, for example at the hands of the OOM killer, breaks the whole pool.
+The pool is then replaced by a new one, and the images which were in it are hashed again there,
+one at a time, so that the image which killed the worker can't take the others down again. A call
+only fails if the pool breaks again while its image is being hashed the second time.
+"""
+
+import asyncio
+import concurrent.futures
+import concurrent.futures.process
+import functools
+import io
+import os
+
+from PIL import Image
+
+import sdhash
+
+
+_worker_hasher = None
+_default_hasher = None
+
+
+class AsyncHash(object):
+    """Hashes images on a bounded pool of workers, for use from a single event loop."""
+
+    def __init__(self, hasher=None, max_workers=None, max_concurrency=None, use_threads=False):
+        """Create an AsyncHash object.
+
+        Args:
+          hasher: the Hash object to use. Defaults to one with the default parameters.
+          max_workers: the number of worker processes or threads. Defaults to the number of CPUs.
+          max_concurrency: how many images can be handed to the workers at once. Calls above this
+            limit wait for a slot. Defaults to twice the number of workers, so that workers do
+            not idle between images.
+          use_threads: whether to hash in threads of this process, rather than in worker
+            processes. Threads avoid copying the images between processes, but hashing then
+            competes with the event loop for the GIL.
+        """
+        assert max_workers is None or max_workers > 0
+        assert max_concurrency is None or max_concurrency > 0
+
+        self._hasher = hasher if hasher is not None else sdhash.Hash()
+        self._max_workers = max_workers if max_workers is not None else os.cpu_count()
+        self._max_concurrency = (max_concurrency if max_concurrency is not None
+            else 2 * self._max_workers)
+        self._use_threads = use_threads
+        if use_threads:
+            self._work = functools.partial(_hash_data_with, self._hasher)
+        else:
+            self._work = _hash_data
+        self._executor = self._new_executor()
+        self._slots = None
+        self._retries = None
+        self._in_flight = 0
+
+    async def hash_image(self, image, timeout=None):
+        """Compute the hash of an encoded image.
+
+        Args:
+          image: the encoded image, as bytes, bytearray or memoryview, or an async stream of it.
+            Streams are either objects with an async read method, such as asyncio.StreamReader,
+            or async iterables of byte chunks. They are read to the end on the event loop, before
+            the image is handed to a worker.
+          timeout: how many seconds to wait for the hash, including the time spent reading the
+            image and waiting for a slot. None means there is no limit.
+
+        Returns:
+          The hash of the image, as for Hash.hash_image.
+
+        Raises:
+          asyncio.TimeoutError: if the hash was not computed in time. The slot of an image which
+            has reached a worker is only freed once the worker is done with it, so timeouts do not
+            let more than max_concurrency images into the pool.
+          concurrent.futures.process.BrokenProcessPool: if a worker died while the image was in
+            the pool, and again once it was handed alone to a new pool.
+        """
+        return await asyncio.wait_for(self._hash_image(image), timeout)
+
+    async def hash_many(self, images, timeout=None, return_exceptions=False):
+        """Compute the hashes of several encoded images, concurrently.
+
+        Args:
+          images: an iterable of encoded images, as for hash_image.
+          timeout: how many seconds to wait for each hash. None means there is no limit.
+          return_exceptions: whether to return the exception raised for an image in place of its
+            hash, rather than raising the first one.
+
+        Returns:
+          A list with the hash of each image, in the order of images.
+        """
+        return await asyncio.gather(*[self.hash_image(image, timeout) for image in images],
+            return_exceptions=return_exceptions)
+
+    def close(self, wait=True):
+        """Shut down the workers. Hashes already handed to them are finished if wait is set."""
+        self._executor.shutdown(wait=wait)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    async def _hash_image(self, image):
+        data = await _read_image(image)
+
+        try:
+            return await self._submit(data)
+        except concurrent.futures.process.BrokenProcessPool:
+            # The worker which died might have been hashing another image, so this one gets
+            # another chance on the new pool, without the other images of the broken one.
+            if self._retries is None:
+                self._retries = asyncio.Lock()
+            async with self._retries:
+                return await self._submit(data)
+
+    async def _submit(self, data):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._max_concurrency)
+        await self._slots.acquire()
+
+        # The slot is tied to the work in the executor, rather than to this coroutine, so that
+        # a cancelled call only gives it back once a worker is done with the image.
+        loop = asyncio.get_running_loop()
+        executor = self._executor
+        try:
+            future = executor.submit(self._work, data)
+        except BaseException as error:
+            self._slots.release()
+            if isinstance(error, concurrent.futures.process.BrokenProcessPool):
+                self._replace_executor(executor)
+            raise
+        self._in_flight += 1
+        future.add_done_callback(functools.partial(_release_slot, loop, self._release))
+        try:
+            return await asyncio.wrap_future(future)
+        except concurrent.futures.process.BrokenProcessPool:
+            self._replace_executor(executor)
+            raise
+
+    def _new_executor(self):
+        if self._use_threads:
+            return concurrent.futures.ThreadPoolExecutor(self._max_workers)
+        return concurrent.futures.ProcessPoolExecutor(self._max_workers,
+            initializer=_init_worker, initargs=(self._hasher,))
+
+    def _replace_executor(self, executor):
+        # All the calls which had images in a broken pool get here, but only the first replaces it.
+        if self._executor is executor:
+            self._executor = self._new_executor()
+            executor.shutdown(wait=False)
+
+    def _release(self):
+        self._in_flight -= 1
+        self._slots.release()
+
+    @property
+    def hasher(self):
+        return self._hasher
+
+    @property
+    def max_workers(self):
+        return self._max_workers
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+
+async def hash_image(image, timeout=None):
+    """Compute the hash of an encoded image with the default AsyncHash. See AsyncHash.hash_image."""
+    return await default_hasher().hash_image(image, timeout)
+
+
+async def hash_many(images, timeout=None, return_exceptions=False):
+    """Compute the hashes of encoded images with the default AsyncHash. See AsyncHash.hash_many."""
+    return await default_hasher().hash_many(images, timeout, return_exceptions)
+
+
+def default_hasher():
+    """The AsyncHash used by the module level functions, with the default parameters."""
+    global _default_hasher
+    if _default_hasher is None:
+        _default_hasher = AsyncHash()
+    return _default_hasher
+
+
+async def _read_image(image):
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return bytes(image)
+    if hasattr(image, 'read'):
+        return bytes(await image.read())
+    chunks = []
+    async for chunk in image:
+        chunks.append(bytes(chunk))
+    return b''.join(chunks)
+
+
+def _release_slot(loop, release, future):
+    # Called from a worker thread, or from the executor's management thread.
+    try:
+        loop.call_soon_threadsafe(release)
+    except RuntimeError:
+        # The event loop is closed, so nothing is waiting for the slot anymore.
+        pass
+
+
+def _init_worker(hasher):
+    global _worker_hasher
+    _worker_hasher = hasher
+
+
+def _hash_data(data):
+    return _hash_data_with(_worker_hasher, data)
+
+
+def _hash_data_with(hasher, data):
+    return hasher.hash_image(Image.open(io.BytesIO(data)))
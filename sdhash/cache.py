@@ -0,0 +1,247 @@
+"""A cache of image hashes, keyed by the encoded bytes of images.
+
+Hashing an image means decoding it, resizing it and computing a DCT, while recognising bytes seen
+before only takes a pass of SHA-1 over them. A HashCache keys each hash by the SHA-1 digest of the
+encoded image together with the parameters of the Hash object, so a repeated request is answered
+without decoding anything, and hashes made with other parameters are never confused.
+
+There are two tiers. An in-process LRU tier keeps the most recently used entries in memory. An
+optional SQLite tier keeps entries on disk, across runs and processes, and evicts the least
+recently used ones once the entries exceed a size budget. Disk hits don't write to the database
+right away. Their last use times are kept in memory, and written in batches, along with the next
+insertion, before an eviction, or when the cache is closed.
+"""
+
+import binascii
+import collections
+import hashlib
+import io
+import json
+import sqlite3
+import time
+
+from PIL import Image
+
+import sdhash
+
+
+VERSION = 1
+
+# A rough per-entry cost in the SQLite tier, on top of the key and digest bytes, for the index
+# and row overhead.
+_ENTRY_OVERHEAD = 48
+
+# How many disk hits have their last use times written at once.
+_MAX_PENDING_USES = 256
+
+
+class HashCache(object):
+    """A two-tier cache in front of Hash.hash_image. Not safe to share between threads."""
+
+    def __init__(self, hasher=None, max_entries=4096, path=None, max_bytes=64 * 1024 * 1024):
+        """Create a HashCache object.
+
+        Args:
+          hasher: the Hash object to use. Defaults to one with the default parameters.
+          max_entries: the number of entries kept in memory. Zero disables the memory tier.
+          path: the path of the SQLite database for the disk tier. It is created if missing, and
+            can be shared by several caches, with the same or with different Hash parameters.
+            None disables the disk tier.
+          max_bytes: roughly how many bytes the entries in the disk tier can take, before the
+            least recently used ones are evicted.
+        """
+        assert max_entries >= 0
+        assert max_bytes > 0
+
+        self._hasher = hasher if hasher is not None else sdhash.Hash()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        # The disk tier keeps digests in a single format, so the digest_format of the hasher
+        # doesn't change the key.
+        params = dict((name, value) for (name, value) in self._hasher.params.items()
+            if name != 'digest_format')
+        self._params_key = json.dumps(
+            {'version': VERSION, 'params': params}, sort_keys=True).encode('utf-8')
+        self._entries = collections.OrderedDict()
+        self._hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+
+        self._path = path
+        self._connection = None
+        self._disk_bytes = 0
+        self._pending_uses = {}
+        if path is not None:
+            self._connection = sqlite3.connect(path)
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS hashes ('
+                'key BLOB PRIMARY KEY, digest TEXT NOT NULL, last_used REAL NOT NULL)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS hashes_last_used ON hashes (last_used)')
+            self._connection.commit()
+            self._disk_bytes = self._measure_disk_bytes()
+
+    def hash_bytes(self, data):
+        """Compute the hash of an encoded image, or get it from the cache.
+
+        Args:
+          data: the encoded image, as a byte string.
+
+        Returns:
+          The hash of the image, as for Hash.hash_image.
+        """
+        key = self.key(data)
+
+        digest = self._entries.pop(key, None)
+        if digest is not None:
+            self._hits += 1
+            self._entries[key] = digest
+            return digest
+
+        digest = self._disk_get(key)
+        if digest is not None:
+            self._disk_hits += 1
+        else:
+            self._misses += 1
+            digest = self._hasher.hash_image(Image.open(io.BytesIO(data)))
+            self._disk_put(key, digest)
+
+        self._memory_put(key, digest)
+        return digest
+
+    def hash_file(self, path):
+        """Compute the hash of an image file, or get it from the cache."""
+        with open(path, 'rb') as image_file:
+            return self.hash_bytes(image_file.read())
+
+    def key(self, data):
+        """The cache key for an encoded image, as a byte string."""
+        key_hasher = hashlib.sha1(self._params_key)
+        key_hasher.update(data)
+        return key_hasher.digest()
+
+    def clear(self):
+        """Remove all the entries, from both tiers."""
+        self._entries.clear()
+        self._pending_uses.clear()
+        if self._connection is not None:
+            self._connection.execute('DELETE FROM hashes')
+            self._connection.commit()
+            self._disk_bytes = 0
+
+    def close(self):
+        """Close the disk tier. The memory tier keeps working.
+
+        The last use times of disk hits which were not written yet are written first.
+        """
+        if self._connection is not None:
+            self._write_pending_uses()
+            self._connection.commit()
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _memory_put(self, key, digest):
+        if self._max_entries == 0:
+            return
+        self._entries[key] = digest
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _disk_get(self, key):
+        if self._connection is None:
+            return None
+        row = self._connection.execute(
+            'SELECT digest FROM hashes WHERE key = ?', (sqlite3.Binary(key),)).fetchone()
+        if row is None:
+            return None
+        self._pending_uses[key] = time.time()
+        if len(self._pending_uses) >= _MAX_PENDING_USES:
+            self._write_pending_uses()
+            self._connection.commit()
+        return self._hasher.format_digest(binascii.unhexlify(str(row[0])))
+
+    def _disk_put(self, key, digest):
+        if self._connection is None:
+            return
+        # Digests are kept as hexadecimal text, whatever the digest_format of the hasher.
+        digest = binascii.hexlify(self._hasher.digest_bytes(digest)).decode('ascii')
+        self._connection.execute(
+            'INSERT OR REPLACE INTO hashes (key, digest, last_used) VALUES (?, ?, ?)',
+            (sqlite3.Binary(key), digest, time.time()))
+        self._pending_uses.pop(key, None)
+        self._write_pending_uses()
+        self._disk_bytes += len(key) + len(digest) + _ENTRY_OVERHEAD
+        if self._disk_bytes > self._max_bytes:
+            self._evict()
+        self._connection.commit()
+
+    def _write_pending_uses(self):
+        # Does not commit, so that the caller can do it along with its own changes.
+        if not self._pending_uses:
+            return
+        self._connection.executemany('UPDATE hashes SET last_used = ? WHERE key = ?',
+            [(last_used, sqlite3.Binary(key)) for (key, last_used) in self._pending_uses.items()])
+        self._pending_uses.clear()
+
+    def _evict(self):
+        # Other processes may share the database, so the size is measured again before evicting,
+        # and entries are evicted down to 90% of the budget, so this happens once in a while
+        # rather than on every insertion.
+        self._disk_bytes = self._measure_disk_bytes()
+        excess = self._disk_bytes - int(0.9 * self._max_bytes)
+        if excess <= 0:
+            return
+        entry_bytes = self._disk_bytes // max(1, self._count_disk_entries())
+        num_evicted = (excess + entry_bytes - 1) // entry_bytes
+        self._connection.execute(
+            'DELETE FROM hashes WHERE key IN '
+            '(SELECT key FROM hashes ORDER BY last_used ASC LIMIT ?)', (num_evicted,))
+        self._disk_bytes = self._measure_disk_bytes()
+
+    def _measure_disk_bytes(self):
+        (total,) = self._connection.execute(
+            'SELECT COALESCE(SUM(LENGTH(key) + LENGTH(digest) + ?), 0) FROM hashes',
+            (_ENTRY_OVERHEAD,)).fetchone()
+        return total
+
+    def _count_disk_entries(self):
+        (count,) = self._connection.execute('SELECT COUNT(*) FROM hashes').fetchone()
+        return count
+
+    @property
+    def hasher(self):
+        return self._hasher
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def max_entries(self):
+        return self._max_entries
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    @property
+    def disk_bytes(self):
+        return self._disk_bytes
+
+    @property
+    def hits(self):
+        return self._hits
+
+    @property
+    def disk_hits(self):
+        return self._disk_hits
+
+    @property
+    def misses(self):
+        return self._misses
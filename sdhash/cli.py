@@ -0,0 +1,206 @@
+"""Command line interface for SDHash.
+
+Usage:
+
+  >> sdhash dedup photos/ > duplicates.jsonl
+  >> find photos/ -name '*.jpg' | sdhash dedup > duplicates.jsonl
+  >> sdhash hash-shard --shard 0 --num-shards 2 manifest.txt runs/shard0
+  >> sdhash merge runs/shard*.run* > clusters.jsonl
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import sys
+import time
+
+import sdhash
+import sdhash.job
+import sdhash.parallel
+
+
+def main(argv=None, stdin=None, stdout=None, stderr=None):
+    """Run the command line interface.
+
+    Args:
+      argv: the command line arguments, without the program name. Defaults to sys.argv[1:].
+      stdin: the stream to read paths from. Defaults to sys.stdin.
+      stdout: the stream to write results to. Defaults to sys.stdout.
+      stderr: the stream to write progress reports to. Defaults to sys.stderr.
+
+    Returns:
+      The exit code of the program.
+    """
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    if getattr(args, 'command', None) is None:
+        parser.error('a command is required')
+    return args.command(args,
+        stdin if stdin is not None else sys.stdin,
+        stdout if stdout is not None else sys.stdout,
+        stderr if stderr is not None else sys.stderr)
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(prog='sdhash', description='Image hashing and deduplication.')
+    subparsers = parser.add_subparsers()
+
+    dedup_parser = subparsers.add_parser('dedup',
+        help='Find duplicate images.',
+        description='Find duplicate images. Images are hashed in parallel as paths are read, '
+            'and each duplicate is written out as soon as it is found, as a JSON line with the '
+            'digest, the first path seen with it and the duplicate path. Memory use grows only '
+            'with the number of distinct images.')
+    dedup_parser.add_argument('directories', nargs='*',
+        help='Directories to search for images. When missing, paths are read from stdin, one '
+            'per line.')
+    _add_hasher_arguments(dedup_parser)
+    _add_pool_arguments(dedup_parser)
+    dedup_parser.add_argument('--report-interval', type=float, default=10.0,
+        help='Seconds between progress reports on stderr. Zero disables them.')
+    dedup_parser.set_defaults(command=_dedup)
+
+    hash_shard_parser = subparsers.add_parser('hash-shard',
+        help='Hash a shard of a manifest, for a sharded dedup job.',
+        description='Hash the images of one shard of a manifest, a file with one path per line, '
+            'and write the digests and paths as sorted runs, to be merged with "sdhash merge". '
+            'Line i of the manifest belongs to shard i modulo the number of shards. All the '
+            'shards of a job must use the same hashing parameters.')
+    hash_shard_parser.add_argument('manifest', help='The manifest, with one path per line.')
+    hash_shard_parser.add_argument('run_prefix',
+        help='The prefix of the run files, which are written as RUN_PREFIX.run00000 and so on.')
+    hash_shard_parser.add_argument('--shard', type=int, required=True,
+        help='The index of the shard to hash.')
+    hash_shard_parser.add_argument('--num-shards', type=int, required=True,
+        help='The number of shards the manifest is split into.')
+    hash_shard_parser.add_argument('--run-size', type=int, default=1000000,
+        help='The maximum number of records in a run, and thus held in memory.')
+    _add_hasher_arguments(hash_shard_parser)
+    _add_pool_arguments(hash_shard_parser)
+    hash_shard_parser.set_defaults(command=_hash_shard)
+
+    merge_parser = subparsers.add_parser('merge',
+        help='Merge the runs of a sharded dedup job into duplicate clusters.',
+        description='Merge the runs written by "sdhash hash-shard" for all the shards of a job, '
+            'and write each group of images which share a digest as a JSON line with the digest '
+            'and the paths. Memory use only grows with the number of runs and the size of the '
+            'largest group.')
+    merge_parser.add_argument('runs', nargs='+', help='The run files.')
+    merge_parser.set_defaults(command=_merge)
+
+    return parser
+
+
+def _add_hasher_arguments(parser):
+    defaults = sdhash.Hash()
+    parser.add_argument('--standard-width', type=int, default=defaults.standard_width)
+    parser.add_argument('--edge-width', type=int, default=defaults.edge_width)
+    parser.add_argument('--height-buckets', type=int, default=defaults.height_buckets)
+    parser.add_argument('--dct-core-width', type=int, default=defaults.dct_core_width)
+    parser.add_argument('--dct-coeff-buckets', type=int, default=defaults.dct_coeff_buckets)
+    parser.add_argument('--fast-decode', action='store_true',
+        help='Shrink JPEGs while decoding them. See the README.')
+    parser.add_argument('--orientation-invariant', action='store_true',
+        help='Give rotated and flipped images the same digests.')
+    parser.add_argument('--max-pixels', type=int, default=None,
+        help='Shrink larger images before converting and resizing them. See the README.')
+    parser.add_argument('--max-decoded-pixels', type=int, default=None,
+        help='Fail on images which would decode to more pixels than this.')
+
+
+def _add_pool_arguments(parser):
+    parser.add_argument('--processes', type=int, default=None,
+        help='Number of worker processes. Defaults to the number of CPUs.')
+    parser.add_argument('--chunk-size', type=int, default=16,
+        help='Number of paths sent to a worker at once.')
+
+
+def _build_hasher(args):
+    return sdhash.Hash(
+        standard_width=args.standard_width,
+        edge_width=args.edge_width,
+        height_buckets=args.height_buckets,
+        dct_core_width=args.dct_core_width,
+        dct_coeff_buckets=args.dct_coeff_buckets,
+        fast_decode=args.fast_decode,
+        orientation_invariant=args.orientation_invariant,
+        max_pixels=args.max_pixels,
+        max_decoded_pixels=args.max_decoded_pixels)
+
+
+def _read_paths(args, stdin):
+    if len(args.directories) > 0:
+        return itertools.chain.from_iterable(
+            sdhash.parallel.walk_files(directory) for directory in args.directories)
+    return (line.rstrip('\n') for line in stdin if line.strip())
+
+
+def _dedup(args, stdin, stdout, stderr):
+    progress = _Progress(stderr, args.report_interval)
+    first_paths = {}
+
+    def on_error(path, error):
+        logging.warning('Could not hash %s: %s', path, error)
+        progress.errors += 1
+
+    for (path, digest) in sdhash.parallel.hash_files(_read_paths(args, stdin),
+            hasher=_build_hasher(args), processes=args.processes, chunk_size=args.chunk_size,
+            on_error=on_error):
+        first_path = first_paths.setdefault(digest, path)
+        if first_path != path:
+            stdout.write(json.dumps(
+                {'digest': digest, 'original': first_path, 'duplicate': path}) + '\n')
+            progress.duplicates += 1
+        progress.hashed += 1
+        progress.maybe_report()
+
+    progress.report()
+    return 0
+
+
+def _hash_shard(args, stdin, stdout, stderr):
+    errors = [0]
+
+    def on_error(path, error):
+        logging.warning('Could not hash %s: %s', path, error)
+        errors[0] += 1
+
+    run_paths = sdhash.job.hash_shard(args.manifest, args.shard, args.num_shards, args.run_prefix,
+        hasher=_build_hasher(args), processes=args.processes, chunk_size=args.chunk_size,
+        run_size=args.run_size, on_error=on_error)
+    stderr.write('Wrote %d runs, %d errors\n' % (len(run_paths), errors[0]))
+    return 0
+
+
+def _merge(args, stdin, stdout, stderr):
+    for (digest, paths) in sdhash.job.find_clusters(args.runs):
+        stdout.write(json.dumps({'digest': digest, 'paths': paths}) + '\n')
+    return 0
+
+
+class _Progress(object):
+    def __init__(self, stream, interval):
+        self.hashed = 0
+        self.duplicates = 0
+        self.errors = 0
+        self._stream = stream
+        self._interval = interval
+        self._start_time = time.time()
+        self._last_report_time = self._start_time
+
+    def maybe_report(self):
+        if self._interval > 0 and time.time() - self._last_report_time >= self._interval:
+            self.report()
+
+    def report(self):
+        now = time.time()
+        elapsed = max(now - self._start_time, 1e-6)
+        self._stream.write('Hashed %d images (%.1f images/s), found %d duplicates, %d errors\n' % (
+            self.hashed, self.hashed / elapsed, self.duplicates, self.errors))
+        self._stream.flush()
+        self._last_report_time = now
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+"""Backends for computing the top-left block of the 2-D DCT of image cores.
+
+Each backend is a function which receives a matrix, or a stack of matrices along the first
+axis, and a size k, and returns the top-left k x k block of the orthonormal 2-D DCT-II of each
+matrix.
+
+SciPy is a heavy import, so it is only imported when the 'fftpack' backend is first requested,
+through load_backend.
+"""
+
+import math
+
+import numpy
+
+
+def load_backend(name):
+    """Get a backend function by name, importing its dependencies if needed.
+
+    Raises:
+      ImportError: if the backend depends on a package which is not installed.
+    """
+    if name == 'fftpack':
+        _load_fftpack()
+    return BACKENDS[name]
+
+
+def fftpack_dct2(mat, size):
+    """Compute the full 2-D DCT with scipy.fftpack, and keep the top-left block."""
+    fftpack = _load_fftpack()
+    # The row and column transforms are the same 1-D transforms as dct(dct(mat).T).T.
+    mat_dct = fftpack.dct(fftpack.dct(mat, axis=-1, norm='ortho'), axis=-2, norm='ortho')
+    return mat_dct[..., :size, :size]
+
+
+def numpy_dct2(mat, size):
+    """Compute just the top-left block of the 2-D DCT, as two products with cosine bases.
+
+    For an R x C matrix, this costs about size * R * C multiplications, instead of the
+    R * C * (log R + log C) of a full transform, and the bases are computed once per shape.
+    """
+    rows_basis = dct_basis(mat.shape[-2], size)
+    cols_basis = dct_basis(mat.shape[-1], size)
+    return numpy.matmul(numpy.matmul(rows_basis, mat), cols_basis.T)
+
+
+def dct_basis(length, size):
+    """The first size rows of the orthonormal DCT-II matrix for vectors of a given length.
+
+    The DCT is separable, so the basis for the rows and the one for the columns of a matrix are
+    cached independently, per (length, size).
+
+    Returns:
+      A read-only NumPy float64 array of shape (min(size, length), length).
+    """
+    key = (length, size)
+    basis = _BASES.get(key)
+
+    if basis is None:
+        freqs = numpy.arange(min(size, length), dtype=numpy.float64)[:, numpy.newaxis]
+        samples = numpy.arange(length, dtype=numpy.float64)[numpy.newaxis, :]
+        basis = numpy.cos(math.pi * freqs * (2 * samples + 1) / (2 * length))
+        basis *= math.sqrt(2.0 / length)
+        basis[0] /= math.sqrt(2.0)
+        basis.flags.writeable = False
+        _BASES[key] = basis
+
+    return basis
+
+
+def _load_fftpack():
+    global _fftpack
+    if _fftpack is None:
+        import scipy.fftpack
+        _fftpack = scipy.fftpack
+    return _fftpack
+
+
+BACKENDS = {
+    'fftpack': fftpack_dct2,
+    'numpy': numpy_dct2,
+    }
+
+
+_BASES = {}
+_fftpack = None
@@ -0,0 +1,196 @@
+"""In-memory index of image signatures, for near-duplicate lookup."""
+
+import itertools
+
+import numpy
+
+import sdhash
+
+
+class Index(object):
+    """Index of signatures, searchable by Hamming distance, using multi-index hashing.
+
+    Signatures, as produced by Hash.signature, are kept in a contiguous NumPy array, alongside an
+    array of integer ids. Each signature is also split into num_blocks contiguous blocks of bytes,
+    and a hash table is kept for each block, mapping its contents to the signatures which contain
+    it. Two signatures within Hamming distance r must have at least one block within distance
+    r // num_blocks of each other. So a query only looks at the signatures found in the tables
+    under the query blocks, or under variants of them with at most r // num_blocks bits flipped,
+    and computes the exact distance just for those.
+    """
+
+    MAX_VARIANTS = 4096
+
+    def __init__(self, hasher, num_blocks=4, initial_capacity=1024):
+        """Create an Index object.
+
+        Args:
+          hasher: the Hash object which produces the signatures.
+          num_blocks: the number of blocks signatures are split into. More blocks make lookups
+            cheaper for larger radiuses, but produce more false candidates for small ones.
+          initial_capacity: the number of signatures to allocate space for initially.
+        """
+        signature_size = (hasher.signature_bits + 7) // 8
+
+        assert num_blocks > 0
+        assert num_blocks <= signature_size
+        assert initial_capacity > 0
+
+        self._hasher = hasher
+        self._signature_size = signature_size
+        self._num_blocks = num_blocks
+        block_edges = numpy.linspace(0, signature_size, num_blocks + 1).astype(int)
+        self._blocks = list(zip(block_edges[:-1], block_edges[1:]))
+        self._tables = [{} for _ in self._blocks]
+        self._signatures = numpy.zeros((initial_capacity, signature_size), dtype=numpy.uint8)
+        self._ids = numpy.zeros(initial_capacity, dtype=numpy.int64)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, signature, image_id=None):
+        """Add a signature to the index.
+
+        Args:
+          signature: a signature, as produced by Hash.signature.
+          image_id: an integer id for the signature. Defaults to its position in the index.
+
+        Returns:
+          The id of the signature.
+        """
+        signature = numpy.asarray(signature, dtype=numpy.uint8)
+        assert signature.shape == (self._signature_size,)
+
+        if self._size == self._signatures.shape[0]:
+            self._grow()
+
+        row = self._size
+        image_id = image_id if image_id is not None else row
+        self._signatures[row] = signature
+        self._ids[row] = image_id
+        for (table, (start, end)) in zip(self._tables, self._blocks):
+            table.setdefault(signature[start:end].tobytes(), []).append(row)
+        self._size += 1
+
+        return image_id
+
+    def add_many(self, signatures, image_ids=None):
+        """Add many signatures to the index at once.
+
+        Args:
+          signatures: a 2-D array with one signature per row.
+          image_ids: a sequence of integer ids, one for each signature. Defaults to their
+            positions in the index.
+        """
+        signatures = numpy.asarray(signatures, dtype=numpy.uint8)
+        assert signatures.ndim == 2
+        assert signatures.shape[1] == self._signature_size
+        assert image_ids is None or len(image_ids) == signatures.shape[0]
+
+        first_row = self._size
+        last_row = first_row + signatures.shape[0]
+        while last_row > self._signatures.shape[0]:
+            self._grow()
+
+        self._signatures[first_row:last_row] = signatures
+        if image_ids is not None:
+            self._ids[first_row:last_row] = image_ids
+        else:
+            self._ids[first_row:last_row] = numpy.arange(first_row, last_row)
+        for (table, (start, end)) in zip(self._tables, self._blocks):
+            for (row, block) in enumerate(signatures[:, start:end], first_row):
+                table.setdefault(block.tobytes(), []).append(row)
+        self._size = last_row
+
+    def add_image(self, im, image_id=None):
+        """Add the signature of an image to the index. See add."""
+        return self.add(self._hasher.signature(im), image_id)
+
+    def query(self, signature, radius):
+        """Find all the signatures within a Hamming radius of a given one.
+
+        Args:
+          signature: a signature, as produced by Hash.signature.
+          radius: the maximum Hamming distance to the signatures to return.
+
+        Returns:
+          A list of (id, distance) pairs, sorted by distance and then by id.
+        """
+        signature = numpy.asarray(signature, dtype=numpy.uint8)
+        assert signature.shape == (self._signature_size,)
+        assert radius >= 0
+
+        candidates = self._candidates(signature, radius // self._num_blocks)
+        if candidates is None:
+            candidates = numpy.arange(self._size)
+        distances = sdhash.hamming_distance(self._signatures[candidates], signature)
+        matches = distances <= radius
+
+        return sorted(zip(self._ids[candidates][matches].tolist(), distances[matches].tolist()),
+            key=lambda match: (match[1], match[0]))
+
+    def query_image(self, im, radius):
+        """Find all the signatures within a Hamming radius of that of an image. See query."""
+        return self.query(self._hasher.signature(im), radius)
+
+    def _candidates(self, signature, block_radius):
+        # Returns None when enumerating block variants would cost more than a linear scan.
+        rows = set()
+
+        for (table, (start, end)) in zip(self._tables, self._blocks):
+            block = signature[start:end]
+            if _num_variants(8 * (end - start), block_radius) > self.MAX_VARIANTS:
+                return None
+            for variant in _block_variants(block, block_radius):
+                rows.update(table.get(variant, []))
+
+        return numpy.array(sorted(rows), dtype=numpy.int64)
+
+    def _grow(self):
+        capacity = 2 * self._signatures.shape[0]
+        signatures = numpy.zeros((capacity, self._signature_size), dtype=numpy.uint8)
+        signatures[:self._size] = self._signatures[:self._size]
+        ids = numpy.zeros(capacity, dtype=numpy.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._signatures = signatures
+        self._ids = ids
+
+    @property
+    def hasher(self):
+        return self._hasher
+
+    @property
+    def num_blocks(self):
+        return self._num_blocks
+
+    @property
+    def signatures(self):
+        return self._signatures[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+
+def _block_variants(block, radius):
+    # Yields the bytes of block with every combination of at most radius bits flipped.
+    num_bits = 8 * len(block)
+
+    for num_flips in range(radius + 1):
+        for positions in itertools.combinations(range(num_bits), num_flips):
+            variant = block.copy()
+            for position in positions:
+                variant[position // 8] ^= 0x80 >> (position % 8)
+            yield variant.tobytes()
+
+
+def _num_variants(num_bits, radius):
+    num_variants = 0
+    combinations = 1
+
+    for num_flips in range(radius + 1):
+        num_variants += combinations
+        combinations = combinations * (num_bits - num_flips) // (num_flips + 1)
+
+    return num_variants
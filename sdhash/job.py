@@ -0,0 +1,194 @@
+"""Sharded deduplication jobs, with mergeable partial results in plain files.
+
+A job starts from a manifest, a text file with the path of an image on each line. The manifest is
+split into num_shards shards, with line i going to shard i % num_shards, so every node of a job
+can read the same manifest and only hash its own lines. Each shard is hashed independently, and
+its (digest, path) pairs are written out as runs: text files with a tab separated digest and path
+on each line, sorted. A merge then streams all the runs of all the shards in digest order, and
+groups the paths which share a digest into duplicate clusters.
+
+Usage, with one command per node, then one for the merge:
+
+  >> sdhash hash-shard --shard 0 --num-shards 2 manifest.txt runs/shard0
+  >> sdhash hash-shard --shard 1 --num-shards 2 manifest.txt runs/shard1
+  >> sdhash merge runs/shard*.run* > clusters.jsonl
+
+Hashing a shard holds at most run_size records in memory at once, and merging holds one record
+per run, plus the paths of the cluster being built.
+"""
+
+import binascii
+import heapq
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+
+import sdhash
+import sdhash.parallel
+
+
+def shard_paths(manifest_path, shard, num_shards):
+    """Read the paths of a shard of a manifest.
+
+    Args:
+      manifest_path: the path of the manifest, with one image path per line. Empty lines are
+        skipped, but still count towards the shard assignment.
+      shard: the index of the shard, from 0 to num_shards - 1.
+      num_shards: the number of shards the manifest is split into.
+
+    Yields:
+      The image paths in the shard, in manifest order.
+    """
+    assert 0 <= shard < num_shards
+
+    with io.open(manifest_path, 'r', encoding='utf-8') as manifest:
+        for (line_idx, line) in enumerate(manifest):
+            path = line.rstrip('\n')
+            if line_idx % num_shards == shard and path:
+                yield path
+
+
+def hash_shard(manifest_path, shard, num_shards, run_prefix, hasher=None, processes=None,
+        chunk_size=16, run_size=1000000, on_error=None):
+    """Hash a shard of a manifest, and write its results as sorted runs.
+
+    Runs left by an earlier attempt at the shard are removed first, and each run is written to a
+    temporary file and renamed into place once complete, so a shard can be run again after a
+    failure, and never leaves partial runs behind.
+
+    Args:
+      manifest_path: the path of the manifest.
+      shard: the index of the shard to hash.
+      num_shards: the number of shards the manifest is split into.
+      run_prefix: the prefix of the run files. Runs are written to run_prefix.run00000,
+        run_prefix.run00001 and so on.
+      hasher: the Hash object to use. Defaults to one with the default parameters. The same
+        parameters must be used for all the shards of a job.
+      processes: the number of local worker processes. Defaults to the number of CPUs.
+      chunk_size: how many paths to send to a worker at once.
+      run_size: the maximum number of records in a run, and thus held in memory.
+      on_error: a function called with the path and an error message for each file which could
+        not be hashed. Defaults to logging a warning.
+
+    Returns:
+      The list of paths of the runs written.
+    """
+    assert run_size > 0
+
+    hasher = hasher if hasher is not None else sdhash.Hash()
+    for stale_path in _list_runs(run_prefix):
+        os.remove(stale_path)
+    run_paths = []
+    records = []
+
+    for (path, digest) in sdhash.parallel.hash_files(
+            shard_paths(manifest_path, shard, num_shards), hasher=hasher, processes=processes,
+            chunk_size=chunk_size, on_error=on_error):
+        records.append((_hex_digest(hasher, digest), path))
+        if len(records) >= run_size:
+            run_paths.append(_write_run(run_prefix, len(run_paths), records))
+            records = []
+
+    if records or not run_paths:
+        run_paths.append(_write_run(run_prefix, len(run_paths), records))
+    return run_paths
+
+
+def merge_runs(run_paths):
+    """Stream the records of many runs, in digest order.
+
+    Args:
+      run_paths: the paths of the runs, from any number of shards.
+
+    Yields:
+      (digest, path) pairs, sorted, with the digest as a string of hexadecimal digits.
+    """
+    run_files = [io.open(run_path, 'r', encoding='utf-8') for run_path in run_paths]
+    try:
+        for line in heapq.merge(*run_files):
+            (digest, path) = line.rstrip('\n').split('\t', 1)
+            yield (digest, path)
+    finally:
+        for run_file in run_files:
+            run_file.close()
+
+
+def find_clusters(run_paths):
+    """Find the groups of images which share a digest, across many runs.
+
+    Args:
+      run_paths: the paths of the runs, from any number of shards.
+
+    Yields:
+      (digest, paths) pairs, in digest order, for each digest shared by more than one image.
+    """
+    for (digest, records) in itertools.groupby(merge_runs(run_paths), key=lambda r: r[0]):
+        paths = [path for (_, path) in records]
+        if len(paths) > 1:
+            yield (digest, paths)
+
+
+def run_local(manifest_path, work_dir, num_shards, hasher=None, run_size=1000000):
+    """Run all the shards of a job on this machine, each in its own process.
+
+    This stands in for running hash_shard on num_shards nodes. Each shard hashes its images in a
+    single process.
+
+    Args:
+      manifest_path: the path of the manifest.
+      work_dir: the directory to write the runs to, created if missing. Shard i writes runs with
+        the prefix work_dir/shard<i>.
+      num_shards: the number of shards, and of processes.
+      hasher: the Hash object to use. Defaults to one with the default parameters.
+      run_size: the maximum number of records in a run.
+
+    Returns:
+      The list of paths of the runs written by all the shards, ready for find_clusters.
+
+    Raises:
+      RuntimeError: if a shard fails.
+    """
+    hasher = hasher if hasher is not None else sdhash.Hash()
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    run_prefixes = [os.path.join(work_dir, 'shard%05d' % shard) for shard in range(num_shards)]
+    workers = [multiprocessing.Process(target=hash_shard,
+            args=(manifest_path, shard, num_shards, run_prefixes[shard], hasher, 1),
+            kwargs={'run_size': run_size})
+        for shard in range(num_shards)]
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    for (shard, worker) in enumerate(workers):
+        if worker.exitcode != 0:
+            raise RuntimeError('Shard %d failed with exit code %d' % (shard, worker.exitcode))
+
+    return [run_path for run_prefix in run_prefixes for run_path in _list_runs(run_prefix)]
+
+
+def _list_runs(run_prefix):
+    # Lists the runs with a prefix, including temporary ones, sorted.
+    (run_dir, run_name) = os.path.split(run_prefix)
+    return sorted(os.path.join(run_dir, name) for name in os.listdir(run_dir or '.')
+        if name.startswith(run_name + '.run'))
+
+
+def _hex_digest(hasher, digest):
+    hex_digest = binascii.hexlify(hasher.digest_bytes(digest))
+    return hex_digest.decode('ascii') if not isinstance(hex_digest, str) else hex_digest
+
+
+def _write_run(run_prefix, run_idx, records):
+    run_path = '%s.run%05d' % (run_prefix, run_idx)
+    tmp_path = run_path + '.tmp'
+    records.sort()
+    with io.open(tmp_path, 'w', encoding='utf-8') as run_file:
+        for (digest, path) in records:
+            run_file.write(u'%s\t%s\n' % (digest, path))
+    os.rename(tmp_path, run_path)
+    logging.info('Wrote %d records to %s', len(records), run_path)
+    return run_path
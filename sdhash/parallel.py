@@ -0,0 +1,283 @@
+"""Hashing of image files over a pool of worker processes."""
+
+import collections
+import logging
+import multiprocessing
+import os
+import select
+
+import numpy
+from PIL import Image
+
+import sdhash
+
+
+_worker_hasher = None
+
+
+def hash_files(paths, hasher=None, processes=None, chunk_size=16, max_pending_chunks=None,
+        on_error=None):
+    """Hash image files in parallel.
+
+    Paths are grouped in chunks of chunk_size, and each chunk is sent to a worker process, where
+    the images are decoded and hashed. At most max_pending_chunks chunks are in flight at any
+    time, so paths can be a lazy iterable of arbitrary length. If a worker process dies, killed
+    for running out of memory for example, the files of the chunk it was hashing are reported to
+    on_error, and a new worker process replaces it.
+
+    Args:
+      paths: an iterable of paths to image files.
+      hasher: the Hash object to use. Defaults to one with the default parameters.
+      processes: the number of worker processes. Defaults to the number of CPUs.
+      chunk_size: how many paths to send to a worker at once.
+      max_pending_chunks: how many chunks can be in flight at once. Defaults to twice the number
+        of worker processes.
+      on_error: a function called with the path and an error message for each file which could
+        not be hashed. Defaults to logging a warning.
+
+    Yields:
+      (path, digest) pairs, in the order they complete, for each file which could be hashed.
+    """
+    return _map_files(_hash_chunk, paths, hasher, processes, chunk_size, max_pending_chunks,
+        on_error)
+
+
+def coefficient_files(paths, hasher=None, processes=None, chunk_size=16, max_pending_chunks=None,
+        on_error=None):
+    """Compute the quantized values of image files in parallel, as Hash.coefficients does.
+
+    Args:
+      paths: an iterable of paths to image files.
+      hasher: the Hash object to use. Defaults to one with the default parameters.
+      processes: the number of worker processes. Defaults to the number of CPUs.
+      chunk_size: how many paths to send to a worker at once.
+      max_pending_chunks: how many chunks can be in flight at once. Defaults to twice the number
+        of worker processes.
+      on_error: a function called with the path and an error message for each file which could
+        not be read. Defaults to logging a warning.
+
+    Yields:
+      (path, coefficients) pairs, in the order they complete, for each file which could be read.
+    """
+    return _map_files(_coefficients_chunk, paths, hasher, processes, chunk_size,
+        max_pending_chunks, on_error)
+
+
+def find_duplicates(paths, hasher=None, max_distance=None, **kwargs):
+    """Group image files into classes of duplicates, hashing them in parallel.
+
+    Args:
+      paths: an iterable of paths to image files.
+      hasher: the Hash object to use. Defaults to one with the default parameters.
+      max_distance: as for Hash.find_duplicates. When None, files are duplicates when their
+        digests are equal. Otherwise, when the distance between their coefficients is at most
+        max_distance.
+      kwargs: extra arguments for hash_files or coefficient_files.
+
+    Returns:
+      A list of classes, each a sorted list of paths, ordered by their first path. Files with
+      no duplicates are in classes of their own, and files which could not be read are left out.
+    """
+    hasher = hasher if hasher is not None else sdhash.Hash()
+
+    if max_distance is None:
+        results = sorted(hash_files(paths, hasher=hasher, **kwargs))
+        classes = sdhash.digest_classes([digest for (_, digest) in results])
+    else:
+        results = sorted(coefficient_files(paths, hasher=hasher, **kwargs),
+            key=lambda result: result[0])
+        num_values = 1 + hasher.dct_core_width * hasher.dct_core_width
+        coefficients = numpy.array([values for (_, values) in results]).reshape((-1, num_values))
+        classes = sdhash.distance_classes(sdhash.coefficient_distances(coefficients),
+            max_distance)
+
+    return [[results[idx][0] for idx in path_class] for path_class in classes]
+
+
+def hash_directory(directory, **kwargs):
+    """Hash all the files under a directory, in parallel.
+
+    Args:
+      directory: the directory to walk, recursively.
+      kwargs: extra arguments for hash_files.
+
+    Yields:
+      (path, digest) pairs, as for hash_files.
+    """
+    return hash_files(walk_files(directory), **kwargs)
+
+
+def walk_files(directory):
+    """Yield the paths of all the files under a directory, recursively, in sorted order."""
+    for (dir_path, dir_names, file_names) in os.walk(directory):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            yield os.path.join(dir_path, file_name)
+
+
+def _map_files(chunk_function, paths, hasher, processes, chunk_size, max_pending_chunks,
+        on_error):
+    # Each worker process has a pipe of its own, down which it is sent chunks, and up which it
+    # sends the results of each chunk, in order. A worker which dies, killed for running out of
+    # memory or crashed by a decoder, closes its end of the pipe, so the chunk it was working on
+    # is reported as failed, the chunks it had queued are sent to the others, and a new worker
+    # takes its place. Nothing waits on a result which will never come.
+    assert chunk_size > 0
+    assert max_pending_chunks is None or max_pending_chunks > 0
+
+    hasher = hasher if hasher is not None else sdhash.Hash()
+    processes = processes if processes is not None else multiprocessing.cpu_count()
+    max_pending_chunks = max_pending_chunks if max_pending_chunks is not None else 2 * processes
+    on_error = on_error if on_error is not None else _log_error
+
+    workers = []
+    chunks = _chunks(paths, chunk_size)
+    retried_chunks = collections.deque()
+    pending_chunks = 0
+    chunks_exhausted = False
+
+    try:
+        for _ in range(processes):
+            workers.append(_Worker(chunk_function, hasher))
+
+        while True:
+            while pending_chunks < max_pending_chunks:
+                if len(retried_chunks) > 0:
+                    chunk = retried_chunks.popleft()
+                elif not chunks_exhausted:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        chunks_exhausted = True
+                        continue
+                else:
+                    break
+                min(workers, key=lambda worker: len(worker.chunks)).send(chunk)
+                pending_chunks += 1
+
+            if pending_chunks == 0:
+                break
+
+            busy_workers = [worker for worker in workers if len(worker.chunks) > 0]
+            (ready_workers, _, _) = select.select(busy_workers, [], [])
+            for worker in ready_workers:
+                try:
+                    chunk_results = worker.receive()
+                except (EOFError, IOError, OSError):
+                    lost_chunk = worker.chunks.popleft()
+                    error = 'Worker process died, with exit code %s' % worker.stop()
+                    for path in lost_chunk:
+                        on_error(path, error)
+                    pending_chunks -= 1 + len(worker.chunks)
+                    retried_chunks.extend(worker.chunks)
+                    workers[workers.index(worker)] = _Worker(chunk_function, hasher)
+                    continue
+                pending_chunks -= 1
+                for result in _completed(chunk_results, on_error):
+                    yield result
+    finally:
+        for worker in workers:
+            worker.stop()
+
+
+class _Worker(object):
+    # A worker process, the pipe to it, and the chunks sent to it, oldest first.
+
+    def __init__(self, chunk_function, hasher):
+        (self._connection, worker_connection) = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=_worker_main,
+            args=(worker_connection, chunk_function, hasher))
+        self._process.daemon = True
+        self._process.start()
+        # Only the worker holds its end now, so the pipe is closed as soon as it exits.
+        worker_connection.close()
+        self.chunks = collections.deque()
+
+    def fileno(self):
+        return self._connection.fileno()
+
+    def send(self, chunk):
+        self.chunks.append(chunk)
+        try:
+            self._connection.send(chunk)
+        except (IOError, OSError):
+            # The worker is gone. The closed pipe is noticed when waiting for its results.
+            pass
+
+    def receive(self):
+        chunk_results = self._connection.recv()
+        self.chunks.popleft()
+        return chunk_results
+
+    def stop(self):
+        # Returns the exit code of the process.
+        self._connection.close()
+        if self._process.is_alive():
+            self._process.terminate()
+        self._process.join()
+        return self._process.exitcode
+
+
+def _worker_main(connection, chunk_function, hasher):
+    _init_worker(hasher)
+    while True:
+        try:
+            chunk = connection.recv()
+        except EOFError:
+            return
+        try:
+            chunk_results = chunk_function(chunk)
+        except Exception as e:
+            chunk_results = [(path, None, '%s: %s' % (type(e).__name__, e)) for path in chunk]
+        connection.send(chunk_results)
+
+
+def _init_worker(hasher):
+    global _worker_hasher
+    _worker_hasher = hasher
+
+
+def _hash_chunk(paths):
+    return _process_chunk(paths, _worker_hasher.hash_image)
+
+
+def _coefficients_chunk(paths):
+    return _process_chunk(paths, _worker_hasher.coefficients)
+
+
+def _process_chunk(paths, function):
+    results = []
+
+    for path in paths:
+        try:
+            with open(path, 'rb') as image_file:
+                im = Image.open(image_file)
+                results.append((path, function(im), None))
+        except Exception as e:
+            results.append((path, None, '%s: %s' % (type(e).__name__, e)))
+
+    return results
+
+
+def _completed(chunk_results, on_error):
+    for (path, result, error) in chunk_results:
+        if error is not None:
+            on_error(path, error)
+        else:
+            yield (path, result)
+
+
+def _chunks(items, chunk_size):
+    chunk = []
+
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _log_error(path, error):
+    logging.warning('Could not hash %s: %s', path, error)
@@ -0,0 +1,217 @@
+"""Resizing of image planes with cached, separable resampling weights.
+
+The weights are those of the Lanczos filter PIL uses for Image.LANCZOS, computed the same way PIL
+computes them for 'F' images, so results match PIL's up to floating point rounding. Unlike PIL,
+only a window of the output can be computed, which is all hashing needs: the rows past
+Hash.MAX_HEIGHT and the edges are thrown away anyway.
+
+For each pair of input and output lengths, the weights are grouped into blocks of consecutive
+output pixels. Each block is a small dense matrix, over the span of input pixels which the block
+reads, so resizing is a handful of matrix products. Blocks are cached per (input length, output
+length, output window), and work over stacks of planes of the same size. At most MAX_PLANS of
+them are cached, and the least recently used are dropped first. A plan for an input a few
+thousand pixels long takes about half a megabyte, so the cache stays within a few tens of
+megabytes however many sizes of images are hashed.
+"""
+
+import collections
+import math
+
+import numpy
+
+
+LANCZOS_SUPPORT = 3.0
+BLOCK_SIZE = 16
+MAX_PLANS = 128
+
+
+def resize(mat, out_width, out_height, rows=None, cols=None):
+    """Resize a plane, or a stack of planes, with a Lanczos filter.
+
+    As PIL does, the rows are resampled first, into float32, then the columns. Only the input rows
+    which contribute to the output window are read.
+
+    Args:
+      mat: a NumPy array of shape (..., height, width).
+      out_width: the width of the resized plane.
+      out_height: the height of the resized plane.
+      rows: a (start, stop) pair, the rows of the resized plane to compute. Defaults to all.
+      cols: a (start, stop) pair, the columns of the resized plane to compute. Defaults to all.
+
+    Returns:
+      A NumPy float32 array of shape (..., rows[1] - rows[0], cols[1] - cols[0]).
+    """
+    rows = rows if rows is not None else (0, out_height)
+    cols = cols if cols is not None else (0, out_width)
+    assert 0 <= rows[0] <= rows[1] <= out_height
+    assert 0 <= cols[0] <= cols[1] <= out_width
+
+    row_plan = plan(mat.shape[-2], out_height, rows[0], rows[1])
+    col_plan = plan(mat.shape[-1], out_width, cols[0], cols[1])
+
+    (in_start, in_stop, _) = row_plan
+    mat = mat[..., in_start:in_stop, :]
+    mat = _resample_rows(mat, col_plan)
+    return _resample_cols(mat, row_plan)
+
+
+def plan(in_size, out_size, start, stop):
+    """Get the blocks of weights to resample from in_size to out_size pixels, for [start, stop).
+
+    Returns:
+      A tuple (in_start, in_stop, blocks). The output window only reads input pixels in
+      [in_start, in_stop). Blocks is a list of (out_start, out_stop, block_in_start, block_in_stop,
+      weights) tuples, with weights a read-only float64 array of shape (out_stop - out_start,
+      block_in_stop - block_in_start), or None when in_size equals out_size, and no resampling is
+      needed. Output indices are relative to start, and input ones to in_start. Only the
+      MAX_PLANS most recently used plans are cached.
+    """
+    key = (in_size, out_size, start, stop)
+    cached = _PLANS.get(key)
+    if cached is not None:
+        return cached
+
+    if in_size == out_size:
+        # PIL skips resampling along an axis which keeps its size.
+        cached = (start, stop, None)
+    elif start == stop:
+        cached = (0, 0, [])
+    else:
+        (xmins, xmaxs, weights) = lanczos_weights(in_size, out_size)
+        in_start = int(xmins[start:stop].min())
+        in_stop = int(xmaxs[start:stop].max())
+        blocks = []
+        for block_start in range(start, stop, BLOCK_SIZE):
+            block_stop = min(block_start + BLOCK_SIZE, stop)
+            block_in_start = int(xmins[block_start:block_stop].min())
+            block_in_stop = int(xmaxs[block_start:block_stop].max())
+            block = numpy.zeros((block_stop - block_start, block_in_stop - block_in_start))
+            for out_idx in range(block_start, block_stop):
+                offset = xmins[out_idx] - block_in_start
+                num_taps = xmaxs[out_idx] - xmins[out_idx]
+                block[out_idx - block_start, offset:offset + num_taps] = weights[out_idx, :num_taps]
+            block.flags.writeable = False
+            blocks.append((block_start - start, block_stop - start, block_in_start - in_start,
+                block_in_stop - in_start, block))
+        cached = (in_start, in_stop, blocks)
+
+    _PLANS.put(key, cached)
+    return cached
+
+
+def weights(in_size, out_size, start, stop):
+    """Get the dense matrix which resamples from in_size to out_size pixels, for [start, stop).
+
+    The matrix is built from the blocks of plan, and is not cached.
+
+    Returns:
+      A float64 array of shape (stop - start, in_size), whose product with a vector of in_size
+      pixels gives the output pixels in [start, stop).
+    """
+    (in_start, _, blocks) = plan(in_size, out_size, start, stop)
+    matrix = numpy.zeros((stop - start, in_size))
+    if blocks is None:
+        matrix[:, start:stop] = numpy.eye(stop - start)
+        return matrix
+    for (out_start, out_stop, block_in_start, block_in_stop, block) in blocks:
+        matrix[out_start:out_stop, in_start + block_in_start:in_start + block_in_stop] = block
+    return matrix
+
+
+class PlanCache(object):
+    """A cache which holds at most max_entries values, and drops the least recently used first."""
+
+    def __init__(self, max_entries):
+        assert max_entries > 0
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Get the value for a key, or None if it is not cached."""
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self._entries[key] = value
+        return value
+
+    def put(self, key, value):
+        """Cache a value for a key, dropping the least recently used values past the limit."""
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    @property
+    def max_entries(self):
+        return self._max_entries
+
+
+def lanczos_weights(in_size, out_size):
+    """Compute the Lanczos weights for resampling from in_size to out_size pixels, as PIL does.
+
+    Returns:
+      A tuple (xmins, xmaxs, weights). Output pixel i is the sum of input pixels xmins[i] up to,
+      but excluding, xmaxs[i], with the weights in the first xmaxs[i] - xmins[i] elements of
+      weights[i].
+    """
+    scale = float(in_size) / out_size
+    filter_scale = max(scale, 1.0)
+    support = LANCZOS_SUPPORT * filter_scale
+    num_taps = int(math.ceil(support)) * 2 + 1
+
+    centers = (numpy.arange(out_size) + 0.5) * scale
+    # Casts to int truncate towards zero, as in C. Negative values are clamped to zero anyway.
+    xmins = numpy.maximum((centers - support + 0.5).astype(numpy.int64), 0)
+    xmaxs = numpy.minimum((centers + support + 0.5).astype(numpy.int64), in_size)
+    xs = xmins[:, numpy.newaxis] + numpy.arange(num_taps)[numpy.newaxis, :]
+    valid = xs < xmaxs[:, numpy.newaxis]
+
+    weights = _lanczos(((xs - centers[:, numpy.newaxis]) + 0.5) * (1.0 / filter_scale))
+    weights[~valid] = 0
+    totals = weights.sum(axis=1)
+    weights[totals != 0] /= totals[totals != 0][:, numpy.newaxis]
+    return (xmins, xmaxs, weights)
+
+
+def _lanczos(x):
+    result = _sinc(x) * _sinc(x / 3)
+    result[(x < -LANCZOS_SUPPORT) | (x >= LANCZOS_SUPPORT)] = 0
+    return result
+
+
+def _sinc(x):
+    x = x * math.pi
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        result = numpy.sin(x) / x
+    result[x == 0] = 1
+    return result
+
+
+def _resample_rows(mat, col_plan):
+    # Resamples each row, that is, along the last axis.
+    (in_start, in_stop, blocks) = col_plan
+    if blocks is None:
+        return numpy.asarray(mat[..., in_start:in_stop], dtype=numpy.float32)
+    out = numpy.empty(mat.shape[:-1] + (blocks[-1][1] if blocks else 0,), dtype=numpy.float32)
+    mat = mat[..., in_start:in_stop]
+    for (out_start, out_stop, block_in_start, block_in_stop, block) in blocks:
+        out[..., out_start:out_stop] = numpy.matmul(mat[..., block_in_start:block_in_stop], block.T)
+    return out
+
+
+def _resample_cols(mat, row_plan):
+    # Resamples each column, that is, along the second to last axis. The rows of mat are already
+    # restricted to those the plan reads.
+    (in_start, in_stop, blocks) = row_plan
+    if blocks is None:
+        return numpy.asarray(mat, dtype=numpy.float32)
+    out = numpy.empty(mat.shape[:-2] + (blocks[-1][1] if blocks else 0, mat.shape[-1]),
+        dtype=numpy.float32)
+    for (out_start, out_stop, block_in_start, block_in_stop, block) in blocks:
+        out[..., out_start:out_stop, :] = numpy.matmul(block, mat[..., block_in_start:block_in_stop, :])
+    return out
+
+
+_PLANS = PlanCache(MAX_PLANS)
@@ -0,0 +1,243 @@
+"""Persistent, memory-mapped storage for image hashes and signatures.
+
+A store is a single file. It starts with a header of HEADER_SIZE bytes, holding a magic string,
+a format version and a JSON description of the Hash parameters used to produce its contents.
+Fixed-size records follow, one per image, each with an integer id, the raw bytes of the digest
+produced by Hash.hash_image and the signature produced by Hash.signature.
+
+Records are only ever appended, each batch of them with a single write, under an exclusive
+lock. Readers map the records with numpy.memmap, so loading a store copies nothing, and all the
+processes which load the same store share its pages. A record which is only partially written
+when a store is loaded is ignored. One left behind by a writer which died halfway is cut off
+before the next append, so that the records after it stay aligned.
+"""
+
+import binascii
+import fcntl
+import json
+import os
+import struct
+
+import numpy
+
+import sdhash
+import sdhash.index
+
+
+MAGIC = b'SDHSTORE'
+VERSION = 1
+HEADER_SIZE = 4096
+
+_HEADER_PREFIX = struct.Struct('<8sII')
+
+# Hash parameters which don't change the records: digests are stored as raw bytes, whatever
+# their format, and max_decoded_pixels only rejects images instead of hashing them otherwise.
+_UNRECORDED_PARAMS = frozenset(['digest_format', 'max_decoded_pixels'])
+
+
+class Store(object):
+    """A read-only view of a store file."""
+
+    def __init__(self, path):
+        """Load a store.
+
+        Args:
+          path: the path to the store file.
+
+        Raises:
+          ValueError: if the file is not a valid store.
+        """
+        (self._hasher, self._record_dtype) = _read_header(path)
+
+        num_records = (os.path.getsize(path) - HEADER_SIZE) // self._record_dtype.itemsize
+        if num_records > 0:
+            self._records = numpy.memmap(path, dtype=self._record_dtype, mode='r',
+                offset=HEADER_SIZE, shape=(num_records,))
+        else:
+            self._records = numpy.zeros(0, dtype=self._record_dtype)
+        self._path = path
+
+    def __len__(self):
+        return self._records.shape[0]
+
+    def digest(self, row):
+        """The digest of a record, as produced by Hash.hash_image."""
+        return self._hasher.format_digest(self._records['digest'][row].tobytes())
+
+    def hex_digest(self, row):
+        """The digest of a record, as a string of hexadecimal digits."""
+        digest = binascii.hexlify(self._records['digest'][row].tobytes())
+        return digest.decode('ascii') if not isinstance(digest, str) else digest
+
+    def build_index(self, num_blocks=4):
+        """Build an in-memory index over the signatures in the store.
+
+        Args:
+          num_blocks: the number of blocks for the index. See sdhash.index.Index.
+
+        Returns:
+          An sdhash.index.Index containing all the signatures in the store, with their ids.
+        """
+        index = sdhash.index.Index(self._hasher, num_blocks=num_blocks,
+            initial_capacity=max(1, len(self)))
+        index.add_many(self.signatures, self.ids)
+        return index
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def hasher(self):
+        return self._hasher
+
+    @property
+    def ids(self):
+        return self._records['id']
+
+    @property
+    def digests(self):
+        return self._records['digest']
+
+    @property
+    def signatures(self):
+        return self._records['signature']
+
+
+class StoreWriter(object):
+    """An append-only writer for a store file.
+
+    Many writers, in many processes, can append to the same store at the same time.
+    """
+
+    def __init__(self, path, hasher):
+        """Open a store for appending, creating it if it does not exist.
+
+        Args:
+          path: the path to the store file.
+          hasher: the Hash object which produced the records to append. Must have the same
+            parameters as the one the store was created with, except for digest_format and
+            max_decoded_pixels, which don't change the records.
+
+        Raises:
+          ValueError: if the file is not a valid store or was created with other parameters.
+        """
+        self._file = open(path, 'ab')
+        try:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            try:
+                if os.fstat(self._file.fileno()).st_size == 0:
+                    self._file.write(_build_header(hasher))
+                    self._file.flush()
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+            (store_hasher, self._record_dtype) = _read_header(path)
+            if _record_params(store_hasher) != _record_params(hasher):
+                raise ValueError('Store %s was created with parameters %s, not %s' % (
+                    path, _record_params(store_hasher), _record_params(hasher)))
+        except:
+            self._file.close()
+            raise
+        self._hasher = hasher
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, image_id, digest, signature):
+        """Append a single record to the store.
+
+        Args:
+          image_id: an integer id for the image.
+          digest: the digest of the image, as produced by Hash.hash_image.
+          signature: the signature of the image, as produced by Hash.signature.
+        """
+        self.append_many([image_id], [digest], [signature])
+
+    def append_many(self, image_ids, digests, signatures):
+        """Append many records to the store, with a single write.
+
+        Args:
+          image_ids: a sequence of integer ids.
+          digests: a sequence of digests, as produced by Hash.hash_image.
+          signatures: a sequence of signatures, or a 2-D array with one per row.
+        """
+        assert len(image_ids) == len(digests) == len(signatures)
+
+        records = numpy.zeros(len(image_ids), dtype=self._record_dtype)
+        records['id'] = image_ids
+        for (record, digest) in zip(records, digests):
+            record['digest'] = numpy.frombuffer(self._hasher.digest_bytes(digest), dtype=numpy.uint8)
+        records['signature'] = signatures
+
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            # The file is opened for appending, so the write goes to its end, wherever that is
+            # once a partial record is cut off.
+            size = os.fstat(self._file.fileno()).st_size
+            record_size = self._record_dtype.itemsize
+            whole_size = HEADER_SIZE + (size - HEADER_SIZE) // record_size * record_size
+            if size != whole_size:
+                os.ftruncate(self._file.fileno(), whole_size)
+            self._file.write(records.tobytes())
+            self._file.flush()
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        self._file.close()
+
+    @property
+    def hasher(self):
+        return self._hasher
+
+
+# The parameters of a hasher which determine the records it produces.
+def _record_params(hasher):
+    return dict((name, value) for (name, value) in hasher.params.items()
+        if name not in _UNRECORDED_PARAMS)
+
+
+def _record_dtype(hasher):
+    signature_size = (hasher.signature_bits + 7) // 8
+    return numpy.dtype([
+        ('id', '<i8'),
+        ('digest', 'u1', (hasher.digest_size,)),
+        ('signature', 'u1', (signature_size,)),
+        ])
+
+
+def _build_header(hasher):
+    description = json.dumps({
+        'params': hasher.params,
+        'record_size': _record_dtype(hasher).itemsize,
+        }, sort_keys=True).encode('utf-8')
+    header = _HEADER_PREFIX.pack(MAGIC, VERSION, len(description)) + description
+    assert len(header) <= HEADER_SIZE
+    return header + b'\0' * (HEADER_SIZE - len(header))
+
+
+def _read_header(path):
+    with open(path, 'rb') as store_file:
+        header = store_file.read(HEADER_SIZE)
+
+    if len(header) < HEADER_SIZE:
+        raise ValueError('Store %s has a truncated header' % path)
+    (magic, version, description_size) = _HEADER_PREFIX.unpack_from(header)
+    if magic != MAGIC:
+        raise ValueError('File %s is not a store' % path)
+    if version != VERSION:
+        raise ValueError('Store %s has unsupported version %d' % (path, version))
+
+    start = _HEADER_PREFIX.size
+    description = json.loads(header[start:start + description_size].decode('utf-8'))
+    hasher = sdhash.Hash(**dict((str(k), v) for (k, v) in description['params'].items()))
+    record_dtype = _record_dtype(hasher)
+    if description['record_size'] != record_dtype.itemsize:
+        raise ValueError('Store %s has unexpected record size %d' % (
+            path, description['record_size']))
+
+    return (hasher, record_dtype)
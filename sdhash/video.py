@@ -0,0 +1,329 @@
+"""Frame sources and key frame samplers, for hashing videos.
+
+A frame source is any iterable of Frame tuples, with the index of the frame in the video, its time
+in seconds and its pixels, as a PIL image or a NumPy array. There are sources for PIL animations,
+for any iterator of images, such as an imageio reader, and for any video ffmpeg can decode, read
+from an ffmpeg subprocess.
+
+A sampler is any callable which receives an iterable of frames, and returns an iterable of the key
+frames to hash. Frames flow through one at a time, so neither the source nor the sampler ever
+holds the whole video in memory, and samplers stop reading the source once they are done. There
+are samplers for fixed frame indices, as used for animations, for regular intervals of time, and
+for scene changes.
+
+Usage:
+
+  >> h = sdhash.Hash()
+  >> sdhash.video.hash_video(sdhash.video.ffmpeg_frames('clip.mp4', frame_rate=2), h,
+         sdhash.video.TimeSampler(1.0, max_frames=30))
+"""
+
+import collections
+import subprocess
+
+import numpy
+
+import sdhash
+import sdhash.resample
+
+
+# Frame times are sums or ratios of floats, and are compared with this much slack.
+_TIME_EPSILON = 1e-6
+
+Frame = collections.namedtuple('Frame', ['index', 'time', 'image'])
+
+
+def hash_video(source, hasher=None, sampler=None):
+    """Hash the key frames of a video.
+
+    Args:
+      source: an iterable of Frame tuples.
+      hasher: the Hash object to use. Defaults to one with the default parameters.
+      sampler: a callable which picks the key frames out of an iterable of frames. Defaults to an
+        IndexSampler for the key_frames of the hasher, which gives the same digests as
+        Hash.hash_image does for animations.
+
+    Returns:
+      A digest, as for Hash.hash_frames.
+
+    Raises:
+      ValueError: if the sampler picks no frames.
+    """
+    hasher = hasher if hasher is not None else sdhash.Hash()
+    sampler = sampler if sampler is not None else IndexSampler(hasher.key_frames)
+    try:
+        return hasher.hash_frames(frame.image for frame in sampler(source))
+    finally:
+        # Sources which are generators stop their decoders as soon as they are closed.
+        close = getattr(source, 'close', None)
+        if close is not None:
+            close()
+
+
+def pil_frames(im, default_duration=0.1):
+    """Stream the frames of a PIL image, such as a GIF animation.
+
+    The frames are the image itself, seeked forward from frame to frame, so each is only valid
+    until the next one is requested. The image is left at its first frame at the end.
+
+    Args:
+      im: a PIL image, with one or more frames.
+      default_duration: the duration of a frame, in seconds, for frames with no duration of their
+        own in the image info.
+
+    Yields:
+      Frame tuples.
+    """
+    frame_idx = 0
+    time = 0.0
+    if im.tell() != 0:
+        im.seek(0)
+    try:
+        while True:
+            yield Frame(frame_idx, time, im)
+            time += (im.info.get('duration') or 1000 * default_duration) / 1000.0
+            frame_idx += 1
+            try:
+                im.seek(frame_idx)
+            except EOFError:
+                break
+    finally:
+        im.seek(0)
+
+
+def iter_frames(images, frame_rate):
+    """Stream frames from any iterable of images, such as an imageio reader.
+
+    Args:
+      images: an iterable of PIL images or NumPy arrays, as for Hash.hash_frames.
+      frame_rate: the number of frames per second, used to compute the time of each frame.
+
+    Yields:
+      Frame tuples.
+    """
+    assert frame_rate > 0
+
+    for (frame_idx, image) in enumerate(images):
+        yield Frame(frame_idx, frame_idx / float(frame_rate), image)
+
+
+def ffmpeg_frames(path, frame_rate=None, size=None, ffmpeg='ffmpeg', ffprobe='ffprobe'):
+    """Stream the frames of a video file, decoded by an ffmpeg subprocess.
+
+    ffmpeg decodes the video to raw grayscale frames, which are read from its output one at a
+    time, as NumPy arrays of uint8s. ffmpeg's grayscale is the luma plane of the video, which is
+    close to, but not exactly, the luminance PIL computes, so the digests of videos hashed this way
+    should only be compared with each other.
+
+    Args:
+      path: the path of the video file, or anything else ffmpeg accepts as an input.
+      frame_rate: if given, ffmpeg resamples the video to this many frames per second, so with a
+        low rate, the frames a TimeSampler would skip are never sent over the pipe.
+      size: the (width, height) of the video, before any rotation. When missing, it is found with
+        ffprobe.
+      ffmpeg: the ffmpeg executable.
+      ffprobe: the ffprobe executable.
+
+    Yields:
+      Frame tuples.
+
+    Raises:
+      RuntimeError: if ffmpeg or ffprobe fail.
+    """
+    if size is None or frame_rate is None:
+        (probed_size, probed_frame_rate) = probe_video(path, ffprobe)
+        size = size if size is not None else probed_size
+        times_frame_rate = frame_rate if frame_rate is not None else probed_frame_rate
+    else:
+        times_frame_rate = frame_rate
+    (width, height) = size
+
+    command = [ffmpeg, '-v', 'error', '-noautorotate', '-i', path, '-an']
+    if frame_rate is not None:
+        command += ['-vf', 'fps=%s' % frame_rate]
+    command += ['-f', 'rawvideo', '-pix_fmt', 'gray', '-']
+
+    frame_bytes = width * height
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    finished = False
+    try:
+        frame_idx = 0
+        while True:
+            data = process.stdout.read(frame_bytes)
+            if len(data) < frame_bytes:
+                break
+            yield Frame(frame_idx, frame_idx / float(times_frame_rate),
+                numpy.frombuffer(data, dtype=numpy.uint8).reshape((height, width)))
+            frame_idx += 1
+        finished = True
+    finally:
+        process.stdout.close()
+        if not finished and process.poll() is None:
+            process.kill()
+        return_code = process.wait()
+    if return_code != 0:
+        raise RuntimeError('ffmpeg failed on %s with exit code %d' % (path, return_code))
+
+
+def probe_video(path, ffprobe='ffprobe'):
+    """Find the size and frame rate of the first video stream of a file, with ffprobe.
+
+    Returns:
+      A tuple ((width, height), frame_rate).
+
+    Raises:
+      RuntimeError: if ffprobe fails, or the file has no video stream.
+    """
+    command = [ffprobe, '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'stream=width,height,avg_frame_rate', '-of', 'csv=p=0', path]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    (output, _) = process.communicate()
+    fields = output.decode('ascii', 'replace').strip().split(',')
+    if process.returncode != 0 or len(fields) != 3:
+        raise RuntimeError('ffprobe found no video stream in %s' % path)
+    (numerator, _, denominator) = fields[2].partition('/')
+    frame_rate = float(numerator) / float(denominator or 1) if float(numerator) > 0 else 25.0
+    return ((int(fields[0]), int(fields[1])), frame_rate)
+
+
+class IndexSampler(object):
+    """Picks the frames at fixed indices, as Hash.hash_image does for animations."""
+
+    def __init__(self, indices):
+        """Create an IndexSampler object.
+
+        Args:
+          indices: the indices of the frames to pick. The source is not read past the last one.
+        """
+        assert len(indices) > 0
+        assert all(idx >= 0 for idx in indices)
+
+        self._indices = frozenset(indices)
+        self._last_index = max(indices)
+
+    def __call__(self, frames):
+        for frame in frames:
+            if frame.index in self._indices:
+                yield frame
+            if frame.index >= self._last_index:
+                break
+
+    @property
+    def indices(self):
+        return sorted(self._indices)
+
+
+class TimeSampler(object):
+    """Picks a frame every interval seconds: the first frame at or after each multiple of it."""
+
+    def __init__(self, interval, max_frames=None):
+        """Create a TimeSampler object.
+
+        Args:
+          interval: the time between key frames, in seconds.
+          max_frames: the maximum number of frames to pick. The source is not read further once
+            they are picked. None means no limit.
+        """
+        assert interval > 0
+        assert max_frames is None or max_frames > 0
+
+        self._interval = interval
+        self._max_frames = max_frames
+
+    def __call__(self, frames):
+        num_picked = 0
+        next_time = 0.0
+        for frame in frames:
+            if frame.time < next_time - _TIME_EPSILON:
+                continue
+            yield frame
+            num_picked += 1
+            if self._max_frames is not None and num_picked >= self._max_frames:
+                break
+            next_time = (int(frame.time / self._interval + _TIME_EPSILON) + 1) * self._interval
+
+    @property
+    def interval(self):
+        return self._interval
+
+    @property
+    def max_frames(self):
+        return self._max_frames
+
+
+class SceneSampler(object):
+    """Picks the first frame, and each frame which differs enough from the one before it.
+
+    Frames are compared by the mean absolute difference of their luminance, on a 0 to 255 scale,
+    over thumbnails of thumbnail_size x thumbnail_size pixels. Only the thumbnail of the previous
+    frame is kept around.
+    """
+
+    def __init__(self, threshold=25.0, min_interval=0.0, max_frames=None, thumbnail_size=16):
+        """Create a SceneSampler object.
+
+        Args:
+          threshold: the mean absolute difference above which a frame starts a new scene.
+          min_interval: the minimum time between key frames, in seconds, so fast cuts or flashes
+            don't pick too many frames.
+          max_frames: the maximum number of frames to pick. The source is not read further once
+            they are picked. None means no limit.
+          thumbnail_size: the width and height of the thumbnails the frames are compared on.
+        """
+        assert threshold >= 0
+        assert min_interval >= 0
+        assert max_frames is None or max_frames > 0
+        assert thumbnail_size > 0
+
+        self._threshold = threshold
+        self._min_interval = min_interval
+        self._max_frames = max_frames
+        self._thumbnail_size = thumbnail_size
+
+    def __call__(self, frames):
+        num_picked = 0
+        last_picked_time = None
+        previous_thumbnail = None
+        for frame in frames:
+            thumbnail = self.thumbnail(frame.image)
+            if previous_thumbnail is None:
+                is_key_frame = True
+            else:
+                is_key_frame = (self.distance(previous_thumbnail, thumbnail) > self._threshold and
+                    frame.time - last_picked_time >= self._min_interval)
+            previous_thumbnail = thumbnail
+            if not is_key_frame:
+                continue
+            yield frame
+            last_picked_time = frame.time
+            num_picked += 1
+            if self._max_frames is not None and num_picked >= self._max_frames:
+                break
+
+    def thumbnail(self, image):
+        """Shrink a frame, a PIL image or a NumPy array, to a thumbnail of its luminance."""
+        if isinstance(image, numpy.ndarray):
+            mat = sdhash._luminance(image)
+        else:
+            mat = numpy.asarray(image.convert('F'), dtype=numpy.float32)
+        return sdhash.resample.resize(mat, self._thumbnail_size, self._thumbnail_size)
+
+    def distance(self, thumbnail1, thumbnail2):
+        """The mean absolute difference between two thumbnails."""
+        return float(numpy.mean(numpy.abs(thumbnail1 - thumbnail2)))
+
+    @property
+    def threshold(self):
+        return self._threshold
+
+    @property
+    def min_interval(self):
+        return self._min_interval
+
+    @property
+    def max_frames(self):
+        return self._max_frames
+
+    @property
+    def thumbnail_size(self):
+        return self._thumbnail_size
@@ -0,0 +1,165 @@
+import io
+import os
+import signal
+import threading
+import time
+import unittest
+
+from PIL import Image
+
+import sdhash
+import tests.util as util
+try:
+    import asyncio
+    import concurrent.futures.process
+    import sdhash.aio
+except ImportError:
+    asyncio = None
+
+
+def _encode(im):
+    encoded = io.BytesIO()
+    im.save(encoded, 'PNG')
+    return encoded.getvalue()
+
+
+class _DyingHash(sdhash.Hash):
+    # Kills the worker process it runs in when asked to hash an image of a given height.
+
+    def __init__(self, fatal_height, **kwargs):
+        sdhash.Hash.__init__(self, **kwargs)
+        self._fatal_height = fatal_height
+
+    def hash_image(self, im):
+        if im.size[1] == self._fatal_height:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return sdhash.Hash.hash_image(self, im)
+
+
+class _Chunks(object):
+    """An async iterable over byte chunks, written without the async syntax."""
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        future = asyncio.get_event_loop().create_future()
+        try:
+            future.set_result(next(self._chunks))
+        except StopIteration:
+            future.set_exception(StopAsyncIteration())
+        return future
+
+
+@unittest.skipIf(asyncio is None, 'sdhash.aio requires Python 3')
+class AsyncHash(unittest.TestCase):
+    def setUp(self):
+        self.hasher = sdhash.Hash(standard_width=32, edge_width=0)
+        self.images = [util.build_random_color_image((32 + idx, 48), idx) for idx in range(6)]
+        self.data = [_encode(im) for im in self.images]
+        self.expected = [self.hasher.hash_image(Image.open(io.BytesIO(d))) for d in self.data]
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_hash_image(self):
+        async_hasher = sdhash.aio.AsyncHash(self.hasher, max_workers=2)
+        try:
+            self.assertEqual(async_hasher.max_workers, 2)
+            self.assertEqual(async_hasher.max_concurrency, 4)
+            self.assertEqual(
+                self.loop.run_until_complete(async_hasher.hash_image(self.data[0])),
+                self.expected[0])
+            self.assertEqual(
+                self.loop.run_until_complete(async_hasher.hash_many(self.data)),
+                self.expected)
+            self.assertEqual(async_hasher.in_flight, 0)
+        finally:
+            async_hasher.close()
+
+    def test_streams(self):
+        async_hasher = sdhash.aio.AsyncHash(self.hasher, max_workers=2, use_threads=True)
+        reader = asyncio.StreamReader(loop=self.loop)
+        reader.feed_data(self.data[1])
+        reader.feed_eof()
+        chunks = _Chunks([self.data[2][:100], self.data[2][100:]])
+        try:
+            self.assertEqual(
+                self.loop.run_until_complete(async_hasher.hash_many(
+                    [bytearray(self.data[0]), reader, chunks])),
+                self.expected[:3])
+        finally:
+            async_hasher.close()
+
+    def test_backpressure(self):
+        async_hasher = sdhash.aio.AsyncHash(self.hasher, max_workers=4, max_concurrency=2,
+            use_threads=True)
+        lock = threading.Lock()
+        running = [0]
+        max_running = [0]
+        work = async_hasher._work
+
+        def counting_work(data):
+            with lock:
+                running[0] += 1
+                max_running[0] = max(max_running[0], running[0])
+            time.sleep(0.01)
+            try:
+                return work(data)
+            finally:
+                with lock:
+                    running[0] -= 1
+
+        async_hasher._work = counting_work
+        try:
+            self.assertEqual(
+                self.loop.run_until_complete(async_hasher.hash_many(self.data)),
+                self.expected)
+            self.assertEqual(max_running[0], 2)
+        finally:
+            async_hasher.close()
+
+    def test_timeout_and_errors(self):
+        async_hasher = sdhash.aio.AsyncHash(self.hasher, max_workers=1, use_threads=True)
+        release = threading.Event()
+        work = async_hasher._work
+        async_hasher._work = lambda data: release.wait() and work(data)
+        try:
+            with self.assertRaises(asyncio.TimeoutError):
+                self.loop.run_until_complete(async_hasher.hash_image(self.data[0], timeout=0.05))
+            # The worker still holds the image, so its slot is still taken.
+            self.assertEqual(async_hasher.in_flight, 1)
+            release.set()
+            async_hasher._work = work
+            results = self.loop.run_until_complete(async_hasher.hash_many(
+                [self.data[0], b'not an image'], return_exceptions=True))
+            self.assertEqual(results[0], self.expected[0])
+            self.assertTrue(isinstance(results[1], IOError))
+            self.assertEqual(async_hasher.in_flight, 0)
+        finally:
+            async_hasher.close()
+
+    def test_worker_dies(self):
+        hasher = _DyingHash(35, standard_width=32, edge_width=0)
+        async_hasher = sdhash.aio.AsyncHash(hasher, max_workers=2)
+        try:
+            results = self.loop.run_until_complete(async_hasher.hash_many(self.data,
+                return_exceptions=True))
+            # Only the image which kills its worker fails, the others are hashed again on a new
+            # pool.
+            self.assertTrue(isinstance(results[3], concurrent.futures.process.BrokenProcessPool))
+            self.assertEqual(results[:3] + results[4:], self.expected[:3] + self.expected[4:])
+            self.assertEqual(
+                self.loop.run_until_complete(async_hasher.hash_image(self.data[0])),
+                self.expected[0])
+            self.assertEqual(async_hasher.in_flight, 0)
+        finally:
+            async_hasher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import binascii
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+import sdhash
+import sdhash.cache
+import tests.util as util
+
+
+def _encode(im):
+    encoded = io.BytesIO()
+    im.save(encoded, 'PNG')
+    return encoded.getvalue()
+
+
+class HashCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite')
+        self.hasher = sdhash.Hash(standard_width=32, edge_width=0)
+        self.data = [_encode(util.build_random_color_image((32 + idx, 48), idx))
+            for idx in range(8)]
+        self.expected = [self.hasher.hash_image(Image.open(io.BytesIO(d))) for d in self.data]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_memory_tier(self):
+        cache = sdhash.cache.HashCache(self.hasher, max_entries=2)
+
+        self.assertEqual([cache.hash_bytes(d) for d in self.data[:3]], self.expected[:3])
+        self.assertEqual(cache.misses, 3)
+        # The least recently used entry, for the first image, was evicted.
+        self.assertEqual(cache.hash_bytes(self.data[2]), self.expected[2])
+        self.assertEqual(cache.hash_bytes(self.data[1]), self.expected[1])
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.hash_bytes(self.data[0]), self.expected[0])
+        self.assertEqual(cache.misses, 4)
+
+    def test_cache_hits_skip_hashing(self):
+        cache = sdhash.cache.HashCache(self.hasher)
+        cache.hash_bytes(self.data[0])
+        # Bytes which are not an image can only be answered from the cache.
+        corrupt_key = cache.key(b'not an image')
+        cache._entries[corrupt_key] = 'cached'
+
+        self.assertEqual(cache.hash_bytes(b'not an image'), 'cached')
+        self.assertEqual(cache.hash_bytes(self.data[0]), self.expected[0])
+        self.assertEqual(cache.hits, 2)
+        self.assertEqual(cache.misses, 1)
+
+    def test_key_depends_on_params(self):
+        cache = sdhash.cache.HashCache(self.hasher)
+        other_cache = sdhash.cache.HashCache(sdhash.Hash(standard_width=32, edge_width=2))
+
+        self.assertEqual(cache.key(self.data[0]), cache.key(self.data[0]))
+        self.assertNotEqual(cache.key(self.data[0]), cache.key(self.data[1]))
+        self.assertNotEqual(cache.key(self.data[0]), other_cache.key(self.data[0]))
+
+    def test_disk_tier(self):
+        image_path = os.path.join(self.directory, 'image.png')
+        with open(image_path, 'wb') as image_file:
+            image_file.write(self.data[0])
+
+        with sdhash.cache.HashCache(self.hasher, path=self.path) as cache:
+            self.assertEqual(cache.hash_file(image_path), self.expected[0])
+            self.assertEqual(cache.misses, 1)
+
+        with sdhash.cache.HashCache(self.hasher, path=self.path) as cache:
+            self.assertEqual(cache.hash_file(image_path), self.expected[0])
+            self.assertEqual(cache.hash_file(image_path), self.expected[0])
+            self.assertEqual(cache.disk_hits, 1)
+            self.assertEqual(cache.hits, 1)
+            self.assertEqual(cache.misses, 0)
+            cache.clear()
+            self.assertEqual(cache.disk_bytes, 0)
+
+        with sdhash.cache.HashCache(self.hasher, path=self.path) as cache:
+            self.assertEqual(cache.hash_file(image_path), self.expected[0])
+            self.assertEqual(cache.misses, 1)
+
+    def test_disk_tier_with_byte_digests(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=0, digest_format='bytes')
+
+        with sdhash.cache.HashCache(hasher, path=self.path) as cache:
+            digest = cache.hash_bytes(self.data[0])
+        with sdhash.cache.HashCache(hasher, path=self.path) as cache:
+            self.assertEqual(cache.hash_bytes(self.data[0]), digest)
+            self.assertEqual(cache.disk_hits, 1)
+        self.assertEqual(binascii.hexlify(digest).decode('ascii'), self.expected[0])
+
+        # Entries are shared by hashers which only differ in their digest_format.
+        with sdhash.cache.HashCache(self.hasher, path=self.path) as cache:
+            self.assertEqual(cache.key(self.data[0]),
+                sdhash.cache.HashCache(hasher).key(self.data[0]))
+            self.assertEqual(cache.hash_bytes(self.data[0]), self.expected[0])
+            self.assertEqual(cache.disk_hits, 1)
+
+    def test_disk_hits_update_last_used(self):
+        with sdhash.cache.HashCache(self.hasher, max_entries=0, path=self.path) as cache:
+            for data in self.data[:2]:
+                cache.hash_bytes(data)
+            cache.hash_bytes(self.data[0])
+            self.assertEqual(cache.disk_hits, 1)
+            # The hit is only written to the database later, in a batch.
+            self.assertEqual(len(cache._pending_uses), 1)
+
+        with sdhash.cache.HashCache(self.hasher, path=self.path) as cache:
+            keys = [bytes(key) for (key,) in cache._connection.execute(
+                'SELECT key FROM hashes ORDER BY last_used ASC')]
+            self.assertEqual(keys, [cache.key(data) for data in reversed(self.data[:2])])
+
+    def test_disk_eviction(self):
+        # Room for about four entries.
+        with sdhash.cache.HashCache(self.hasher, max_entries=0, path=self.path,
+                max_bytes=4 * (20 + 32 + sdhash.cache._ENTRY_OVERHEAD)) as cache:
+            self.assertEqual([cache.hash_bytes(d) for d in self.data], self.expected)
+            self.assertTrue(cache.disk_bytes <= cache.max_bytes)
+            self.assertEqual(cache.hash_bytes(self.data[-1]), self.expected[-1])
+            self.assertEqual(cache.disk_hits, 1)
+            self.assertEqual(cache.hash_bytes(self.data[0]), self.expected[0])
+            self.assertEqual(cache.misses, len(self.data) + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import sdhash.cli
+import tests.util as util
+
+
+class Dedup(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for (idx, size) in enumerate([(32, 32), (64, 32), (32, 64)]):
+            im = util.build_random_color_image(size, idx)
+            for copy in range(idx + 1):
+                path = os.path.join(self.directory, 'image%d_%d.png' % (idx, copy))
+                im.save(path)
+                self.paths.append(path)
+        self.corrupt_path = os.path.join(self.directory, 'corrupt.png')
+        with open(self.corrupt_path, 'wb') as corrupt_file:
+            corrupt_file.write(b'not an image')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _run(self, argv, stdin=u''):
+        stdout = io.BytesIO() if str is bytes else io.StringIO()
+        stderr = io.BytesIO() if str is bytes else io.StringIO()
+        exit_code = sdhash.cli.main(argv, stdin=io.StringIO(stdin), stdout=stdout,
+            stderr=stderr)
+        self.assertEqual(exit_code, 0)
+        lines = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return (lines, stderr.getvalue())
+
+    def _check_duplicates(self, lines):
+        clusters = {}
+        for line in lines:
+            cluster = clusters.setdefault(line['digest'], set([line['original']]))
+            self.assertTrue(line['original'] in cluster)
+            cluster.add(line['duplicate'])
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(sorted(sorted(os.path.basename(path) for path in cluster)
+            for cluster in clusters.values()), [
+            ['image1_0.png', 'image1_1.png'],
+            ['image2_0.png', 'image2_1.png', 'image2_2.png'],
+            ])
+
+    def test_dedup_directory(self):
+        (lines, report) = self._run(['dedup', self.directory, '--processes', '2'])
+
+        self._check_duplicates(lines)
+        self.assertTrue('Hashed 6 images' in report)
+        self.assertTrue('found 3 duplicates, 1 errors' in report)
+
+    def test_dedup_stdin(self):
+        stdin = u''.join(u'%s\n' % path for path in self.paths)
+
+        (lines, report) = self._run(['dedup', '--processes', '2', '--chunk-size', '1'], stdin)
+
+        self._check_duplicates(lines)
+        self.assertTrue('Hashed 6 images' in report)
+
+    def test_sharded(self):
+        manifest_path = os.path.join(self.directory, 'manifest.txt')
+        with io.open(manifest_path, 'w', encoding='utf-8') as manifest:
+            manifest.write(u''.join(u'%s\n' % path for path in self.paths + [self.corrupt_path]))
+        run_dir = os.path.join(self.directory, 'runs')
+        os.mkdir(run_dir)
+
+        run_paths = []
+        reports = []
+        for shard in range(2):
+            run_prefix = os.path.join(run_dir, 'shard%d' % shard)
+            (_, report) = self._run(['hash-shard', '--shard', str(shard), '--num-shards', '2',
+                '--processes', '1', manifest_path, run_prefix])
+            run_paths.append(run_prefix + '.run00000')
+            reports.append(report)
+        (lines, _) = self._run(['merge'] + run_paths)
+
+        self.assertEqual(reports, ['Wrote 1 runs, 1 errors\n', 'Wrote 1 runs, 0 errors\n'])
+        self.assertEqual(sorted(sorted(os.path.basename(path) for path in line['paths'])
+            for line in lines), [
+            ['image1_0.png', 'image1_1.png'],
+            ['image2_0.png', 'image2_1.png', 'image2_2.png'],
+            ])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import numpy
+
+import sdhash.dct
+
+
+class Backends(unittest.TestCase):
+    def test_numpy_matches_fftpack(self):
+        random = numpy.random.RandomState(0)
+
+        for shape in [(96, 96), (1, 40), (300, 96), (7, 96, 64)]:
+            mat = numpy.float32(random.uniform(-128, 128, shape))
+            for size in [1, 4, 8]:
+                expected = sdhash.dct.fftpack_dct2(mat, size)
+                actual = sdhash.dct.numpy_dct2(mat, size)
+                self.assertEqual(actual.shape, expected.shape)
+                self.assertTrue(numpy.allclose(actual, expected, atol=1e-2),
+                    msg='Failed on shape %s and size %d' % (shape, size))
+
+    def test_dct_basis(self):
+        basis = sdhash.dct.dct_basis(16, 16)
+
+        self.assertTrue(numpy.allclose(basis.dot(basis.T), numpy.eye(16)))
+        self.assertEqual(sdhash.dct.dct_basis(16, 4).shape, (4, 16))
+        self.assertEqual(sdhash.dct.dct_basis(2, 4).shape, (2, 2))
+        self.assertTrue(sdhash.dct.dct_basis(16, 4) is sdhash.dct.dct_basis(16, 4))
+        self.assertFalse(sdhash.dct.dct_basis(16, 4).flags.writeable)
+
+
+class LazyImport(unittest.TestCase):
+    def _modules_after(self, statements):
+        script = '%s; import sys; sys.stdout.write(" ".join(sys.modules))' % statements
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script], cwd=root)
+        return output.decode('ascii').split()
+
+    def test_import_does_not_load_scipy(self):
+        modules = self._modules_after('import sdhash; sdhash.Hash()')
+
+        self.assertTrue('sdhash' in modules)
+        self.assertFalse('scipy' in modules)
+
+    def test_fftpack_backend_loads_scipy(self):
+        modules = self._modules_after('import sdhash; sdhash.Hash(dct_backend="fftpack")')
+
+        self.assertTrue('scipy.fftpack' in modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+import numpy
+
+import sdhash
+import sdhash.index
+import tests.util as util
+
+
+def _flip_bits(signature, num_bits, signature_bits, random):
+    flipped = signature.copy()
+    for position in random.choice(signature_bits, num_bits, replace=False):
+        flipped[position // 8] ^= 0x80 >> (position % 8)
+    return flipped
+
+
+class Index(unittest.TestCase):
+    def setUp(self):
+        self.hasher = sdhash.Hash()
+        self.signature_size = (self.hasher.signature_bits + 7) // 8
+        self.signatures = numpy.uint8(numpy.random.RandomState(0).randint(
+            0, 255, (500, self.signature_size)))
+
+    def test_construction(self):
+        index = sdhash.index.Index(self.hasher, num_blocks=8)
+
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.num_blocks, 8)
+        self.assertTrue(index.hasher is self.hasher)
+
+    def test_add(self):
+        index = sdhash.index.Index(self.hasher, initial_capacity=16)
+
+        for signature in self.signatures:
+            index.add(signature)
+        index.add(self.signatures[0], image_id=1000)
+
+        self.assertEqual(len(index), 501)
+        self.assertTrue((index.signatures[:500] == self.signatures).all())
+        self.assertEqual(list(index.ids), list(range(500)) + [1000])
+
+    def test_add_many(self):
+        index = sdhash.index.Index(self.hasher, initial_capacity=16)
+
+        index.add_many(self.signatures[:100])
+        index.add_many(self.signatures[100:], image_ids=range(1000, 1400))
+
+        self.assertEqual(len(index), 500)
+        self.assertTrue((index.signatures == self.signatures).all())
+        self.assertEqual(list(index.ids), list(range(100)) + list(range(1000, 1400)))
+
+    def test_query(self):
+        index = sdhash.index.Index(self.hasher, num_blocks=4)
+        index.add_many(self.signatures)
+        random = numpy.random.RandomState(0)
+
+        for radius in [0, 3, 4, 9, 40]:
+            for (row, num_flips) in [(0, 0), (17, 2), (123, 4), (321, 9)]:
+                query = _flip_bits(self.signatures[row], num_flips, self.hasher.signature_bits,
+                    random)
+                distances = sdhash.hamming_distance(self.signatures, query)
+                expected = sorted(((int(row), int(distances[row]))
+                    for row in numpy.flatnonzero(distances <= radius)),
+                    key=lambda match: (match[1], match[0]))
+                self.assertEqual(index.query(query, radius), expected)
+
+    def test_query_image(self):
+        index = sdhash.index.Index(self.hasher)
+        images = [util.build_random_color_image((64, 64 + idx), idx) for idx in range(5)]
+        for (idx, im) in enumerate(images):
+            index.add_image(im, image_id=10 + idx)
+
+        self.assertTrue((12, 0) in index.query_image(images[2], 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+import sdhash
+import sdhash.job
+import tests.util as util
+
+
+class Job(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for (idx, size) in enumerate([(32, 32), (64, 32), (32, 64), (48, 48)]):
+            im = util.build_random_color_image(size, idx)
+            for copy in range(idx + 1):
+                path = os.path.join(self.directory, 'image%d_%d.png' % (idx, copy))
+                im.save(path)
+                self.paths.append(path)
+        self.paths.append(os.path.join(self.directory, 'missing.png'))
+        self.manifest_path = os.path.join(self.directory, 'manifest.txt')
+        with io.open(self.manifest_path, 'w', encoding='utf-8') as manifest:
+            for path in self.paths:
+                manifest.write(u'%s\n' % path)
+        self.work_dir = os.path.join(self.directory, 'runs')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _check_clusters(self, clusters):
+        self.assertEqual(sorted(sorted(os.path.basename(path) for path in paths)
+            for (_, paths) in clusters), [
+            ['image1_0.png', 'image1_1.png'],
+            ['image2_0.png', 'image2_1.png', 'image2_2.png'],
+            ['image3_0.png', 'image3_1.png', 'image3_2.png', 'image3_3.png'],
+            ])
+
+    def test_shard_paths(self):
+        shards = [list(sdhash.job.shard_paths(self.manifest_path, shard, 3)) for shard in range(3)]
+
+        self.assertEqual(shards[1], self.paths[1::3])
+        self.assertEqual(sorted(sum(shards, [])), sorted(self.paths))
+
+    def test_hash_shard(self):
+        os.mkdir(self.work_dir)
+        errors = []
+        run_prefix = os.path.join(self.work_dir, 'shard0')
+
+        run_paths = sdhash.job.hash_shard(self.manifest_path, 0, 1, run_prefix, processes=2,
+            run_size=3, on_error=lambda path, error: errors.append(path))
+
+        self.assertEqual(run_paths, ['%s.run%05d' % (run_prefix, idx) for idx in range(4)])
+        self.assertEqual(errors, [self.paths[-1]])
+        records = list(sdhash.job.merge_runs(run_paths))
+        self.assertEqual(records, sorted(records))
+        self.assertEqual(sorted(path for (_, path) in records), sorted(self.paths[:-1]))
+        hasher = sdhash.Hash()
+        for (digest, path) in records:
+            self.assertEqual(digest, hasher.hash_image(Image.open(path)))
+        self._check_clusters(sdhash.job.find_clusters(run_paths))
+
+        # Running a shard again replaces its runs.
+        run_paths = sdhash.job.hash_shard(self.manifest_path, 0, 1, run_prefix, processes=1,
+            on_error=lambda path, error: None)
+
+        self.assertEqual(run_paths, [run_prefix + '.run00000'])
+        self.assertEqual(sorted(os.listdir(self.work_dir)), ['shard0.run00000'])
+        self._check_clusters(sdhash.job.find_clusters(run_paths))
+
+    def test_hash_shard_integer_digests(self):
+        os.mkdir(self.work_dir)
+        hasher = sdhash.Hash(digest_format='int')
+
+        run_paths = sdhash.job.hash_shard(self.manifest_path, 0, 1,
+            os.path.join(self.work_dir, 'shard0'), hasher=hasher, processes=1,
+            on_error=lambda path, error: None)
+
+        self.assertEqual(sorted(digest for (digest, _) in sdhash.job.merge_runs(run_paths)),
+            sorted(sdhash.Hash().hash_image(Image.open(path)) for path in self.paths[:-1]))
+
+    def test_run_local(self):
+        run_paths = sdhash.job.run_local(self.manifest_path, self.work_dir, 3, run_size=2)
+
+        self.assertEqual(len(run_paths), 6)
+        self.assertTrue(all(os.path.dirname(path) == self.work_dir for path in run_paths))
+        self._check_clusters(sdhash.job.find_clusters(run_paths))
+
+    def test_find_clusters_empty(self):
+        self.assertEqual(list(sdhash.job.find_clusters([])), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import shutil
+import signal
+import tempfile
+import unittest
+
+from PIL import Image
+
+import sdhash
+import sdhash.parallel
+import tests.util as util
+
+
+class _DyingHash(sdhash.Hash):
+    # Kills the worker process it runs in when asked to hash an image of a given height.
+
+    def __init__(self, fatal_height, **kwargs):
+        sdhash.Hash.__init__(self, **kwargs)
+        self._fatal_height = fatal_height
+
+    def hash_image(self, im):
+        if im.size[1] == self._fatal_height:
+            os.kill(os.getpid(), signal.SIGKILL)
+        return sdhash.Hash.hash_image(self, im)
+
+
+class HashFiles(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.paths = []
+        for idx in range(10):
+            path = os.path.join(self.directory, 'image%02d.png' % idx)
+            util.build_blocks_image((32 + idx, 48), idx).save(path)
+            self.paths.append(path)
+        self.corrupt_path = os.path.join(self.directory, 'corrupt.png')
+        with open(self.corrupt_path, 'wb') as corrupt_file:
+            corrupt_file.write(b'not an image')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hash_files(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=0)
+        errors = []
+
+        results = dict(sdhash.parallel.hash_files(
+            self.paths + [self.corrupt_path], hasher=hasher, processes=2, chunk_size=3,
+            max_pending_chunks=1, on_error=lambda path, error: errors.append(path)))
+
+        expected = dict((path, hasher.hash_image(Image.open(path))) for path in self.paths)
+        self.assertEqual(results, expected)
+        self.assertEqual(errors, [self.corrupt_path])
+
+    def test_worker_dies(self):
+        hasher = _DyingHash(35, standard_width=32, edge_width=0)
+        errors = []
+
+        # The image 3 kills its worker, so the chunk of images 3, 4 and 5 is lost.
+        results = dict(sdhash.parallel.hash_files(
+            self.paths + [self.corrupt_path], hasher=hasher, processes=2, chunk_size=3,
+            on_error=lambda path, error: errors.append(path)))
+
+        expected = dict((path, hasher.hash_image(Image.open(path)))
+            for path in self.paths[:3] + self.paths[6:])
+        self.assertEqual(results, expected)
+        self.assertEqual(sorted(errors), sorted(self.paths[3:6] + [self.corrupt_path]))
+
+    def test_hash_directory(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=0)
+
+        results = dict(sdhash.parallel.hash_directory(
+            self.directory, hasher=hasher, processes=2, on_error=lambda path, error: None))
+
+        self.assertEqual(sorted(results.keys()), self.paths)
+
+    def test_find_duplicates(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=0, dct_core_width=2)
+        copy_path = os.path.join(self.directory, 'image02_copy.png')
+        shutil.copy(self.paths[2], copy_path)
+        paths = sorted(self.paths + [copy_path])
+        errors = []
+
+        classes = sdhash.parallel.find_duplicates(paths + [self.corrupt_path], hasher=hasher,
+            processes=2, chunk_size=3, on_error=lambda path, error: errors.append(path))
+
+        self.assertEqual(classes, [[path] for path in self.paths[:2]] +
+            [[self.paths[2], copy_path]] + [[path] for path in self.paths[3:]])
+        self.assertEqual(errors, [self.corrupt_path])
+
+        for max_distance in [0, 40]:
+            classes = sdhash.parallel.find_duplicates(reversed(paths), hasher=hasher,
+                max_distance=max_distance, processes=2)
+
+            expected = hasher.find_duplicates([Image.open(path) for path in paths], max_distance)
+            self.assertEqual(classes, [[paths[idx] for idx in path_class] for path_class in expected])
+
+    def test_walk_files(self):
+        self.assertEqual(list(sdhash.parallel.walk_files(self.directory)),
+            [self.corrupt_path] + self.paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+import unittest
+
+import numpy
+from PIL import Image
+
+import sdhash.resample
+
+
+def _pil_resize(mat, out_width, out_height):
+    im = Image.fromarray(numpy.float32(mat), mode='F')
+    return numpy.asarray(im.resize((out_width, out_height), Image.LANCZOS))
+
+
+class Resize(unittest.TestCase):
+    SIZES = [
+        ((96, 128), (128, 96)),
+        ((480, 640), (128, 96)),
+        ((640, 480), (128, 170)),
+        ((5000, 200), (128, 3200)),
+        ((17, 23), (128, 94)),
+        ((300, 300), (300, 150)),
+        ((1, 50), (7, 1)),
+        ]
+
+    def test_matches_pil(self):
+        random = numpy.random.RandomState(0)
+
+        for ((height, width), (out_width, out_height)) in self.SIZES:
+            mat = random.uniform(0, 255, (height, width)).astype(numpy.float32)
+            self.assertTrue(numpy.allclose(sdhash.resample.resize(mat, out_width, out_height),
+                _pil_resize(mat, out_width, out_height), rtol=0, atol=1e-3),
+                msg='Failed on %dx%d to %dx%d' % (width, height, out_width, out_height))
+
+    def test_window(self):
+        mat = numpy.random.RandomState(0).uniform(0, 255, (640, 480)).astype(numpy.float32)
+        full = sdhash.resample.resize(mat, 128, 170)
+
+        for (rows, cols) in [((16, 154), (16, 112)), ((0, 170), (0, 128)), ((50, 51), (0, 1)),
+                ((10, 10), (3, 90))]:
+            window = sdhash.resample.resize(mat, 128, 170, rows, cols)
+            self.assertEqual(window.dtype, numpy.float32)
+            self.assertTrue((window == full[rows[0]:rows[1], cols[0]:cols[1]]).all())
+
+    def test_stack(self):
+        mats = numpy.random.RandomState(0).uniform(0, 255, (3, 200, 300)).astype(numpy.float32)
+
+        resized = sdhash.resample.resize(mats, 128, 84, (8, 76), (8, 120))
+
+        self.assertEqual(resized.shape, (3, 68, 112))
+        for (mat, mat_resized) in zip(mats, resized):
+            self.assertTrue(numpy.allclose(
+                sdhash.resample.resize(mat, 128, 84, (8, 76), (8, 120)), mat_resized,
+                rtol=0, atol=1e-4))
+
+    def test_plan(self):
+        (in_start, in_stop, blocks) = sdhash.resample.plan(1000, 100, 10, 90)
+
+        self.assertTrue(sdhash.resample.plan(1000, 100, 10, 90)[2] is blocks)
+        self.assertTrue(0 < in_start < in_stop < 1000)
+        self.assertEqual(sum(out_stop - out_start for (out_start, out_stop, _, _, _) in blocks), 80)
+        for (_, _, _, _, weights) in blocks:
+            self.assertFalse(weights.flags.writeable)
+            self.assertTrue(numpy.allclose(weights.sum(axis=1), 1))
+        self.assertEqual(sdhash.resample.plan(128, 128, 16, 112), (16, 112, None))
+
+    def test_weights(self):
+        mat = numpy.random.RandomState(0).uniform(0, 255, (640, 480))
+
+        for (out_height, rows) in [(170, (16, 154)), (640, (10, 600)), (900, (0, 0))]:
+            weights = sdhash.resample.weights(640, out_height, rows[0], rows[1])
+            self.assertEqual(weights.shape, (rows[1] - rows[0], 640))
+            self.assertTrue(numpy.allclose(numpy.dot(weights, mat),
+                sdhash.resample.resize(mat, 480, out_height, rows), rtol=0, atol=1e-3))
+
+    def test_plan_cache(self):
+        cache = sdhash.resample.PlanCache(3)
+
+        for key in range(4):
+            cache.put(key, str(key))
+        self.assertEqual(len(cache), 3)
+        self.assertEqual(cache.get(0), None)
+        self.assertEqual(cache.get(1), '1')
+        cache.put(4, '4')
+        self.assertEqual(cache.get(1), '1')
+        self.assertEqual(cache.get(2), None)
+        self.assertEqual(cache.get(4), '4')
+
+    def test_plans_bounded(self):
+        for in_size in range(1000, 1000 + 2 * sdhash.resample.MAX_PLANS):
+            sdhash.resample.plan(in_size, 128, 0, 128)
+
+        self.assertEqual(len(sdhash.resample._PLANS), sdhash.resample.MAX_PLANS)
+
+
+if __name__ == '__main__':
+    unittest.main()
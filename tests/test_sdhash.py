@@ -1,4 +1,6 @@
+import binascii
 import hashlib
+import io
 import logging
 import os
 import unittest
@@ -11,6 +13,7 @@ from PIL import Image
 
 import sdhash
 import tests.gen_test_data as gen_test_data
+import tests.util as util
 
 
 logging.basicConfig(level=logging.INFO)
@@ -54,18 +57,13 @@ def _build_test_image(size, edge_width, core):
         row_idx += 1
 
     mat_core = fftpack.idct(fftpack.idct(mat_dct, norm='ortho').T, norm='ortho').T
-    mat = numpy.float32(numpy.random.randint(0, 127, size))
+    mat = numpy.float32(numpy.random.RandomState(0).randint(0, 127, size))
     mat[edge_width:size[0] - edge_width, edge_width:size[1] - edge_width] = mat_core
     mat += 128
 
     return Image.fromarray(numpy.float32(mat).T, mode='F')
 
 
-def _build_random_color_image(size):
-    mat = numpy.uint8(numpy.random.randint(0, 255, (size[0], size[1], 3)))
-    return Image.fromarray(mat, mode='RGB')
-
-
 def _md5_sequence(*args):
     md5hasher = hashlib.md5()
 
@@ -98,7 +96,9 @@ class Core(TableTestCase):
             key_frames=[0, 4, 9],
             height_buckets=128,
             dct_core_width=8,
-            dct_coeff_buckets=256)
+            dct_coeff_buckets=256,
+            fast_decode=True,
+            dct_backend='fftpack')
 
         self.assertEquals(hasher.standard_width, 256)
         self.assertEquals(hasher.edge_width, 24)
@@ -108,6 +108,8 @@ class Core(TableTestCase):
         self.assertEquals(hasher.dct_core_width, 8)
         self.assertEquals(hasher.dct_coeff_buckets, 256)
         self.assertEquals(hasher.dct_coeff_split, 8)
+        self.assertEquals(hasher.fast_decode, True)
+        self.assertEquals(hasher.dct_backend, 'fftpack')
 
     def test_defaults_have_changed(self):
         hasher = sdhash.Hash()
@@ -120,6 +122,33 @@ class Core(TableTestCase):
         self.assertEquals(hasher.dct_core_width, 4)
         self.assertEquals(hasher.dct_coeff_buckets, 128)
         self.assertEquals(hasher.dct_coeff_split, 16)
+        self.assertEquals(hasher.fast_decode, False)
+        self.assertEquals(hasher.dct_backend, 'numpy')
+        self.assertEquals(hasher.digest, 'md5')
+        self.assertEquals(hasher.digest_format, 'hex')
+        self.assertEquals(hasher.digest_size, 16)
+
+    def test_params(self):
+        hasher = sdhash.Hash(standard_width=256, edge_width=24, key_frames=[0, 4, 9],
+            height_buckets=128, dct_core_width=8, dct_coeff_buckets=256, fast_decode=True,
+            dct_backend='numpy', digest_format='int', max_pixels=1000000)
+
+        self.assertEquals(hasher.params, {
+            'standard_width': 256,
+            'edge_width': 24,
+            'key_frames': [0, 4, 9],
+            'height_buckets': 128,
+            'dct_core_width': 8,
+            'dct_coeff_buckets': 256,
+            'fast_decode': True,
+            'dct_backend': 'numpy',
+            'digest': 'md5',
+            'digest_format': 'int',
+            'orientation_invariant': False,
+            'max_pixels': 1000000,
+            'max_decoded_pixels': None,
+            })
+        self.assertEquals(sdhash.Hash(**hasher.params).params, hasher.params)
 
     LOWER_BOUND_FP_RATE_TEST_CASES = [
         ({'dct_core_width': 2, 'dct_coeff_buckets': 128}, 1.0 / (2 * 2 * 128)),
@@ -252,6 +281,41 @@ class ImageSynthetic(TableTestCase):
         self.assertEqual(hash_code, md5hasher.hexdigest(),
             msg='Failed on "%s"' % test_case['name'])
 
+    @tabletest.tabletest(HASH_IMAGE_TEST_CASES)
+    def test_hash_image_fftpack_backend(self, test_case):
+        md5hasher = _md5_sequence('IMAGE', *test_case['sequence'])
+        params = dict(test_case['hasher'].params, dct_backend='fftpack')
+        hash_code = sdhash.Hash(**params).hash_image(test_case['image'])
+        self.assertEqual(hash_code, md5hasher.hexdigest(),
+            msg='Failed on "%s"' % test_case['name'])
+
+    @tabletest.tabletest(HASH_IMAGE_TEST_CASES)
+    def test_coefficients(self, test_case):
+        coefficients = test_case['hasher'].coefficients(test_case['image'])
+        self.assertEqual(list(coefficients), [int(value) for value in test_case['sequence']],
+            msg='Failed on "%s"' % test_case['name'])
+
+    def test_signature(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=0, dct_core_width=2,
+            dct_coeff_buckets=256)
+        reference = _build_test_image((32, 32), 0, [[1002, 412], [-212, 206]])
+        modified = _build_test_image((32, 32), 0, [[1010, 412], [-212, 206]])
+        different = _build_test_image((32, 32), 0, [[-1002, 412], [212, -206]])
+
+        signatures = numpy.array([hasher.signature(im) for im in [reference, modified, different]])
+
+        self.assertEqual(hasher.signature_bits, 9 + 4 * 8)
+        self.assertEqual(signatures.shape, (3, 6))
+        self.assertEqual(signatures.dtype, numpy.uint8)
+        self.assertEqual(sdhash.hamming_distance(signatures[0], signatures[0]), 0)
+        self.assertEqual(sdhash.hamming_distance(signatures[0], signatures[1]), 1)
+        self.assertTrue(sdhash.hamming_distance(signatures[0], signatures[2]) > 4)
+        self.assertEqual(list(sdhash.hamming_distance(signatures, signatures[0])),
+            [0, 1, sdhash.hamming_distance(signatures[0], signatures[2])])
+        self.assertTrue((hasher.pack_signatures(
+            [hasher.coefficients(im) for im in [reference, modified, different]]) ==
+            signatures).all())
+
     TEST_DUPLICATE_TEST_CASES = _flatten_for_test_duplicate([
         {
             'hasher': sdhash.Hash(standard_width=32, edge_width=0, dct_core_width=2),
@@ -342,7 +406,7 @@ class ImageSynthetic(TableTestCase):
             },
         {
             'hasher': sdhash.Hash(standard_width=16, edge_width=0, dct_core_width=2),
-            'reference': _build_random_color_image((16, 16)),
+            'reference': util.build_random_color_image((16, 16), 0),
             'modified': [
                 {
                     'name': 'Color components get ingored',
@@ -363,6 +427,342 @@ class ImageSynthetic(TableTestCase):
         self.assertTrue(hasher.test_duplicate(reference, modified),
              msg='Failed on "%s"' % test_case['name'])
 
+    def test_hash_images(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        images = [
+            _build_test_image((32, 32), 2, [[1002, 412], [412, 206]]),
+            _build_test_image((32, 64), 2, [[1002, 412], [-212, 206]]),
+            util.build_random_color_image((16, 16), 1),
+            _build_test_image((32, 32), 2, [[2048, 412], [-1080, 206]]),
+            util.build_random_color_image((48, 24), 2),
+            _build_test_image((32, 4096), 0, [[0]]),
+            ]
+
+        self.assertEqual(hasher.hash_images(images), [hasher.hash_image(im) for im in images])
+        self.assertEqual(hasher.hash_images([]), [])
+
+    def test_stats(self):
+        stats = sdhash.HashStats()
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        hasher_with_stats = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2,
+            stats=stats)
+        images = [util.build_random_color_image((16, 16), 1),
+            util.build_random_color_image((48, 24), 2)]
+
+        self.assertEqual([hasher_with_stats.hash_image(im) for im in images],
+            [hasher.hash_image(im) for im in images])
+        self.assertEqual(hasher_with_stats.hash_images(images), hasher.hash_images(images))
+
+        snapshot = stats.snapshot()
+        self.assertTrue(hasher_with_stats.stats is stats)
+        self.assertEqual(snapshot['counters'], {
+            'images_hashed': 4,
+            'frames_hashed': 4,
+            'pixels_decoded': 2 * (16 * 16 + 48 * 24),
+            'bytes_decoded': 2 * 3 * (16 * 16 + 48 * 24),
+            })
+        for stage in ['decode', 'convert', 'resize', 'quantize', 'digest']:
+            self.assertEqual(snapshot['latencies'][stage]['count'], 4)
+            self.assertEqual(sum(snapshot['latencies'][stage]['buckets']), 4)
+        self.assertEqual(snapshot['latencies']['dct']['count'], 4)
+        self.assertEqual(len(snapshot['latency_bounds']) + 1,
+            len(snapshot['latencies']['dct']['buckets']))
+
+        stats.reset()
+        self.assertEqual(stats.snapshot()['counters'], {})
+
+    def test_fast_decode(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        fast_hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2,
+            fast_decode=True)
+        reference = _build_test_image((512, 384), 2, [[1002, 412], [412, 206]])
+        jpeg = io.BytesIO()
+        reference.convert('L').save(jpeg, 'JPEG', quality=95)
+
+        self.assertEqual(fast_hasher.hash_image(reference), hasher.hash_image(reference))
+        im = Image.open(io.BytesIO(jpeg.getvalue()))
+        fast_hasher.hash_image(im)
+        self.assertEqual(im.size, (64, 48))
+
+    def test_hash_array(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        random = numpy.random.RandomState(0)
+        gray = numpy.uint8(random.randint(0, 255, (48, 64)))
+        color = numpy.uint8(random.randint(0, 255, (48, 64, 3)))
+        color_alpha = numpy.uint8(random.randint(0, 255, (48, 64, 4)))
+        gray_float = numpy.float32(random.uniform(0, 255, (48, 64)))
+
+        self.assertEqual(hasher.hash_array(gray), hasher.hash_image(Image.fromarray(gray, 'L')))
+        self.assertEqual(hasher.hash_array(color), hasher.hash_image(Image.fromarray(color, 'RGB')))
+        self.assertEqual(hasher.hash_array(color_alpha),
+            hasher.hash_image(Image.fromarray(color_alpha, 'RGBA')))
+        self.assertEqual(hasher.hash_array(gray_float),
+            hasher.hash_image(Image.fromarray(gray_float, 'F')))
+        self.assertEqual(hasher.hash_array(numpy.float64(gray_float)),
+            hasher.hash_array(gray_float))
+        self.assertEqual(hasher.hash_array(color[:, ::-1]),
+            hasher.hash_image(Image.fromarray(color, 'RGB').transpose(Image.FLIP_LEFT_RIGHT)))
+
+    def test_hash_arrays(self):
+        stats = sdhash.HashStats()
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2, stats=stats)
+        random = numpy.random.RandomState(0)
+        arrays = [
+            numpy.uint8(random.randint(0, 255, (48, 64))),
+            numpy.uint8(random.randint(0, 255, (48, 64, 3))),
+            numpy.float32(random.uniform(0, 255, (48, 64))),
+            numpy.uint8(random.randint(0, 255, (96, 32))),
+            numpy.uint8(random.randint(0, 255, (5000, 40))),
+            ]
+
+        self.assertEqual(hasher.hash_arrays(arrays), [hasher.hash_array(arr) for arr in arrays])
+        self.assertEqual(hasher.hash_arrays([]), [])
+        self.assertEqual(stats.snapshot()['counters']['images_hashed'], 2 * len(arrays))
+
+    def test_hash_buffer(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        random = numpy.random.RandomState(0)
+        gray = numpy.uint8(random.randint(0, 255, (48, 64)))
+        color = numpy.uint8(random.randint(0, 255, (48, 64, 3)))
+        gray_float = numpy.float32(random.uniform(0, 255, (48, 64)))
+
+        self.assertEqual(hasher.hash_buffer(gray.tobytes(), 64, 48), hasher.hash_array(gray))
+        self.assertEqual(hasher.hash_buffer(bytearray(color.tobytes()), 64, 48, 'RGB'),
+            hasher.hash_array(color))
+        self.assertEqual(hasher.hash_buffer(memoryview(gray_float.tobytes()), 64, 48, 'F'),
+            hasher.hash_array(gray_float))
+
+    def test_digest_formats(self):
+        image = _build_test_image((32, 32), 2, [[1002, 412], [412, 206]])
+        hex_digest = sdhash.Hash(standard_width=32, edge_width=2).hash_image(image)
+
+        for digest_format in ['hex', 'bytes', 'int']:
+            hasher = sdhash.Hash(standard_width=32, edge_width=2, digest_format=digest_format)
+            digest = hasher.hash_image(image)
+            self.assertEqual(hasher.hash_images([image]), [digest])
+            self.assertEqual(hasher.digest_bytes(digest), binascii.unhexlify(hex_digest))
+            self.assertEqual(hasher.format_digest(hasher.digest_bytes(digest)), digest)
+        self.assertEqual(
+            sdhash.Hash(standard_width=32, edge_width=2, digest_format='int').hash_image(image),
+            int(hex_digest, 16))
+
+    @unittest.skipIf(not hasattr(hashlib, 'blake2b'), 'BLAKE2 needs Python 3.6 or later')
+    def test_blake2b_digest(self):
+        image = _build_test_image((32, 32), 2, [[1002, 412], [412, 206]])
+
+        for (digest, digest_size) in [('blake2b-64', 8), ('blake2b-128', 16)]:
+            hasher = sdhash.Hash(standard_width=32, edge_width=2, digest=digest,
+                digest_format='bytes')
+            expected = hashlib.blake2b(digest_size=digest_size)
+            expected.update(b'IMAGE')
+            expected.update(hasher.coefficients(image).astype('<i2').tobytes())
+            self.assertEqual(hasher.hash_image(image), expected.digest())
+            self.assertEqual(hasher.digest_size, digest_size)
+
+    def test_animation(self):
+        stats = sdhash.HashStats()
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2, stats=stats)
+        # Frames are flat gray, with a different level each, so every frame has its own hash.
+        frames = [Image.new('L', (48, 32), 10 * frame_idx) for frame_idx in range(7)]
+        gif = io.BytesIO()
+        frames[0].save(gif, 'GIF', save_all=True, append_images=frames[1:])
+
+        # Only the key frames before the end, 0 and 4, go into the hash.
+        expected = hashlib.md5()
+        expected.update('VIDEO')
+        for frame_idx in [0, 4]:
+            (height_small, mat_core) = hasher._first_frame_core(frames[frame_idx])
+            hasher._coeffs_hash(height_small, hasher._dct_core(mat_core), expected)
+
+        im = Image.open(io.BytesIO(gif.getvalue()))
+        self.assertEqual(hasher.hash_image(im), expected.hexdigest())
+        self.assertEqual(im.tell(), 0)
+        self.assertNotEqual(hasher.hash_image(frames[0]), expected.hexdigest())
+        self.assertEqual(stats.snapshot()['counters']['frames_seeked'], 4)
+        self.assertEqual(stats.snapshot()['counters']['animations_hashed'], 1)
+
+        images = [frames[0], Image.open(io.BytesIO(gif.getvalue())), frames[1]]
+        self.assertEqual(hasher.hash_images(images), [hasher.hash_image(im) for im in images])
+
+    def test_find_duplicates(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        originals = [util.build_random_color_image((48, 64), seed) for seed in range(3)]
+        images = [originals[0], originals[1], originals[0].copy(), originals[2],
+            originals[1].copy(), originals[0].copy()]
+
+        self.assertEqual(hasher.find_duplicates(images), [[0, 2, 5], [1, 4], [3]])
+        self.assertEqual(hasher.find_duplicates(images, max_distance=0), [[0, 2, 5], [1, 4], [3]])
+        self.assertEqual(hasher.find_duplicates([]), [])
+        self.assertEqual(hasher.find_duplicates([], max_distance=1), [])
+
+    def test_distance_matrix(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        images = [util.build_random_color_image(size, seed)
+            for (seed, size) in enumerate([(48, 64), (48, 64), (64, 48), (30, 80), (48, 64)])]
+        coefficients = numpy.array([hasher.coefficients(im) for im in images], dtype=numpy.int32)
+
+        distances = hasher.distance_matrix(images)
+
+        self.assertEqual(distances.dtype, numpy.int32)
+        for row in range(len(images)):
+            for col in range(len(images)):
+                self.assertEqual(distances[row, col],
+                    numpy.abs(coefficients[row] - coefficients[col]).sum())
+        block_values = sdhash._DISTANCE_BLOCK_VALUES
+        try:
+            sdhash._DISTANCE_BLOCK_VALUES = 2 * len(images) * coefficients.shape[1]
+            self.assertTrue((sdhash.coefficient_distances(coefficients) == distances).all())
+        finally:
+            sdhash._DISTANCE_BLOCK_VALUES = block_values
+        # Classes are the connected groups of images close enough, even through others.
+        (row, col) = (0, 1)
+        max_distance = distances[row, col]
+        classes = sdhash.distance_classes(distances, max_distance)
+        self.assertTrue(any(row in image_class and col in image_class for image_class in classes))
+        self.assertEqual(hasher.find_duplicates(images, max_distance), classes)
+        self.assertEqual(sdhash.distance_classes(numpy.array([[0, 3, 9], [3, 0, 4], [9, 4, 0]]), 4),
+            [[0, 1, 2]])
+        self.assertEqual(sdhash.distance_classes(numpy.array([[0, 3, 9], [3, 0, 5], [9, 5, 0]]), 4),
+            [[0, 1], [2]])
+        self.assertEqual(sdhash.digest_classes(['a', 'b', 'a', 'c', 'c']), [[0, 2], [1], [3, 4]])
+
+    def test_orientation_invariant(self):
+        hasher = sdhash.Hash(orientation_invariant=True)
+        transposes = [Image.FLIP_LEFT_RIGHT, Image.FLIP_TOP_BOTTOM, Image.ROTATE_90,
+            Image.ROTATE_180, Image.ROTATE_270, Image.TRANSPOSE]
+        # Smooth images, so the coefficients are far from the bucket boundaries.
+        images = [util.build_random_color_image((6, 8), seed).resize(size, Image.BICUBIC)
+            for (seed, size) in enumerate([(300, 200), (200, 300), (256, 256), (180, 500)])]
+
+        for im in images:
+            digest = hasher.hash_image(im)
+            self.assertTrue(digest in hasher.orientation_digests(im))
+            if im.size[0] <= im.size[1]:
+                # Only landscape images are transposed first.
+                self.assertEqual(hasher.orientation_digests(im)[0], sdhash.Hash().hash_image(im))
+            for transpose in transposes:
+                self.assertEqual(hasher.hash_image(im.transpose(transpose)), digest)
+                self.assertEqual(hasher.hash_array(numpy.asarray(im.transpose(transpose))),
+                    digest)
+
+        # The orientation digests follow the flips of the image.
+        im = images[1]
+        digests = hasher.orientation_digests(im)
+        self.assertEqual(len(set(digests)), 8)
+        for (idx, transpose) in enumerate(
+                [Image.FLIP_LEFT_RIGHT, Image.FLIP_TOP_BOTTOM, Image.ROTATE_180]):
+            self.assertEqual(hasher.orientation_digests(im.transpose(transpose))[0],
+                digests[idx + 1])
+        self.assertEqual(hasher.coefficients(im).tolist(),
+            hasher.coefficients(im.transpose(Image.ROTATE_90)).tolist())
+
+    def test_window_digests(self):
+        hasher = sdhash.Hash()
+        crops = [(0.1, 0, 0, 0), (0, 0.05, 0, 0.05), (0.05, 0.1, 0.05, 0)]
+        window_hits = 0
+        plain_hits = 0
+
+        for seed in range(20):
+            im = util.build_random_color_image((6, 8), seed).resize((400, 300), Image.BICUBIC)
+            digest = hasher.hash_image(im)
+            digests = hasher.window_digests(im, crops)
+            self.assertTrue(digest in digests)
+            self.assertTrue(len(digests) <= 1 + len(crops))
+            for (left, top, right, bottom) in crops:
+                cropped_digest = hasher.hash_image(im.crop((int(left * 400), int(top * 300),
+                    400 - int(right * 400), 300 - int(bottom * 300))))
+                window_hits += cropped_digest in digests
+                plain_hits += cropped_digest == digest
+
+        # Windows are resized as the cropped images are, so only floating point rounding can
+        # move a coefficient across a bucket boundary.
+        self.assertTrue(window_hits >= 20 * len(crops) - 2)
+        self.assertTrue(window_hits > plain_hits)
+
+        frames = [util.build_random_color_image((64, 48), seed) for seed in range(6)]
+        gif = io.BytesIO()
+        frames[0].save(gif, 'GIF', save_all=True, append_images=frames[1:])
+        im = Image.open(io.BytesIO(gif.getvalue()))
+        digests = hasher.window_digests(im)
+        self.assertEqual(im.tell(), 0)
+        self.assertTrue(hasher.hash_image(im) in digests)
+
+        hasher = sdhash.Hash(orientation_invariant=True)
+        im = util.build_random_color_image((6, 8), 0).resize((300, 200), Image.BICUBIC)
+        self.assertEqual(hasher.window_digests(im.transpose(Image.ROTATE_90)),
+            hasher.window_digests(im))
+        # Crops are of the image transposed to portrait, and landscape windows are transposed
+        # as well.
+        crops = [(0.3, 0, 0, 0), (0, 0.5, 0, 0.1)]
+        window_hits = 0
+        for seed in range(5):
+            im = util.build_random_color_image((6, 8), seed).resize((400, 300), Image.BICUBIC)
+            digests = hasher.window_digests(im, crops)
+            portrait = im.transpose(Image.TRANSPOSE)
+            for (left, top, right, bottom) in crops:
+                window_hits += hasher.hash_image(portrait.crop((int(left * 300), int(top * 400),
+                    300 - int(right * 300), 400 - int(bottom * 400)))) in digests
+        self.assertTrue(window_hits >= 5 * len(crops) - 1)
+
+        hasher = sdhash.Hash(standard_width=32, edge_width=0)
+        im = util.build_random_color_image((6, 8), 0)
+        for width in range(40, 40 + sdhash._MAX_WINDOW_PLANS + 10):
+            hasher.window_digests(im.resize((width, 30)))
+        self.assertEqual(len(sdhash._WINDOW_PLANS), sdhash._MAX_WINDOW_PLANS)
+
+    def test_max_pixels(self):
+        stats = sdhash.HashStats()
+        hasher = sdhash.Hash(max_pixels=200000, max_decoded_pixels=3000000, stats=stats)
+        im = util.build_random_color_image((6, 8), 0).resize((2000, 1500), Image.BICUBIC)
+        png = io.BytesIO()
+        im.save(png, 'PNG')
+
+        # Shrunk by four, with a box filter, before the usual resize.
+        coefficients = hasher.coefficients(Image.open(io.BytesIO(png.getvalue())))
+        self.assertTrue(numpy.abs(coefficients - sdhash.Hash().coefficients(im)).sum() <= 8)
+        self.assertEqual(stats.snapshot()['counters']['frames_shrunk'], 1)
+        self.assertEqual(hasher.hash_image(im.convert('P')),
+            hasher.hash_image(im.convert('P').convert('L')))
+
+        im = util.build_random_color_image((6, 8), 0).resize((2000, 1600), Image.BICUBIC)
+        png = io.BytesIO()
+        im.save(png, 'PNG')
+        with self.assertRaises(ValueError):
+            hasher.hash_image(Image.open(io.BytesIO(png.getvalue())))
+
+        # The decoder shrinks JPEGs to within the limits.
+        jpeg = io.BytesIO()
+        im.save(jpeg, 'JPEG', quality=95)
+        im_jpeg = Image.open(io.BytesIO(jpeg.getvalue()))
+        hasher.hash_image(im_jpeg)
+        self.assertTrue(im_jpeg.size[0] * im_jpeg.size[1] <= 4 * hasher.max_pixels)
+
+    def test_hash_family(self):
+        stats = sdhash.HashStats()
+        hashers = [
+            sdhash.Hash(dct_core_width=2, dct_coeff_buckets=16, height_buckets=16),
+            sdhash.Hash(dct_core_width=8, digest_format='int', stats=stats),
+            sdhash.Hash(),
+            ]
+        family = sdhash.HashFamily(hashers)
+        frames = [util.build_random_color_image((64, 48), seed) for seed in range(6)]
+        gif = io.BytesIO()
+        frames[0].save(gif, 'GIF', save_all=True, append_images=frames[1:])
+        images = [util.build_random_color_image((200, 150), 1),
+            util.build_random_color_image((300, 90), 2),
+            Image.open(io.BytesIO(gif.getvalue()))]
+
+        for im in images:
+            self.assertEqual(family.hash_image(im), [hasher.hash_image(im) for hasher in hashers])
+        arr = numpy.uint8(numpy.random.RandomState(0).randint(0, 255, (120, 160, 3)))
+        self.assertEqual(family.hash_array(arr), [hasher.hash_array(arr) for hasher in hashers])
+        # The shared work is only counted once, in the stats of the widest DCT.
+        self.assertEqual(stats.snapshot()['counters']['frames_hashed'], 2 * (2 + 2 + 1))
+        self.assertEqual(family.hashers, hashers)
+
+        with self.assertRaises(AssertionError):
+            sdhash.HashFamily([sdhash.Hash(), sdhash.Hash(standard_width=64)])
+
 
 class ImageReal(TableTestCase):
     TEST_CASES = gen_test_data.gen_test_data()
@@ -379,6 +779,19 @@ class ImageReal(TableTestCase):
         self.assertTrue(hasher.test_duplicate(reference, modified),
             msg='Failed on "%s"' % test_case['name'])
 
+    @tabletest.tabletest(TEST_CASES)
+    def test_numpy_backend_matches_fftpack(self, test_case):
+        # The default backend gives the same digests as the one older versions of this library
+        # used, for all the real images and their transforms.
+        for params in [{}, {'dct_core_width': 8, 'dct_coeff_buckets': 256},
+                {'standard_width': 256, 'edge_width': 32}, test_case.get('hasher', {})]:
+            hasher = sdhash.Hash(**params)
+            fftpack_hasher = sdhash.Hash(**dict(hasher.params, dct_backend='fftpack'))
+            for path in [test_case['reference'], test_case['modified']]:
+                im = Image.open(os.path.join('tests', 'data', path))
+                self.assertEqual(hasher.hash_image(im), fftpack_hasher.hash_image(im),
+                    msg='Failed on "%s" with %s' % (path, params))
+
 
 class AnimationReal(TableTestCase):
     pass
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import sdhash
+import sdhash.store
+import tests.util as util
+
+
+class Store(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'hashes.store')
+        self.hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2)
+        self.images = [util.build_random_color_image((32, 32 + 4 * idx), idx) for idx in range(6)]
+        self.digests = [self.hasher.hash_image(im) for im in self.images]
+        self.signatures = numpy.array([self.hasher.signature(im) for im in self.images])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_append_and_load(self):
+        with sdhash.store.StoreWriter(self.path, self.hasher) as writer:
+            writer.append(10, self.digests[0], self.signatures[0])
+            writer.append_many([11, 12], self.digests[1:3], self.signatures[1:3])
+        with sdhash.store.StoreWriter(self.path, sdhash.Hash(**self.hasher.params)) as writer:
+            writer.append_many([13, 14, 15], self.digests[3:], self.signatures[3:])
+
+        store = sdhash.store.Store(self.path)
+
+        self.assertEqual(store.hasher.params, self.hasher.params)
+        self.assertEqual(len(store), 6)
+        self.assertTrue(isinstance(store.signatures, numpy.memmap) or
+            isinstance(store.signatures.base, numpy.memmap))
+        self.assertEqual(list(store.ids), list(range(10, 16)))
+        self.assertEqual([store.hex_digest(row) for row in range(6)], self.digests)
+        self.assertEqual([store.digest(row) for row in range(6)], self.digests)
+        self.assertTrue((store.signatures == self.signatures).all())
+
+    def test_integer_digests(self):
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2,
+            digest_format='int')
+        digests = [hasher.hash_image(im) for im in self.images]
+        with sdhash.store.StoreWriter(self.path, hasher) as writer:
+            writer.append_many(range(6), digests, self.signatures)
+
+        store = sdhash.store.Store(self.path)
+
+        self.assertEqual([store.digest(row) for row in range(6)], digests)
+        self.assertEqual([store.hex_digest(row) for row in range(6)], self.digests)
+
+    def test_load_empty(self):
+        sdhash.store.StoreWriter(self.path, self.hasher).close()
+
+        store = sdhash.store.Store(self.path)
+
+        self.assertEqual(len(store), 0)
+        self.assertEqual(len(store.build_index()), 0)
+
+    def test_partial_record_is_ignored(self):
+        with sdhash.store.StoreWriter(self.path, self.hasher) as writer:
+            writer.append_many(range(6), self.digests, self.signatures)
+        with open(self.path, 'ab') as store_file:
+            store_file.write(b'\1\2\3')
+
+        self.assertEqual(len(sdhash.store.Store(self.path)), 6)
+
+    def test_append_after_partial_record(self):
+        with sdhash.store.StoreWriter(self.path, self.hasher) as writer:
+            writer.append_many(range(3), self.digests[:3], self.signatures[:3])
+        with open(self.path, 'ab') as store_file:
+            store_file.write(b'\1\2\3')
+        with sdhash.store.StoreWriter(self.path, self.hasher) as writer:
+            writer.append_many(range(3, 6), self.digests[3:], self.signatures[3:])
+
+        store = sdhash.store.Store(self.path)
+
+        self.assertEqual(list(store.ids), list(range(6)))
+        self.assertEqual([store.digest(row) for row in range(6)], self.digests)
+        self.assertTrue((store.signatures == self.signatures).all())
+
+    def test_build_index(self):
+        with sdhash.store.StoreWriter(self.path, self.hasher) as writer:
+            writer.append_many(range(100, 106), self.digests, self.signatures)
+
+        index = sdhash.store.Store(self.path).build_index(num_blocks=2)
+
+        self.assertEqual(len(index), 6)
+        self.assertTrue((104, 0) in index.query(self.signatures[4], 0))
+
+    def test_mismatched_params(self):
+        sdhash.store.StoreWriter(self.path, self.hasher).close()
+
+        with self.assertRaises(ValueError):
+            sdhash.store.StoreWriter(self.path, sdhash.Hash(standard_width=32, edge_width=2,
+                dct_core_width=2, dct_coeff_buckets=64))
+
+    def test_params_which_keep_records(self):
+        sdhash.store.StoreWriter(self.path, self.hasher).close()
+        hasher = sdhash.Hash(standard_width=32, edge_width=2, dct_core_width=2,
+            digest_format='bytes', max_decoded_pixels=10 ** 6)
+        digests = [hasher.hash_image(im) for im in self.images]
+
+        with sdhash.store.StoreWriter(self.path, hasher) as writer:
+            writer.append_many(range(6), digests, self.signatures)
+
+        store = sdhash.store.Store(self.path)
+        self.assertEqual(store.hasher.params, self.hasher.params)
+        self.assertEqual([store.digest(row) for row in range(6)], self.digests)
+
+    def test_not_a_store(self):
+        with open(self.path, 'wb') as store_file:
+            store_file.write(b'x' * sdhash.store.HEADER_SIZE)
+
+        with self.assertRaises(ValueError):
+            sdhash.store.Store(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+import numpy
+from PIL import Image
+
+import sdhash
+import sdhash.video
+
+
+# Stands in for ffmpeg: writes its arguments to a file next to it, then the frames it is told to,
+# each of a single gray level, or frames forever.
+_FAKE_FFMPEG = '''#!%s
+import os
+import sys
+
+directory = os.path.dirname(os.path.abspath(__file__))
+with open(os.path.join(directory, 'args.txt'), 'w') as args_file:
+    args_file.write(' '.join(sys.argv[1:]))
+with open(os.path.join(directory, 'frames.txt')) as frames_file:
+    (width, height, num_frames, exit_code) = [int(field) for field in frames_file.read().split()]
+out = getattr(sys.stdout, 'buffer', sys.stdout)
+frame_idx = 0
+try:
+    while num_frames < 0 or frame_idx < num_frames:
+        out.write(bytearray([(frame_idx * 40) %% 256]) * (width * height))
+        out.flush()
+        frame_idx += 1
+except (IOError, OSError):
+    # The reader went away early.
+    pass
+sys.exit(exit_code)
+'''
+
+
+def _build_random_frames(num_frames, size):
+    random = numpy.random.RandomState(0)
+    return [numpy.uint8(random.randint(0, 255, (size[1], size[0], 3)))
+        for _ in range(num_frames)]
+
+
+def _counted(frames, counter):
+    for frame in frames:
+        counter.append(frame.index)
+        yield frame
+
+
+class Sources(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _fake_ffmpeg(self, width, height, num_frames, exit_code=0):
+        ffmpeg_path = os.path.join(self.directory, 'ffmpeg')
+        with open(ffmpeg_path, 'w') as ffmpeg_file:
+            ffmpeg_file.write(_FAKE_FFMPEG % sys.executable)
+        os.chmod(ffmpeg_path, os.stat(ffmpeg_path).st_mode | stat.S_IEXEC)
+        with open(os.path.join(self.directory, 'frames.txt'), 'w') as frames_file:
+            frames_file.write('%d %d %d %d' % (width, height, num_frames, exit_code))
+        return ffmpeg_path
+
+    def test_pil_frames(self):
+        frames = [Image.fromarray(arr) for arr in _build_random_frames(25, (96, 64))]
+        path = os.path.join(self.directory, 'animation.gif')
+        frames[0].save(path, save_all=True, append_images=frames[1:], duration=50)
+        hasher = sdhash.Hash()
+
+        im = Image.open(path)
+        digest = sdhash.video.hash_video(sdhash.video.pil_frames(im), hasher)
+
+        self.assertEqual(im.tell(), 0)
+        self.assertEqual(digest, hasher.hash_image(Image.open(path)))
+        times = [frame.time for frame in sdhash.video.pil_frames(Image.open(path))]
+        self.assertEqual(len(times), 25)
+        self.assertAlmostEqual(times[20], 1.0)
+
+    def test_iter_frames(self):
+        arrays = _build_random_frames(10, (160, 120))
+        hasher = sdhash.Hash()
+
+        digest = sdhash.video.hash_video(sdhash.video.iter_frames(arrays, 25), hasher,
+            sdhash.video.IndexSampler([0, 2, 7]))
+
+        self.assertEqual(digest, hasher.hash_frames([arrays[0], arrays[2], arrays[7]]))
+        self.assertEqual([frame.time for frame in sdhash.video.iter_frames(arrays[:3], 25)],
+            [0.0, 0.04, 0.08])
+
+    def test_ffmpeg_frames(self):
+        ffmpeg_path = self._fake_ffmpeg(160, 120, 6)
+
+        frames = list(sdhash.video.ffmpeg_frames('clip.mp4', frame_rate=2, size=(160, 120),
+            ffmpeg=ffmpeg_path))
+
+        self.assertEqual([frame.index for frame in frames], list(range(6)))
+        self.assertEqual([frame.time for frame in frames], [0.0, 0.5, 1.0, 1.5, 2.0, 2.5])
+        for frame in frames:
+            self.assertEqual(frame.image.shape, (120, 160))
+            self.assertTrue((frame.image == (frame.index * 40) % 256).all())
+        with open(os.path.join(self.directory, 'args.txt')) as args_file:
+            args = args_file.read().split()
+        self.assertEqual(args[args.index('-i') + 1], 'clip.mp4')
+        self.assertEqual(args[args.index('-vf') + 1], 'fps=2')
+        self.assertEqual(args[args.index('-pix_fmt') + 1], 'gray')
+
+    def test_ffmpeg_frames_stops_early(self):
+        ffmpeg_path = self._fake_ffmpeg(160, 120, -1)
+        hasher = sdhash.Hash()
+
+        digest = sdhash.video.hash_video(sdhash.video.ffmpeg_frames('clip.mp4', frame_rate=1,
+            size=(160, 120), ffmpeg=ffmpeg_path), hasher, sdhash.video.TimeSampler(2.0, 2))
+
+        self.assertEqual(digest, hasher.hash_frames(
+            [numpy.full((120, 160), level, dtype=numpy.uint8) for level in [0, 80]]))
+
+    def test_ffmpeg_frames_failure(self):
+        ffmpeg_path = self._fake_ffmpeg(16, 16, 1, exit_code=1)
+
+        with self.assertRaises(RuntimeError):
+            list(sdhash.video.ffmpeg_frames('clip.mp4', frame_rate=1, size=(16, 16),
+                ffmpeg=ffmpeg_path))
+
+
+class Samplers(unittest.TestCase):
+    def test_index_sampler(self):
+        frames = sdhash.video.iter_frames(_build_random_frames(30, (8, 8)), 10)
+        read = []
+
+        picked = list(sdhash.video.IndexSampler([0, 4, 9])(_counted(frames, read)))
+
+        self.assertEqual([frame.index for frame in picked], [0, 4, 9])
+        self.assertEqual(read, list(range(10)))
+
+    def test_time_sampler(self):
+        frames = list(sdhash.video.iter_frames(_build_random_frames(20, (8, 8)), 10))
+
+        self.assertEqual([frame.index for frame in sdhash.video.TimeSampler(0.3)(frames)],
+            [0, 3, 6, 9, 12, 15, 18])
+        self.assertEqual([frame.index for frame in sdhash.video.TimeSampler(0.25)(frames)],
+            [0, 3, 5, 8, 10, 13, 15, 18])
+        self.assertEqual([frame.index for frame in sdhash.video.TimeSampler(0.5, 2)(frames)],
+            [0, 5])
+
+    def test_scene_sampler(self):
+        random = numpy.random.RandomState(0)
+        scenes = [numpy.kron(random.uniform(0, 255, (6, 8)), numpy.ones((15, 15)))
+            for _ in range(3)]
+        arrays = [numpy.clip(scenes[idx // 4] + random.normal(0, 2, (90, 120)), 0, 255)
+            for idx in range(12)]
+        arrays[9] = 255 - arrays[9]
+        frames = list(sdhash.video.iter_frames(arrays, 10))
+
+        self.assertEqual([frame.index for frame in sdhash.video.SceneSampler()(frames)],
+            [0, 4, 8, 9, 10])
+        self.assertEqual([frame.index for frame in
+            sdhash.video.SceneSampler(min_interval=0.3)(frames)], [0, 4, 8])
+        self.assertEqual([frame.index for frame in
+            sdhash.video.SceneSampler(max_frames=2)(frames)], [0, 4])
+
+    def test_no_frames(self):
+        with self.assertRaises(ValueError):
+            sdhash.video.hash_video([], sdhash.Hash(), sdhash.video.TimeSampler(1.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+"""Helpers shared by the tests."""
+
+import numpy
+from PIL import Image
+
+
+def build_random_color_image(size, seed):
+    """Build an RGB image of random noise, with size[0] rows and size[1] columns.
+
+    The noise comes from a generator seeded with seed, so the same arguments always build the
+    same image.
+    """
+    mat = numpy.random.RandomState(seed).randint(0, 255, (size[0], size[1], 3))
+    return Image.fromarray(numpy.uint8(mat), mode='RGB')
+
+
+def build_blocks_image(size, seed):
+    """Build an RGB image of 2x2 blocks of random colors, with size[0] rows and size[1] columns.
+
+    Images built from different seeds differ in their lowest frequencies, so they don't collide
+    even under a hasher with a tiny DCT core.
+    """
+    blocks = numpy.random.RandomState(seed).randint(0, 256, (2, 2, 3))
+    mat = blocks.repeat((size[0] + 1) // 2, axis=0).repeat((size[1] + 1) // 2, axis=1)
+    return Image.fromarray(numpy.uint8(mat[:size[0], :size[1]]), mode='RGB')
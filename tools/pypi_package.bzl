@@ -22,6 +22,7 @@ setup(
     install_requires=[{install_requires}],
     test_suite = "{test_suite}",
     tests_require=[{tests_require}],
+    entry_points={{"console_scripts": [{console_scripts}]}},
     zip_safe=False,
 )
 """
@@ -85,7 +86,7 @@ twine upload dist/* -u $$user -p $$pass
 
 def pypi_package(name, version, description, long_description, classifiers, keywords, url,
                  author, author_email, license, packages, install_requires = [],
-                 test_suite = "nose.collector", tests_require = ["nose"],
+                 test_suite = "nose.collector", tests_require = ["nose"], console_scripts = [],
 		 visibility=["//visibility:public"]):
     """A `pypi_package` is a python package and modulates interaction with the PyPi repository.
 
@@ -119,6 +120,8 @@ def pypi_package(name, version, description, long_description, classifiers, keyw
       test_suite: Name of the test suite runner.
       tests_require: A list of strings or `_pkg` labels which are names of required testing
           packages for this one.
+      console_scripts: A list of strings of the form `name = module:function`, describing the
+          command line programs to install with the package.
       visibility: Rule visibility.
     """
       
@@ -141,7 +144,8 @@ def pypi_package(name, version, description, long_description, classifiers, keyw
 	install_requires = ', '.join(['"%s"' % _translate_package_name(i) for i in install_requires]),
         license = license,
         test_suite = test_suite,
-        tests_require = ', '.join(['"%s"' % _translate_package_name(r) for r in tests_require])
+        tests_require = ', '.join(['"%s"' % _translate_package_name(r) for r in tests_require]),
+        console_scripts = ', '.join(['"%s"' % c for c in console_scripts])
     )
 
     manifest_in = _MANIFEST_IN_TEMPLATE.format(